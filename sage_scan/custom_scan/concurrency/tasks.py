@@ -26,7 +26,7 @@ import time
 import traceback
 from celery import Celery
 from ansible_risk_insight.models import Module as ARIModule
-from ansible_risk_insight.risk_assessment_model import RAMClient
+from sage_scan.process.kb_index import load_kb_client
 
 
 dp = SagePipeline(silent=True)
@@ -53,7 +53,8 @@ if ARI_KB_DATA_DIR.startswith("<PATH"):
     raise ValueError("Please set environment variable `ARI_KB_DATA_DIR` with your KB direcotry")
 
 
-ram_client = RAMClient(root_dir=ARI_KB_DATA_DIR)
+# use the prebuilt index file if `SAGE_KB_INDEX_FILE` is set
+ram_client = load_kb_client(ARI_KB_DATA_DIR)
 
 
 def get_module_name_from_task(task: Task, use_ram=True):
@@ -22,7 +22,7 @@ import time
 import argparse
 from sage_scan.models import Task, Playbook, TaskFile, Project
 from sage_scan.tools.src_rebuilder import write_result, prepare_source_dir
-from ansible_risk_insight.risk_assessment_model import RAMClient
+from sage_scan.process.kb_index import load_kb_client
 from ansible_risk_insight.models import (
     Module as ARIModule,
 )
@@ -35,7 +35,8 @@ if ARI_KB_DIR.startswith("<PATH"):
     raise ValueError("Please set environment variable `ARI_KB_DIR` with your KB direcotry")
 
 
-ram_client = RAMClient(root_dir=ARI_KB_DIR)
+# use the prebuilt index file if `SAGE_KB_INDEX_FILE` is set
+ram_client = load_kb_client(ARI_KB_DIR)
 
 
 def get_module_name_from_task(task: Task, use_ram=True):
@@ -14,11 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, is_dataclass
 from typing import List, Dict
+import os
+import re
+import sys
 import logging
 import json
 import jsonpickle
+import jsonpickle.handlers
+import jsonpickle.unpickler
 from ansible_risk_insight.models import (
     Module as ARIModule,
     Task as ARITask,
@@ -33,13 +38,92 @@ from ansible_risk_insight.models import (
     BecomeInfo,
 )
 from ansible_risk_insight.findings import Findings as ARIFindings
-from ansible_risk_insight.keyutil import get_obj_type, key_delimiter
+from ansible_risk_insight.keyutil import key_delimiter
+from sage_scan.utils import strtobool
 
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+# when the compact mode is on, SageObjects are defined as `__slots__`-backed classes,
+# and objects added to a SageProject share its source record and intern repeated strings
+_compact_objects_feature_env_key = "SAGE_COMPACT_OBJECTS"
+FEATURE_COMPACT_OBJECTS = strtobool(os.getenv(_compact_objects_feature_env_key, "False"))
+
+# `slots` of dataclass is available in Python 3.10 or later; on older versions, the compact mode
+# only shares the source records and interns strings
+_dataclass_slots_available = sys.version_info >= (3, 10)
+if FEATURE_COMPACT_OBJECTS and not _dataclass_slots_available:
+    logger.warning(f"{_compact_objects_feature_env_key} requires Python 3.10 or later for `__slots__`-backed SageObjects; they are defined as normal dataclasses")
+
+sage_object_dataclass = dataclass(slots=True) if FEATURE_COMPACT_OBJECTS and _dataclass_slots_available else dataclass
+
+# string attributes which have the same value in many objects
+interned_attrs = [
+    "type",
+    "filepath",
+    "role",
+    "collection",
+    "module",
+    "executable",
+    "executable_type",
+]
+
+
+# incremented when `include_info` of tasks is updated by include resolution (e.g. KnowledgeBase)
+# call graphs cached in projects are rebuilt if they were built with an older generation
+_include_info_generation = 0
+
+
+def update_include_info_generation():
+    global _include_info_generation
+    _include_info_generation += 1
+    return
+
+
+# attribute mappings between ARI objects and Sage objects
+ari_to_sage_attr_mapping = {
+    "defined_in": "filepath",
+    "path": "filepath",
+    "source": "ari_source",
+}
+
+sage_to_ari_attr_mapping = {
+    "filepath": "defined_in",
+}
+
+sage_to_ari_type_specific_attr_mapping = {
+    "role": {
+        "ari_source": "source",
+    },
+    "collection": {
+        "filepath": "path",
+    }
+}
+
+ari_to_sage_type_mapping = {
+    "repository": "project",
+}
+
+sage_to_ari_type_mapping = {
+    "project": "repository",
+}
+
+# Sage class name (lower case) --> ARI class
+sage_to_ari_cls_mapping = {
+    "module": ARIModule,
+    "task": ARITask,
+    "taskfile": ARITaskFile,
+    "role": ARIRole,
+    "playbook": ARIPlaybook,
+    "play": ARIPlay,
+    "collection": ARICollection,
+    "file": ARIFile,
+    "project": ARIRepository,
+}
+
+
+@sage_object_dataclass
 class SageObject(object):
     type: str = ""
     key: str = ""
@@ -59,81 +143,28 @@ class SageObject(object):
         if not hasattr(ari_obj, "__dict__"):
             return sage_obj
 
-        attr_mapping = {
-            "defined_in": "filepath",
-            "path": "filepath",
-            "source": "ari_source",
-        }
-        for key, val in ari_obj.__dict__.items():
-            attr_name = key
-            if key in attr_mapping:
-                attr_name = attr_mapping[key]
-            
-            if hasattr(sage_obj, attr_name):
-                setattr(sage_obj, attr_name, val)
-
-        type_mapping = {
-            "repository": "project",
-        }
-        if sage_obj.type in type_mapping:
-            sage_obj.type = type_mapping[sage_obj.type]
+        converter = get_from_ari_converter(cls, type(ari_obj))
+        converter(ari_obj, sage_obj)
+
+        if sage_obj.type in ari_to_sage_type_mapping:
+            sage_obj.type = ari_to_sage_type_mapping[sage_obj.type]
 
         sage_obj.set_source(source)
         return sage_obj
     
     @classmethod
     def to_ari_obj(cls, sage_obj):
-        type_str = cls.__name__.lower()
-
-        cls_mapping = {
-            "module": ARIModule,
-            "task": ARITask,
-            "taskfile": ARITaskFile,
-            "role": ARIRole,
-            "playbook": ARIPlaybook,
-            "play": ARIPlay,
-            "collection": ARICollection,
-            "file": ARIFile,
-            "project": ARIRepository,
-        }
-        cls = cls_mapping.get(type_str, None)
-        if not cls:
+        ari_cls = sage_to_ari_cls_mapping.get(cls.__name__.lower(), None)
+        if not ari_cls:
             return None
         
-        ari_obj = cls()
-        if not hasattr(sage_obj, "__dict__"):
-            return ari_obj
+        ari_obj = ari_cls()
 
-        default_attr_mapping = {
-            "filepath": "defined_in",
-        }
-        type_specific_attr_mapping = {
-            "role": {
-                "ari_source": "source",
-            },
-            "collection": {
-                "filepath": "path",
-            }
-        }
-        
-        attr_mapping = default_attr_mapping.copy()
-        if type_str:
-            _attr_mapping = type_specific_attr_mapping.get(type_str, {})
-            attr_mapping.update(_attr_mapping)
-
-        for key, val in sage_obj.__dict__.items():
-            attr_name = key
-            if key in attr_mapping:
-                attr_name = attr_mapping[key]
-            
-            if hasattr(ari_obj, attr_name):
-                setattr(ari_obj, attr_name, val)
-
-        type_mapping = {
-            "project": "repository",
-        }
-        if ari_obj.type in type_mapping:
-            ari_obj.type = type_mapping[ari_obj.type]
+        converter = get_to_ari_converter(cls, ari_cls)
+        converter(sage_obj, ari_obj)
+
+        if ari_obj.type in sage_to_ari_type_mapping:
+            ari_obj.type = sage_to_ari_type_mapping[ari_obj.type]
 
         return ari_obj
     
@@ -155,8 +186,19 @@ class SageObject(object):
             self.annotations.pop(key)
         return
 
+    # point to the shared source record if the source is the same one, and intern repeated strings
+    def compact(self, source: dict=None, source_id: str=""):
+        if source is not None and source_id and self.source_id == source_id:
+            self.source = source
+            self.source_id = source_id
+        for attr in interned_attrs:
+            val = getattr(self, attr, None)
+            if val and isinstance(val, str):
+                setattr(self, attr, sys.intern(val))
+        return
+
 
-@dataclass
+@sage_object_dataclass
 class Module(SageObject):
     type: str = "module"
     key: str = ""
@@ -171,7 +213,22 @@ class Module(SageObject):
     builtin: bool = False
 
 
-@dataclass
+# examples of a module used in a project
+# they are saved once per module instead of being copied to the annotations of each task
+@sage_object_dataclass
+class ModuleExample(SageObject):
+    type: str = "module_example"
+    key: str = ""
+    name: str = ""
+    fqcn: str = ""
+    examples: str = ""
+
+    @classmethod
+    def make_key(cls, fqcn: str):
+        return f"module_example module_example:{fqcn}"
+
+
+@sage_object_dataclass
 class Task(SageObject):
     type: str = "task"
     key: str = ""
@@ -196,6 +253,10 @@ class Task(SageObject):
     executable_type: str = ""
     collections_in_play: list = field(default_factory=list)
 
+    # storage of `yaml_lines`; these must be defined before `yaml_lines` so that __init__() sets them first
+    _yaml_lines: str = field(default="", init=False, repr=False, compare=False)
+    # (file_text, start, end) when `yaml_lines` is a part of the yaml_lines of the parent playbook/taskfile
+    _yaml_lines_ref: tuple = field(default=None, init=False, repr=False, compare=False)
     yaml_lines: str = ""
     line_num_in_file: list = field(default_factory=list)  # [begin, end]
 
@@ -208,8 +269,74 @@ class Task(SageObject):
     module_info: dict = field(default_factory=dict)
     include_info: dict = field(default_factory=dict)
 
+    # point `yaml_lines` to a part of the specified file text instead of holding its own copy
+    # this returns False if the task yaml_lines is not found in the file text
+    def share_yaml_lines(self, file_text: str, line_offsets: list=None):
+        if self._yaml_lines_ref is not None:
+            return True
+        yaml_lines = self._yaml_lines
+        if not yaml_lines or not file_text:
+            return False
+        start = -1
+        if line_offsets and self.line_num_in_file and len(self.line_num_in_file) == 2:
+            begin_line = self.line_num_in_file[0] - 1
+            if 0 <= begin_line < len(line_offsets):
+                start = line_offsets[begin_line]
+        if start < 0 or file_text[start:start + len(yaml_lines)] != yaml_lines:
+            start = file_text.find(yaml_lines)
+        if start < 0:
+            return False
+        self._yaml_lines = ""
+        self._yaml_lines_ref = (file_text, start, start + len(yaml_lines))
+        return True
+
+
+def _get_task_yaml_lines(self):
+    ref = self._yaml_lines_ref
+    if ref is not None:
+        file_text, start, end = ref
+        return file_text[start:end]
+    return self._yaml_lines
+
+
+def _set_task_yaml_lines(self, value):
+    self._yaml_lines = value
+    self._yaml_lines_ref = None
+
+
+# replace the dataclass attribute with a property after the class is created
+# so that `yaml_lines` is materialized only when it is read
+Task.yaml_lines = property(_get_task_yaml_lines, _set_task_yaml_lines)
+
+
+# serialize SageObjects with their fields in the definition order
+# for Task, the storage attributes of `yaml_lines` are omitted and `yaml_lines` is written as a plain string
+class SageObjectHandler(jsonpickle.handlers.BaseHandler):
+    def flatten(self, obj, data):
+        for f in fields(obj):
+            if f.name.startswith("_"):
+                continue
+            data[f.name] = self.context.flatten(getattr(obj, f.name), reset=False)
+        return data
+
+    def restore(self, data):
+        cls = jsonpickle.unpickler.loadclass(data["py/object"])
+        obj = cls()
+        for key, val in data.items():
+            if key.startswith("py/"):
+                continue
+            setattr(obj, key, self.context.restore(val, reset=False))
+        return obj
 
-@dataclass
+
+jsonpickle.handlers.register(Task, SageObjectHandler)
+# in the compact mode, jsonpickle writes slots of the subclass first,
+# so all SageObjects use the handler to keep the same key order as the normal mode
+if FEATURE_COMPACT_OBJECTS:
+    jsonpickle.handlers.register(SageObject, SageObjectHandler, base=True)
+
+
+@sage_object_dataclass
 class TaskFile(SageObject):
     type: str = "taskfile"
     key: str = ""
@@ -225,7 +352,7 @@ class TaskFile(SageObject):
     task_loading: dict = field(default_factory=dict)
 
 
-@dataclass
+@sage_object_dataclass
 class Role(SageObject):
     type: str = "role"
     key: str = ""
@@ -249,7 +376,7 @@ class Role(SageObject):
     options: dict = field(default_factory=dict)
 
 
-@dataclass
+@sage_object_dataclass
 class Playbook(SageObject):
     type: str = "playbook"
     key: str = ""
@@ -263,7 +390,7 @@ class Playbook(SageObject):
     options: dict = field(default_factory=dict)
 
 
-@dataclass
+@sage_object_dataclass
 class Play(SageObject):
     type: str = "play"
     key: str = ""
@@ -290,7 +417,7 @@ class Play(SageObject):
     task_loading: dict = field(default_factory=dict)
 
 
-@dataclass
+@sage_object_dataclass
 class Collection(SageObject):
     type: str = "collection"
     name: str = ""
@@ -309,7 +436,7 @@ class Collection(SageObject):
     options: dict = field(default_factory=dict)
 
 
-@dataclass
+@sage_object_dataclass
 class File(SageObject):
     type: str = "file"
     key: str = ""
@@ -323,7 +450,7 @@ class File(SageObject):
     filepath: str = ""
 
 
-@dataclass
+@sage_object_dataclass
 class Project(SageObject):
     type: str = "project"
     key: str = ""
@@ -350,55 +477,168 @@ class Project(SageObject):
 
     @classmethod
     def from_ari_obj(cls, ari_obj, source: dict={}):
-        instance = super().from_ari_obj(ari_obj, source)
+        # zero-argument super() does not work for classes re-created with `__slots__`
+        instance = super(Project, cls).from_ari_obj(ari_obj, source)
         instance.key = f"project {instance.source_id}"
         return instance
 
 
+ari_to_sage_cls_mapping = {
+    ARIModule: Module,
+    ARITask: Task,
+    ARITaskFile: TaskFile,
+    ARIRole: Role,
+    ARIPlaybook: Playbook,
+    ARIPlay: Play,
+    ARICollection: Collection,
+    ARIFile: File,
+    ARIRepository: Project,
+}
+
+supported_ari_classes = list(ari_to_sage_cls_mapping.keys())
+supported_sage_classes = list(ari_to_sage_cls_mapping.values())
+
+
+# build a function which copies attributes of an ARI object to a Sage object
+# the attribute pairs are computed only once for each pair of classes
+def compile_from_ari_converter(sage_cls, ari_cls):
+    sage_attrs = set([f.name for f in fields(sage_cls)])
+    attr_pairs = []
+    for f in fields(ari_cls):
+        attr_name = ari_to_sage_attr_mapping.get(f.name, f.name)
+        if attr_name in sage_attrs:
+            attr_pairs.append((f.name, attr_name))
+    attr_pairs = tuple(attr_pairs)
+
+    def converter(ari_obj, sage_obj):
+        ari_attrs = ari_obj.__dict__
+        for key, attr_name in attr_pairs:
+            if key in ari_attrs:
+                setattr(sage_obj, attr_name, ari_attrs[key])
+        return
+
+    return converter
+
+
+# build a function which copies attributes of a Sage object to an ARI object
+def compile_to_ari_converter(sage_cls, ari_cls):
+    type_str = sage_cls.__name__.lower()
+    attr_mapping = sage_to_ari_attr_mapping.copy()
+    attr_mapping.update(sage_to_ari_type_specific_attr_mapping.get(type_str, {}))
+
+    ari_attrs = set([f.name for f in fields(ari_cls)])
+    attr_pairs = []
+    for f in fields(sage_cls):
+        attr_name = attr_mapping.get(f.name, f.name)
+        if attr_name in ari_attrs:
+            attr_pairs.append((f.name, attr_name))
+    attr_pairs = tuple(attr_pairs)
+
+    def converter(sage_obj, ari_obj):
+        for key, attr_name in attr_pairs:
+            setattr(ari_obj, attr_name, getattr(sage_obj, key))
+        return
+
+    return converter
+
+
+# copy all attributes in `__dict__` of the ARI object
+# this is used only for ARI objects which are not dataclass instances
+def reflective_from_ari_converter(ari_obj, sage_obj):
+    for key, val in ari_obj.__dict__.items():
+        attr_name = ari_to_sage_attr_mapping.get(key, key)
+        if hasattr(sage_obj, attr_name):
+            setattr(sage_obj, attr_name, val)
+    return
+
+
+_from_ari_converters = {}
+_to_ari_converters = {}
+
+
+def get_from_ari_converter(sage_cls, ari_cls):
+    converter = _from_ari_converters.get((sage_cls, ari_cls), None)
+    if converter:
+        return converter
+    if not is_dataclass(ari_cls):
+        return reflective_from_ari_converter
+    converter = compile_from_ari_converter(sage_cls, ari_cls)
+    _from_ari_converters[(sage_cls, ari_cls)] = converter
+    return converter
+
+
+def get_to_ari_converter(sage_cls, ari_cls):
+    converter = _to_ari_converters.get((sage_cls, ari_cls), None)
+    if converter:
+        return converter
+    converter = compile_to_ari_converter(sage_cls, ari_cls)
+    _to_ari_converters[(sage_cls, ari_cls)] = converter
+    return converter
+
+
+# compile the converters of all supported types at import time
+for _ari_cls, _sage_cls in ari_to_sage_cls_mapping.items():
+    get_from_ari_converter(_sage_cls, _ari_cls)
+    get_to_ari_converter(_sage_cls, _ari_cls)
+
+
+# find a supported class for the type of the object
+# subclasses of the supported classes are resolved by isinstance() once and cached
+def _find_supported_cls(obj, supported_classes: list, cache: dict):
+    obj_cls = type(obj)
+    if obj_cls in cache:
+        return cache[obj_cls]
+    found = None
+    for _cls in supported_classes:
+        if isinstance(obj, _cls):
+            found = _cls
+            break
+    cache[obj_cls] = found
+    return found
+
+
+_supported_ari_cls_cache = {}
+_supported_sage_cls_cache = {}
+
+
 def convert_to_sage_obj(ari_obj, source: dict={}):
-    if isinstance(ari_obj, ARIModule):
-        return Module.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARITask):
-        return Task.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARITaskFile):
-        return TaskFile.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARIRole):
-        return Role.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARIPlaybook):
-        return Playbook.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARIPlay):
-        return Play.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARICollection):
-        return Collection.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARIFile):
-        return File.from_ari_obj(ari_obj, source)
-    elif isinstance(ari_obj, ARIRepository):
-        return Project.from_ari_obj(ari_obj, source)
-    else:
+    ari_cls = _find_supported_cls(ari_obj, supported_ari_classes, _supported_ari_cls_cache)
+    if not ari_cls:
         raise ValueError(f"{type(ari_obj)} is not a supported type for Sage objects")
+    sage_cls = ari_to_sage_cls_mapping[ari_cls]
+    return sage_cls.from_ari_obj(ari_obj, source)
 
 
 def convert_to_ari_obj(sage_obj):
-    if isinstance(sage_obj, Module):
-        return Module.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Task):
-        return Task.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, TaskFile):
-        return TaskFile.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Role):
-        return Role.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Playbook):
-        return Playbook.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Play):
-        return Play.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Collection):
-        return Collection.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, File):
-        return File.to_ari_obj(sage_obj)
-    elif isinstance(sage_obj, Project):
-        return Project.to_ari_obj(sage_obj)
-    else:
+    sage_cls = _find_supported_cls(sage_obj, supported_sage_classes, _supported_sage_cls_cache)
+    if not sage_cls:
         raise ValueError(f"{type(sage_obj)} is not a supported type for ARI objects")
+    return sage_cls.to_ari_obj(sage_obj)
+
+
+# a node on the traversal stack of SageProject._traverse_call_graph()
+@dataclass
+class CallGraphNode(object):
+    obj: SageObject = None
+    children_keys: any = None
+    # list of (obj, child_obj) and nested parts of child subgraphs
+    parts: list = field(default_factory=list)
+    has_cycle: bool = False
+
+
+# convert nested parts of a call graph into a list of (obj, child_obj)
+def flatten_call_graph_parts(parts: list):
+    call_graph = []
+    stack = [iter(parts)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, list):
+                stack.append(iter(item))
+                break
+            call_graph.append(item)
+        else:
+            stack.pop()
+    return call_graph
 
 
 attr_list = [
@@ -411,11 +651,26 @@ attr_list = [
     "taskfiles",
     "tasks",
     "files",
+    "module_examples",
 ]
 
 
 @dataclass
 class SageProject(object):
+    # lookup indexes are kept in slots instead of `__dict__`
+    # so that they are not serialized together with the project
+    __slots__ = (
+        "_key_index",
+        "_filepath_index",
+        "_parent_role_index",
+        "_role_taskfiles_index",
+        "_collection_fqcn_index",
+        "_role_fqcn_index",
+        "_call_graph_engine",
+        "__dict__",
+        "__weakref__",
+    )
+
     source: dict = field(default_factory=dict)
     source_id: str = ""
 
@@ -430,6 +685,7 @@ class SageProject(object):
     taskfiles: list = field(default_factory=list)
     tasks: list = field(default_factory=list)
     files: list = field(default_factory=list)
+    module_examples: list = field(default_factory=list)
 
     path: str = ""
     scan_timestamp: str = ""
@@ -460,6 +716,7 @@ class SageProject(object):
 
         proj.file_inventory = file_inventory
 
+        proj._init_index()
         for obj in objects:
             proj.add_object(obj)
 
@@ -471,67 +728,179 @@ class SageProject(object):
 
         proj.ari_metadata = ari_metadata
         proj.dependencies = dependencies
+        if FEATURE_COMPACT_OBJECTS:
+            proj.share_yaml_lines()
         return proj
     
+    # add examples of modules (FQCN --> examples) which are not in the project yet
+    def set_module_examples(self, examples_map: dict):
+        for fqcn, examples in examples_map.items():
+            key = ModuleExample.make_key(fqcn)
+            if self.get_object(key) is not None:
+                continue
+            obj = ModuleExample(key=key, name=fqcn, fqcn=fqcn, examples=examples, source=self.source, source_id=self.source_id)
+            self.add_object(obj)
+        return
+
+    def get_module_examples(self, fqcn: str):
+        obj = self.get_object(ModuleExample.make_key(fqcn))
+        if obj is None:
+            return ""
+        return obj.examples
+
     def add_object(self, obj: SageObject):
+        if not self._has_index():
+            self._init_index()
         obj_type = obj.type + "s"
         objects_per_type = getattr(self, obj_type, [])
         objects_per_type.append(obj)
         setattr(self, obj_type, objects_per_type)
+        if FEATURE_COMPACT_OBJECTS:
+            obj.compact(source=self.source, source_id=self.source_id)
+        self._add_object_to_index(obj)
+        self.invalidate_call_graphs()
+        return
+
+    # let all objects share the source record of this project and intern their repeated strings
+    # this is done automatically in `add_object()` when the compact mode is on
+    def compact(self):
+        self.source_id = sys.intern(self.source_id)
+        for obj in self.objects():
+            obj.compact(source=self.source, source_id=self.source_id)
+        self.share_yaml_lines()
+        return
+
+    # let tasks point to the yaml_lines of their playbooks/taskfiles instead of holding their own copy
+    def share_yaml_lines(self):
+        line_offsets_per_file = {}
+        for task in self.tasks:
+            if not task.filepath:
+                continue
+            if task.filepath not in line_offsets_per_file:
+                file_text = ""
+                for obj in self.get_objects_by_filepath(task.filepath):
+                    if isinstance(obj, (Playbook, TaskFile)) and obj.yaml_lines:
+                        file_text = obj.yaml_lines
+                        break
+                line_offsets = []
+                offset = 0
+                for line in file_text.splitlines(keepends=True):
+                    line_offsets.append(offset)
+                    offset += len(line)
+                line_offsets_per_file[task.filepath] = (file_text, line_offsets)
+            file_text, line_offsets = line_offsets_per_file[task.filepath]
+            task.share_yaml_lines(file_text, line_offsets)
         return
 
     def get_object(self, key: str=""):
         if key:
-            obj_type = get_obj_type(key) + "s"
-            objects_per_type = getattr(self, obj_type, [])
-            for obj in objects_per_type:
-                if obj.key == key:
-                    return obj
+            if not self._has_index():
+                self._init_index()
+            return self._key_index.get(key, None)
         return None
 
+    # get all objects defined in the specified file
+    # if `obj_type` is given (e.g. "task"), only objects of the type are returned
+    def get_objects_by_filepath(self, filepath: str, obj_type: str=""):
+        if not self._has_index():
+            self._init_index()
+        objects = self._filepath_index.get(filepath, [])
+        if obj_type:
+            return [obj for obj in objects if obj.type == obj_type]
+        return list(objects)
+
+    def get_taskfiles_in_role(self, role: Role):
+        if not self._has_index():
+            self._init_index()
+        if role.key not in self._role_taskfiles_index:
+            taskfiles = []
+            for tf_key in role.taskfiles:
+                taskfile = self.get_object(tf_key)
+                if not isinstance(taskfile, TaskFile):
+                    continue
+                taskfiles.append(taskfile)
+            self._role_taskfiles_index[role.key] = taskfiles
+        return list(self._role_taskfiles_index[role.key])
+
+    def find_parent_role(self, taskfile: TaskFile):
+        if not self._has_index():
+            self._init_index()
+        return self._parent_role_index.get(taskfile.key, None)
+
+    def get_collection_by_fqcn(self, fqcn: str):
+        if not self._has_index():
+            self._init_index()
+        return self._collection_fqcn_index.get(fqcn, None)
+
+    def get_role_by_fqcn(self, fqcn: str):
+        if not self._has_index():
+            self._init_index()
+        return self._role_fqcn_index.get(fqcn, None)
+
+    def _has_index(self):
+        # projects decoded by jsonpickle do not have the indexes until the first lookup
+        return hasattr(self, "_key_index")
+
+    def _init_index(self):
+        self._key_index = {}
+        self._filepath_index = {}
+        self._parent_role_index = {}
+        self._role_taskfiles_index = {}
+        self._collection_fqcn_index = {}
+        self._role_fqcn_index = {}
+        for attr in attr_list:
+            for obj in getattr(self, attr, []):
+                self._add_object_to_index(obj)
+        return
+
+    def _add_object_to_index(self, obj: SageObject):
+        # keep the first object for duplicated keys like the linear search did
+        if obj.key not in self._key_index:
+            self._key_index[obj.key] = obj
+        filepath = getattr(obj, "filepath", "")
+        if filepath:
+            if filepath not in self._filepath_index:
+                self._filepath_index[filepath] = []
+            self._filepath_index[filepath].append(obj)
+        if isinstance(obj, Collection):
+            # `name` of a collection is its FQCN
+            coll_fqcn = getattr(obj, "fqcn", "") or obj.name
+            if coll_fqcn and coll_fqcn not in self._collection_fqcn_index:
+                self._collection_fqcn_index[coll_fqcn] = obj
+        if isinstance(obj, Role):
+            if obj.fqcn not in self._role_fqcn_index:
+                self._role_fqcn_index[obj.fqcn] = obj
+            for tf_key in obj.taskfiles:
+                if tf_key not in self._parent_role_index:
+                    self._parent_role_index[tf_key] = obj
+        if isinstance(obj, (Role, TaskFile)):
+            # taskfile lists per role are resolved lazily, so reset them when a role or a taskfile is added
+            self._role_taskfiles_index = {}
+        return
+
     def get_all_call_sequences(self, follow_include: bool=True):
-        found_taskfile_keys = set()
-        all_call_sequences = []
-        for p in self.playbooks:
-            call_graph = self._get_call_graph(obj=p, follow_include=follow_include)
-            call_seq = self.call_graph2sequence(call_graph)
-            all_call_sequences.append(call_seq)
-            tmp_taskfile_keys = set([obj.key for obj in call_seq if isinstance(obj, TaskFile)])
-            found_taskfile_keys = found_taskfile_keys.union(tmp_taskfile_keys)
-        for r in self.roles:
-            call_graph = self._get_call_graph(obj=r, follow_include=follow_include)
-            call_seq = self.call_graph2sequence(call_graph)
-            all_call_sequences.append(call_seq)
-            tmp_taskfile_keys = set([obj.key for obj in call_seq if isinstance(obj, TaskFile)])
-            found_taskfile_keys = found_taskfile_keys.union(tmp_taskfile_keys)
-        for tf in self.taskfiles:
-            if tf.key in found_taskfile_keys:
-                continue
-            call_graph = self._get_call_graph(obj=tf, follow_include=follow_include)
-            call_seq = self.call_graph2sequence(call_graph)
-            all_call_sequences.append(call_seq)
-        return all_call_sequences
-    
+        all_call_sequences = self._get_call_graph_engine().get_all_call_sequences(follow_include=follow_include)
+        return [list(call_seq) for call_seq in all_call_sequences]
+
     # NOTE: currently this returns only 1 sequence found first
     def get_call_sequence_for_task(self, task: Task, follow_include: bool=True):
-        target_key = task.key
-        all_call_seqs = self.get_all_call_sequences(follow_include=follow_include)
-        found_seq = None
-        for call_seq in all_call_seqs:
-            keys_in_seq = [obj.key for obj in call_seq]
-            if target_key in keys_in_seq:
-                found_seq = call_seq
-                break
-        return found_seq
-    
+        found_seqs = self._get_call_graph_engine().get_call_sequences_for_key(key=task.key, follow_include=follow_include)
+        if not found_seqs:
+            return None
+        return list(found_seqs[0])
+
+    # get all call sequences which contain the specified task
+    def get_call_sequences_for_task(self, task: Task, follow_include: bool=True):
+        found_seqs = self._get_call_graph_engine().get_call_sequences_for_key(key=task.key, follow_include=follow_include)
+        return [list(call_seq) for call_seq in found_seqs]
+
     def get_call_sequence_by_entrypoint(self, entrypoint: Playbook|Role|TaskFile, follow_include: bool=True):
-        call_tree = self.get_call_tree_by_entrypoint(entrypoint=entrypoint, follow_include=follow_include)
-        call_seq = self.call_graph2sequence(call_tree)
-        return call_seq
+        call_seq = self._get_call_graph_engine().get_call_sequence(obj=entrypoint, follow_include=follow_include)
+        return list(call_seq)
 
     def get_call_tree_by_entrypoint(self, entrypoint: Playbook|Role|TaskFile, follow_include: bool=True):
         return self._get_call_graph(obj=entrypoint, follow_include=follow_include)
-    
+
     def call_graph2sequence(self, call_graph: list=[]):
         if not call_graph:
             return []
@@ -540,6 +909,20 @@ class SageProject(object):
             call_seq.append(c_obj)
         return call_seq
 
+    # call graphs are cached in the project, so this must be called
+    # when objects are updated in a way that changes the graphs (e.g. `include_info` of tasks)
+    # updates by KnowledgeBase are detected by `_include_info_generation` without calling this
+    def invalidate_call_graphs(self):
+        self._call_graph_engine = None
+        return
+
+    def _get_call_graph_engine(self):
+        engine = getattr(self, "_call_graph_engine", None)
+        if engine is None or engine.generation != _include_info_generation:
+            engine = CallGraphEngine(project=self, generation=_include_info_generation)
+            self._call_graph_engine = engine
+        return engine
+
     # get call graph which starts from the specified object (e.g. playbook -> play -> task)
     def _get_call_graph(self, obj: SageObject=None, key: str="", follow_include: bool=True):
         if not obj and not key:
@@ -550,8 +933,8 @@ class SageProject(object):
             if not obj:
                 raise ValueError(f"No object found for key `{key}`")
         
-        history = []
-        return self._recursive_get_call_graph(obj=obj, history=history, follow_include=follow_include)
+        call_graph = self._get_call_graph_engine().get_call_graph(obj=obj, follow_include=follow_include)
+        return list(call_graph)
 
 
     def _get_children_keys_for_graph(self, obj, follow_include: bool=True):
@@ -588,30 +971,55 @@ class SageProject(object):
         
         return []
         
-    def _recursive_get_call_graph(self, obj, history=None, follow_include: bool=True):
-        if not history:
-            history = []
-        
-        obj_key = obj.key
-        if obj_key in history:
+    # get call graph by depth-first traversal without recursion
+    # subgraphs which are expanded without any cycle are stored in `subgraph_cache` with a key (obj_key, follow_include),
+    # and they are reused by reference when the same object is included again (e.g. a role used by many plays)
+    def _traverse_call_graph(self, obj, history=None, follow_include: bool=True, subgraph_cache: dict=None):
+        if subgraph_cache is None:
+            subgraph_cache = {}
+
+        ancestor_keys = set(history) if history else set()
+        if obj.key in ancestor_keys:
             return []
-        
-        _history = [h for h in history]
-        _history.append(obj_key)
-
-        call_graph = []
-        children_keys = self._get_children_keys_for_graph(obj=obj, follow_include=follow_include)
-        if children_keys:
-            for c_key in children_keys:
-                c_obj = self.get_object(c_key)
-                if not c_obj:
-                    logger.warn(f"No object found for key `{c_key}`; skip this node")
-                    continue
-                call_graph.append((obj, c_obj))
-                sub_graph = self._recursive_get_call_graph(obj=c_obj, history=_history, follow_include=follow_include)
-                if sub_graph:
-                    call_graph.extend(sub_graph)
-        return call_graph
+
+        cache_key = (obj.key, follow_include)
+        if cache_key in subgraph_cache:
+            return flatten_call_graph_parts(subgraph_cache[cache_key])
+
+        ancestor_keys.add(obj.key)
+        root = CallGraphNode(obj=obj, children_keys=iter(self._get_children_keys_for_graph(obj=obj, follow_include=follow_include)))
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            c_key = next(node.children_keys, None)
+            if c_key is None:
+                stack.pop()
+                ancestor_keys.discard(node.obj.key)
+                # a subgraph cut by a cycle depends on its ancestors, so it is not reusable
+                if not node.has_cycle:
+                    subgraph_cache[(node.obj.key, follow_include)] = node.parts
+                if stack:
+                    parent = stack[-1]
+                    parent.parts.append(node.parts)
+                    parent.has_cycle = parent.has_cycle or node.has_cycle
+                continue
+
+            c_obj = self.get_object(c_key)
+            if not c_obj:
+                logger.warn(f"No object found for key `{c_key}`; skip this node")
+                continue
+            node.parts.append((node.obj, c_obj))
+            if c_obj.key in ancestor_keys:
+                node.has_cycle = True
+                continue
+            cached_parts = subgraph_cache.get((c_obj.key, follow_include), None)
+            if cached_parts is not None:
+                node.parts.append(cached_parts)
+                continue
+            ancestor_keys.add(c_obj.key)
+            children_keys = self._get_children_keys_for_graph(obj=c_obj, follow_include=follow_include)
+            stack.append(CallGraphNode(obj=c_obj, children_keys=iter(children_keys)))
+        return flatten_call_graph_parts(root.parts)
     
     def object_to_key(self):
         
@@ -660,6 +1068,78 @@ class SageProject(object):
         return _objects
 
 
+# builds call graphs in a SageProject and keeps them until the project is updated
+# each entrypoint graph is built only once, and sequences are indexed by the keys of their objects
+@dataclass
+class CallGraphEngine(object):
+    project: SageProject = None
+    # `_include_info_generation` when this engine was created
+    generation: int = 0
+
+    # key: (entrypoint key, follow_include), value: call graph
+    call_graphs: dict = field(default_factory=dict)
+    # key: (object key, follow_include), value: nested parts of the subgraph; shared by all entrypoints
+    subgraph_parts: dict = field(default_factory=dict)
+    # key: (entrypoint key, follow_include), value: call sequence
+    call_sequences: dict = field(default_factory=dict)
+    # key: follow_include, value: list of call sequences of all entrypoints
+    all_call_sequences: dict = field(default_factory=dict)
+    # key: follow_include, value: dict of object key and all call sequences which contain the object
+    sequences_by_key: dict = field(default_factory=dict)
+
+    def get_call_graph(self, obj: SageObject, follow_include: bool=True):
+        cache_key = (obj.key, follow_include)
+        if cache_key not in self.call_graphs:
+            call_graph = self.project._traverse_call_graph(
+                obj=obj,
+                follow_include=follow_include,
+                subgraph_cache=self.subgraph_parts,
+            )
+            self.call_graphs[cache_key] = call_graph
+        return self.call_graphs[cache_key]
+
+    def get_call_sequence(self, obj: SageObject, follow_include: bool=True):
+        cache_key = (obj.key, follow_include)
+        if cache_key not in self.call_sequences:
+            call_graph = self.get_call_graph(obj=obj, follow_include=follow_include)
+            self.call_sequences[cache_key] = self.project.call_graph2sequence(call_graph)
+        return self.call_sequences[cache_key]
+
+    def get_all_call_sequences(self, follow_include: bool=True):
+        if follow_include not in self.all_call_sequences:
+            self._build_all_call_sequences(follow_include=follow_include)
+        return self.all_call_sequences[follow_include]
+
+    def get_call_sequences_for_key(self, key: str, follow_include: bool=True):
+        if follow_include not in self.sequences_by_key:
+            self._build_all_call_sequences(follow_include=follow_include)
+        return self.sequences_by_key[follow_include].get(key, [])
+
+    def _build_all_call_sequences(self, follow_include: bool=True):
+        found_taskfile_keys = set()
+        all_call_sequences = []
+        for obj in self.project.playbooks + self.project.roles:
+            call_seq = self.get_call_sequence(obj=obj, follow_include=follow_include)
+            all_call_sequences.append(call_seq)
+            found_taskfile_keys.update([obj.key for obj in call_seq if isinstance(obj, TaskFile)])
+        for tf in self.project.taskfiles:
+            if tf.key in found_taskfile_keys:
+                continue
+            call_seq = self.get_call_sequence(obj=tf, follow_include=follow_include)
+            all_call_sequences.append(call_seq)
+
+        sequences_by_key = {}
+        for call_seq in all_call_sequences:
+            for key in set([obj.key for obj in call_seq]):
+                if key not in sequences_by_key:
+                    sequences_by_key[key] = []
+                sequences_by_key[key].append(call_seq)
+
+        self.all_call_sequences[follow_include] = all_call_sequences
+        self.sequences_by_key[follow_include] = sequences_by_key
+        return
+
+
 @dataclass
 class SageObjects(object):
     _projects: List[SageProject] = field(default_factory=list)
@@ -690,10 +1170,85 @@ def load_objects(fpath: str) -> SageObjects:
             proj_dict[source_id].add_object(obj)
     
     proj_list = [c for c in proj_dict.values()]
+    if FEATURE_COMPACT_OBJECTS:
+        for proj in proj_list:
+            proj.share_yaml_lines()
     obj = SageObjects(_projects=proj_list)
     return obj
 
 
+# the source_id field of an object line; the value is a JSON string
+source_id_pattern = re.compile(rb'"source_id":\s*("(?:[^"\\]|\\.)*")')
+
+
+# read the source_id of an object line without decoding the whole object
+def get_source_id_from_line(line: bytes) -> str:
+    m = source_id_pattern.search(line)
+    if m is None:
+        return json.loads(line).get("source_id", "")
+    return json.loads(m.group(1))
+
+
+# read an object file and yield (source_id, lines) for each project without decoding the objects
+# the file is read twice; the first pass only finds the byte ranges of each project, and the second pass
+# reads the ranges of one project at a time, so objects of a project are yielded together even if they
+# are not contiguous in the file
+# projects are yielded in the order they first appear in the file
+def iter_project_lines(fpath: str):
+    # source_id --> list of (start, end) byte ranges
+    ranges = {}
+    last_source_id = None
+    with open(fpath, "rb") as file:
+        offset = 0
+        for line in file:
+            start = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            source_id = get_source_id_from_line(line)
+            if source_id == last_source_id:
+                ranges[source_id][-1][1] = offset
+                continue
+            if source_id not in ranges:
+                ranges[source_id] = []
+            ranges[source_id].append([start, offset])
+            last_source_id = source_id
+
+        for source_id, project_ranges in ranges.items():
+            lines = []
+            for start, end in project_ranges:
+                file.seek(start)
+                data = file.read(end - start)
+                # bytes.splitlines() is used because str.splitlines() splits also by characters like "\u2028"
+                lines.extend([line.decode("utf-8") for line in data.splitlines(keepends=True) if line.strip()])
+            yield source_id, lines
+
+
+# decode object lines of a project into SageProject
+def load_project_from_lines(lines: list) -> SageProject:
+    proj = None
+    for line in lines:
+        obj = jsonpickle.decode(line)
+        if not isinstance(obj, SageObject):
+            raise ValueError(f"expected type: SageObject, detected type: {type(obj)}")
+        if proj is None:
+            proj = SageProject(source=obj.source, source_id=obj.source_id)
+        if obj.source_id != proj.source_id:
+            raise ValueError(f"objects of different projects are found: `{proj.source_id}` and `{obj.source_id}`")
+        proj.add_object(obj)
+    if proj is None:
+        proj = SageProject()
+    if FEATURE_COMPACT_OBJECTS:
+        proj.share_yaml_lines()
+    return proj
+
+
+# read an object file and yield SageProject one by one to avoid loading all projects in memory
+def iter_projects(fpath: str):
+    for _, lines in iter_project_lines(fpath):
+        yield load_project_from_lines(lines)
+
+
 def save_objects(fpath: str, sage_objects: SageObjects):
     projects = sage_objects.projects()
     all_objects = []
@@ -742,6 +1297,8 @@ class PlaybookData(object):
     # initialize this with None to clarify whether it is already computed or not
     used_vars: dict = None
     follow_include_for_used_vars: bool = True
+    # cache of variable analysis results; see `VariableAnalysisSession` in variable_container.py
+    variable_analysis: any = field(default=None, repr=False, compare=False)
 
     metrics: DataMetrics = field(default_factory=DataMetrics)
 
@@ -753,24 +1310,16 @@ class PlaybookData(object):
             return
         
         if self.object.collection:
-            for coll in self.project.collections:
-                if coll.fqcn == self.object.collection:
-                    self.collection = coll
-                    break
+            self.collection = self.project.get_collection_by_fqcn(self.object.collection)
 
         if self.object.role:
-            for role in self.project.roles:
-                if role.fqcn == self.object.role:
-                    self.role = role
-                    break
+            self.role = self.project.get_role_by_fqcn(self.object.role)
 
-        call_tree = self.project.get_call_tree_by_entrypoint(self.object)
-        self.call_tree = call_tree
+        # both are cached in the project, so entrypoints sharing subgraphs do not compute them again
+        self.call_tree = self.project.get_call_tree_by_entrypoint(self.object)
+        self.call_seq = self.project.get_call_sequence_by_entrypoint(self.object)
 
-        call_seq = self.project.call_graph2sequence(call_tree)
-        self.call_seq = call_seq
-
-        for obj in call_seq:
+        for obj in self.call_seq:
             if isinstance(obj, Playbook):
                 self.playbooks.append(obj)
             elif isinstance(obj, Play):
@@ -848,6 +1397,8 @@ class TaskFileData(object):
     # initialize this with None to clarify whether it is already computed or not
     used_vars: dict = None
     follow_include_for_used_vars: bool = True
+    # cache of variable analysis results; see `VariableAnalysisSession` in variable_container.py
+    variable_analysis: any = field(default=None, repr=False, compare=False)
 
     metrics: DataMetrics = field(default_factory=DataMetrics)
 
@@ -859,24 +1410,16 @@ class TaskFileData(object):
             return
         
         if self.object.collection:
-            for coll in self.project.collections:
-                if coll.fqcn == self.object.collection:
-                    self.collection = coll
-                    break
+            self.collection = self.project.get_collection_by_fqcn(self.object.collection)
 
         if self.object.role:
-            for role in self.project.roles:
-                if role.fqcn == self.object.role:
-                    self.role = role
-                    break
-
-        call_tree = self.project.get_call_tree_by_entrypoint(self.object)
-        self.call_tree = call_tree
+            self.role = self.project.get_role_by_fqcn(self.object.role)
 
-        call_seq = self.project.call_graph2sequence(call_tree)
-        self.call_seq = call_seq
+        # both are cached in the project, so entrypoints sharing subgraphs do not compute them again
+        self.call_tree = self.project.get_call_tree_by_entrypoint(self.object)
+        self.call_seq = self.project.get_call_sequence_by_entrypoint(self.object)
 
-        for obj in call_seq:
+        for obj in self.call_seq:
             if isinstance(obj, Role):
                 self.roles.append(obj)
             elif isinstance(obj, TaskFile):
@@ -925,3 +1468,23 @@ class TaskFileData(object):
     
     def get_num_of_plays(self):
         return 0
+
+
+# create PlaybookData/TaskFileData for all entrypoints in the project
+# roles are expanded to their taskfiles; the order is the same as `list_entrypoints()`
+def create_entrypoint_data_list(project: SageProject, follow_include_for_used_vars: bool=True):
+    data_list = []
+    for playbook in project.playbooks:
+        data = PlaybookData(object=playbook, project=project, follow_include_for_used_vars=follow_include_for_used_vars)
+        data_list.append(data)
+    for role in project.roles:
+        for taskfile in project.get_taskfiles_in_role(role):
+            data = TaskFileData(object=taskfile, project=project, follow_include_for_used_vars=follow_include_for_used_vars)
+            data_list.append(data)
+    for taskfile in project.taskfiles:
+        # only independent taskfiles; skip taskfiles in role
+        if taskfile.role:
+            continue
+        data = TaskFileData(object=taskfile, project=project, follow_include_for_used_vars=follow_include_for_used_vars)
+        data_list.append(data)
+    return data_list
@@ -0,0 +1,351 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2023 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import hashlib
+import jsonpickle
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+from sage_scan.models import Task
+from sage_scan.process.annotations import (
+    ARGUMENTS_ANNOTATION_KEY,
+    MODULE_REF_ANNOTATION_KEY,
+    VARIABLES_USED_ANNOTATION_KEY,
+    FEATURE_TASK_MODULE_EXAMPLES,
+    ModuleSpec,
+    get_module_digest,
+    get_task_module,
+    set_module_spec_annotations,
+    set_module_arg_annotations,
+    set_variable_annotations,
+)
+from sage_scan.process.knowledge_base import KnowledgeBase
+from sage_scan.process.variable_resolver import VariableHistorySnapshot
+from ansible_risk_insight.risk_assessment_model import RAMClient
+
+
+# the number of worker processes used by the default annotation engine
+SAGE_ANNOTATION_WORKERS = int(os.getenv("SAGE_ANNOTATION_WORKERS", "1"))
+
+# prefix of annotation inputs; other inputs are task attributes like `module_options`
+annotation_input_prefix = "annotations."
+# the content of the task module in the knowledge base; the module reference of a task is only a FQCN,
+# so this is needed to detect updated modules in the knowledge base
+module_spec_input = "knowledge_base.module_spec"
+
+
+# an annotator sets `outputs` annotations to a task by reading `inputs`
+# `func` is called like `func(task, knowledge_base)`, or `func(tasks, knowledge_base)` once for all the tasks
+# to be annotated if `batch` is True
+# `outputs` must be listed in the order the annotator sets them, so that the annotations have the same order
+# when they are set by worker processes
+@dataclass
+class Annotator(object):
+    name: str = ""
+    func: Callable = None
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    batch: bool = False
+
+    def get_input_values(self, task: Task, knowledge_base=None):
+        values = []
+        for input_name in self.inputs:
+            if input_name == module_spec_input:
+                values.append(_get_module_digest(task, knowledge_base))
+            elif input_name.startswith(annotation_input_prefix):
+                value = task.get_annotation(input_name[len(annotation_input_prefix):])
+                if isinstance(value, VariableHistorySnapshot):
+                    # a snapshot can be as large as the whole history, so its digest is used instead of the content;
+                    # tasks sent to worker processes have plain dicts instead, and they are encoded as is
+                    value = ["VariableHistorySnapshot", value.digest()]
+                values.append(value)
+            else:
+                values.append(getattr(task, input_name, None))
+        return values
+
+    # a hash of the input values of the task
+    def get_input_hash(self, task: Task, knowledge_base=None):
+        values = self.get_input_values(task, knowledge_base)
+        data = jsonpickle.encode(values, make_refs=False, unpicklable=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# module specs of the tasks are found in the registry of the knowledge base
+def _get_module_registry(knowledge_base=None):
+    return getattr(knowledge_base, "module_registry", None)
+
+
+def _get_module_digest(task: Task, knowledge_base=None):
+    module = get_task_module(task, _get_module_registry(knowledge_base))
+    if not module:
+        return ""
+    if isinstance(module, ModuleSpec):
+        return module.digest
+    return get_module_digest(module)
+
+
+def _set_module_spec_annotations(task: Task, knowledge_base=None):
+    return set_module_spec_annotations(task, module_registry=_get_module_registry(knowledge_base))
+
+
+# P002/P003 annotations are set to tasks grouped by module, so they are run as one batch annotator
+def _set_module_arg_annotations(tasks: list, knowledge_base=None):
+    return set_module_arg_annotations(tasks, knowledge_base=knowledge_base, module_registry=_get_module_registry(knowledge_base))
+
+
+def _set_variable_annotations(task: Task, knowledge_base=None):
+    return set_variable_annotations(task)
+
+
+module_ref_input = annotation_input_prefix + MODULE_REF_ANNOTATION_KEY
+arguments_input = annotation_input_prefix + ARGUMENTS_ANNOTATION_KEY
+variables_used_input = annotation_input_prefix + VARIABLES_USED_ANNOTATION_KEY
+
+# P001 - P004 rules in ARI
+default_annotators = [
+    Annotator(
+        name="P001",
+        func=_set_module_spec_annotations,
+        inputs=["module", module_ref_input, module_spec_input],
+        outputs=[
+            "module.resolved_fqcn",
+            "module.wrong_module_name",
+            "module.not_exist",
+            "module.correct_fqcn",
+            "module.need_correction",
+        ]
+        + (["module.examples"] if FEATURE_TASK_MODULE_EXAMPLES else []),
+    ),
+    Annotator(
+        name="P002_P003",
+        func=_set_module_arg_annotations,
+        inputs=["executable_type", "module_options", "module_defaults", "loop", module_ref_input, module_spec_input, arguments_input],
+        outputs=[
+            # P002
+            "module.wrong_arg_keys",
+            "module.available_arg_keys",
+            "module.required_arg_keys",
+            "module.missing_required_arg_keys",
+            "module.used_alias_and_real_keys",
+            # P003
+            "module.wrong_arg_values",
+            "module.undefined_values",
+            "module.unknown_type_values",
+        ],
+        batch=True,
+    ),
+    Annotator(
+        name="P004",
+        func=_set_variable_annotations,
+        inputs=["loop", arguments_input, variables_used_input],
+        outputs=[
+            "variable.undefined_vars",
+            "variable.unknown_name_vars",
+            "variable.unnecessary_loop_vars",
+        ],
+    ),
+]
+
+
+# sort annotators so that an annotator comes after the ones which set its inputs
+# annotators which do not depend on each other keep the given order
+def sort_annotators(annotators: list):
+    producers = {}
+    for annotator in annotators:
+        for output in annotator.outputs:
+            producers[annotation_input_prefix + output] = annotator.name
+
+    sorted_annotators = []
+    done = set()
+    remaining = list(annotators)
+    while remaining:
+        next_remaining = []
+        for annotator in remaining:
+            deps = [producers[i] for i in annotator.inputs if i in producers and producers[i] != annotator.name]
+            if all(dep in done for dep in deps):
+                sorted_annotators.append(annotator)
+            else:
+                next_remaining.append(annotator)
+        if len(next_remaining) == len(remaining):
+            names = [annotator.name for annotator in remaining]
+            raise ValueError(f"annotators have a circular dependency: {names}")
+        for annotator in sorted_annotators:
+            done.add(annotator.name)
+        remaining = next_remaining
+    return sorted_annotators
+
+
+# run the annotators for the tasks
+# each annotator is run for all the tasks before the next one, so that a batch annotator gets all of them at once
+# `input_hashes` is a dict of task key --> {annotator name: (input hash, output keys)} of the previous run, and an
+# annotator is skipped for a task if the input hash is the same and the outputs it set are still there
+# (an annotator may set only some of its outputs, e.g. P002/P003 for a module not found in the KB)
+# this returns the outputs and the new input hashes of the tasks
+def run_annotators(annotators: list, tasks: list, knowledge_base=None, input_hashes: dict = None):
+    outputs = [{} for _ in tasks]
+    new_input_hashes = {}
+    if input_hashes is not None:
+        new_input_hashes = {task.key: {} for task in tasks}
+    for annotator in annotators:
+        target_indices = []
+        for i, task in enumerate(tasks):
+            if input_hashes is not None:
+                input_hash = annotator.get_input_hash(task, knowledge_base)
+                prev_hash, prev_output_keys = input_hashes.get(task.key, {}).get(annotator.name, (None, []))
+                if prev_hash == input_hash and all(key in task.annotations for key in prev_output_keys):
+                    new_input_hashes[task.key][annotator.name] = (prev_hash, prev_output_keys)
+                    continue
+                new_input_hashes[task.key][annotator.name] = (input_hash, [])
+            target_indices.append(i)
+        if not target_indices:
+            continue
+        if annotator.batch:
+            annotator.func([tasks[i] for i in target_indices], knowledge_base)
+        else:
+            for i in target_indices:
+                annotator.func(tasks[i], knowledge_base)
+        for i in target_indices:
+            task = tasks[i]
+            task_outputs = {key: task.annotations[key] for key in annotator.outputs if key in task.annotations}
+            outputs[i][annotator.name] = task_outputs
+            if input_hashes is not None:
+                input_hash, _ = new_input_hashes[task.key][annotator.name]
+                new_input_hashes[task.key][annotator.name] = (input_hash, list(task_outputs))
+    return outputs, new_input_hashes
+
+
+# a KB client which is created at the first search
+# RAMClient loads the indices of the KB data dir, so it is not sent to worker processes; a worker creates it
+# only if a search result is not found in the search cache
+@dataclass
+class LazyKBClient(object):
+    root_dir: str = ""
+
+    _kb_client: RAMClient = None
+
+    # RAMClient caches these searches by itself (see `get_client_cached_search_types()`)
+    @property
+    def cached_search_types(self):
+        return ["module", "role", "taskfile"]
+
+    def get_kb_client(self):
+        if self._kb_client is None:
+            self._kb_client = RAMClient(root_dir=self.root_dir)
+        return self._kb_client
+
+    def search_module(self, name, used_in=""):
+        return self.get_kb_client().search_module(name=name, used_in=used_in)
+
+    def search_role(self, name, used_in=""):
+        return self.get_kb_client().search_role(name=name, used_in=used_in)
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        return self.get_kb_client().search_taskfile(name=name, is_key=is_key, used_in=used_in)
+
+    def search_action_group(self, name, max_match=-1):
+        return self.get_kb_client().search_action_group(name, max_match=max_match)
+
+
+# knowledge base for annotators in a worker process
+_worker_knowledge_base = None
+
+
+# return the parts of the knowledge base which annotators use: the module registry, the search cache
+# and a KB client; they are pickled for each worker process, so RAMClient is replaced with LazyKBClient
+# (KBIndex is pickled as its file path)
+def get_worker_args(knowledge_base):
+    if knowledge_base is None:
+        return (None, None, None)
+    kb_client = knowledge_base.kb_client
+    if isinstance(kb_client, RAMClient):
+        kb_client = LazyKBClient(root_dir=kb_client.root_dir)
+    return (kb_client, knowledge_base.search_cache, knowledge_base.module_registry)
+
+
+def _init_worker(kb_client, search_cache, module_registry):
+    global _worker_knowledge_base
+    if kb_client is None:
+        _worker_knowledge_base = None
+        return
+    _worker_knowledge_base = KnowledgeBase(kb_client=kb_client, search_cache=search_cache, module_registry=module_registry)
+    return
+
+
+def _run_annotators_in_worker(annotators: list, tasks: list, input_hashes: dict = None):
+    return run_annotators(annotators, tasks, _worker_knowledge_base, input_hashes)
+
+
+# split tasks into shards by file; tasks in the same file are annotated by the same worker
+def shard_tasks_by_file(tasks: list, num_of_shards: int):
+    tasks_by_file = {}
+    for task in tasks:
+        filepath = task.filepath
+        if filepath not in tasks_by_file:
+            tasks_by_file[filepath] = []
+        tasks_by_file[filepath].append(task)
+    shards = [[] for _ in range(max(num_of_shards, 1))]
+    # put larger files first to balance the shards
+    for file_tasks in sorted(tasks_by_file.values(), key=len, reverse=True):
+        smallest = min(shards, key=len)
+        smallest.extend(file_tasks)
+    return [shard for shard in shards if shard]
+
+
+# runs annotators for tasks, in parallel by worker processes if `workers` > 1
+# if `skip_unchanged` is True, the input hashes of the tasks are kept in this engine and the annotators whose
+# inputs are not changed since the last run are skipped
+@dataclass
+class AnnotationEngine(object):
+    annotators: list = field(default_factory=lambda: list(default_annotators))
+    workers: int = SAGE_ANNOTATION_WORKERS
+    skip_unchanged: bool = False
+
+    # task key --> {annotator name: (input hash, output keys)}
+    input_hashes: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.annotators = sort_annotators(self.annotators)
+
+    def annotate(self, tasks: list, knowledge_base=None):
+        input_hashes = self.input_hashes if self.skip_unchanged else None
+        if self.workers <= 1 or len(tasks) <= 1:
+            _, new_input_hashes = run_annotators(self.annotators, tasks, knowledge_base, input_hashes)
+        else:
+            new_input_hashes = self._annotate_in_parallel(tasks, knowledge_base, input_hashes)
+        if self.skip_unchanged:
+            self.input_hashes.update(new_input_hashes)
+        return tasks
+
+    def _annotate_in_parallel(self, tasks: list, knowledge_base, input_hashes: dict):
+        shards = shard_tasks_by_file(tasks, self.workers)
+        new_input_hashes = {}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=get_worker_args(knowledge_base)) as executor:
+            futures = []
+            for shard in shards:
+                shard_hashes = None
+                if input_hashes is not None:
+                    shard_hashes = {task.key: input_hashes[task.key] for task in shard if task.key in input_hashes}
+                futures.append(executor.submit(_run_annotators_in_worker, self.annotators, shard, shard_hashes))
+            for shard, future in zip(shards, futures):
+                outputs, shard_new_hashes = future.result()
+                # set the annotations to the original tasks in the annotator order
+                for task, task_outputs in zip(shard, outputs):
+                    for annotator in self.annotators:
+                        for key, value in task_outputs.get(annotator.name, {}).items():
+                            task.set_annotation(key, value)
+                new_input_hashes.update(shard_new_hashes)
+        return new_input_hashes
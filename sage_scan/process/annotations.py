@@ -14,6 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import hashlib
+import jsonpickle
+from dataclasses import dataclass, field
+from sage_scan.utils import strtobool
 from sage_scan.models import (
     Task,
     Module,
@@ -30,16 +35,187 @@ ARGUMENTS_ANNOTATION_KEY = "arguments"
 VARIABLES_SET_ANNOTATION_KEY = "variables_set"
 VARIABLES_USED_ANNOTATION_KEY = "variables_used"
 MODULE_OBJECT_ANNOTATION_KEY = "module_object"
+MODULE_REF_ANNOTATION_KEY = "module_ref"
+LOOP_SUMMARY_ANNOTATION_KEY = "loop_summary"
+
+# if True, P001 copies module examples to the `module.examples` annotation of each task
+# otherwise they are kept once per module in ModuleSpecRegistry and saved as ModuleExample objects of the project
+_task_module_examples_feature_env_key = "SAGE_TASK_MODULE_EXAMPLES"
+FEATURE_TASK_MODULE_EXAMPLES = strtobool(os.getenv(_task_module_examples_feature_env_key, "False"))
+
+
+# return a function which checks if an actual value type is wrong for the argument spec
+def make_arg_type_checker(arg_spec):
+    def is_wrong_type(actual_type: str):
+        type_wrong = False
+        if arg_spec.type != "any" and actual_type != arg_spec.type:
+            type_wrong = True
+        elements_type_wrong = False
+        no_elements = False
+        if arg_spec.elements:
+            if arg_spec.elements != "any" and actual_type != arg_spec.elements:
+                elements_type_wrong = True
+        else:
+            no_elements = True
+        return type_wrong and (elements_type_wrong or no_elements)
+
+    return is_wrong_type
+
+
+# argument specs of a module compiled for P002/P003 checks
+@dataclass
+class ModuleArgSpec(object):
+    fqcn: str = ""
+    arguments: list = field(default_factory=list)
+
+    available_keys: list = field(default_factory=list)
+    available_key_set: set = field(default_factory=set)
+    required_keys: list = field(default_factory=list)
+    alias_reverse_map: dict = field(default_factory=dict)
+    # argument name or alias --> the first argument spec which has it
+    arg_spec_map: dict = field(default_factory=dict)
+    # argument name or alias --> type checker of the argument spec
+    type_checkers: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_module(cls, module: Module):
+        spec = cls(fqcn=module.fqcn, arguments=module.arguments)
+        for arg in module.arguments:
+            spec.available_keys.extend(arg.available_keys())
+            if arg.required:
+                aliases = arg.aliases if arg.aliases else []
+                req_k = {"key": arg.name, "aliases": aliases}
+                spec.required_keys.append(req_k)
+            if arg.aliases:
+                for al in arg.aliases:
+                    spec.alias_reverse_map[al] = arg.name
+            checker = None
+            for key in [arg.name] + (list(arg.aliases) if arg.aliases else []):
+                if key in spec.arg_spec_map:
+                    continue
+                if checker is None:
+                    checker = make_arg_type_checker(arg)
+                spec.arg_spec_map[key] = arg
+                spec.type_checkers[key] = checker
+        spec.available_key_set = set(spec.available_keys)
+        return spec
+
+    def get_arg_spec(self, key: str):
+        return self.arg_spec_map.get(key, None)
+
+    # return wrong keys and missing required keys in the used keys
+    def check_keys(self, used_keys: list, default_args: dict):
+        wrong_keys = [key for key in used_keys if key not in self.available_key_set]
+
+        used_key_set = set(used_keys)
+        missing_required_keys = []
+        for k in self.required_keys:
+            name = k.get("key", "")
+            aliases = k.get("aliases", [])
+            if name in used_key_set:
+                continue
+            if name in default_args:
+                continue
+            if aliases:
+                found = False
+                for a_k in aliases:
+                    if a_k in used_key_set:
+                        found = True
+                        break
+                    if a_k in default_args:
+                        found = True
+                        break
+                if found:
+                    continue
+            # here, the required key was not found
+            missing_required_keys.append(name)
+        return wrong_keys, missing_required_keys
+
+
+# module FQCN --> ModuleArgSpec
+_module_arg_spec_cache = {}
+
+
+# return the compiled argument specs of the module
+# the cache is keyed by FQCN, and it is updated if the module has different arguments from the cached one
+def get_module_arg_spec(module: Module):
+    spec = _module_arg_spec_cache.get(module.fqcn, None)
+    if spec is not None:
+        if spec.arguments is module.arguments or spec.arguments == module.arguments:
+            return spec
+    spec = ModuleArgSpec.from_module(module)
+    _module_arg_spec_cache[module.fqcn] = spec
+    return spec
+
+
+# a hash of the module content which the annotators use
+def get_module_digest(module: Module):
+    data = jsonpickle.encode([module.fqcn, module.examples, module.arguments], make_refs=False, unpicklable=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# the part of a module which the annotators use; documentation is not kept
+@dataclass
+class ModuleSpec(object):
+    fqcn: str = ""
+    examples: str = ""
+    arguments: list = field(default_factory=list)
+    # changes when the module is updated in the KB even if the FQCN is the same
+    digest: str = field(default="", compare=False)
+
+    @classmethod
+    def from_module(cls, module: Module):
+        spec = cls(fqcn=module.fqcn, examples=module.examples, arguments=module.arguments)
+        spec.digest = get_module_digest(spec)
+        return spec
+
+
+# module specs interned by FQCN
+# tasks keep only the FQCN under MODULE_REF_ANNOTATION_KEY, and annotators look up the spec here
+@dataclass
+class ModuleSpecRegistry(object):
+    specs: dict = field(default_factory=dict)
+
+    # register the module if the FQCN is new, and return the FQCN as a reference
+    def register(self, module: Module):
+        fqcn = module.fqcn
+        if fqcn not in self.specs:
+            self.specs[fqcn] = ModuleSpec.from_module(module)
+        return fqcn
+
+    def get(self, fqcn: str):
+        return self.specs.get(fqcn, None)
+
+    def get_examples(self, fqcn: str):
+        spec = self.get(fqcn)
+        return spec.examples if spec else ""
+
+    # FQCN --> examples of all the registered modules
+    def examples_map(self):
+        return {fqcn: spec.examples for fqcn, spec in self.specs.items()}
+
+
+# return the module of the task
+# the module reference is looked up in the registry if given, or in the registry of the knowledge base;
+# otherwise the module object annotation is used
+def get_task_module(task: Task, module_registry: ModuleSpecRegistry = None, knowledge_base=None):
+    if module_registry is None:
+        module_registry = getattr(knowledge_base, "module_registry", None)
+    if module_registry is not None:
+        fqcn = task.get_annotation(MODULE_REF_ANNOTATION_KEY, None)
+        if fqcn is not None:
+            return module_registry.get(fqcn)
+    return task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY)
 
 
 # P001 rule in ARI
-def set_module_spec_annotations(task: Task):
+def set_module_spec_annotations(task: Task, module_registry: ModuleSpecRegistry = None):
     resolved_fqcn = ""
     wrong_module_name = ""
     not_exist = False
     correct_fqcn = ""
     need_correction = False
-    module = task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY)
+    module = get_task_module(task, module_registry)
     if module:
         resolved_fqcn = module.fqcn
         correct_fqcn = module.fqcn
@@ -59,13 +235,14 @@ def set_module_spec_annotations(task: Task):
     task.set_annotation("module.not_exist", not_exist)
     task.set_annotation("module.correct_fqcn", correct_fqcn)
     task.set_annotation("module.need_correction", need_correction)
-    task.set_annotation("module.examples", module_examples)
+    if FEATURE_TASK_MODULE_EXAMPLES:
+        task.set_annotation("module.examples", module_examples)
     return task
 
 
 # P002 rule in ARI
-def set_module_arg_key_annotations(task: Task, knowledge_base=None):
-    module = task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY)
+def set_module_arg_key_annotations(task: Task, knowledge_base=None, arg_spec: ModuleArgSpec = None, module_registry: ModuleSpecRegistry = None):
+    module = get_task_module(task, module_registry, knowledge_base)
     if task.executable_type == ExecutableType.MODULE_TYPE and module and module.arguments:
         mo = task.module_options
         module_fqcn = module.fqcn
@@ -88,7 +265,7 @@ def set_module_arg_key_annotations(task: Task, knowledge_base=None):
                 if not group_name.startswith("group/"):
                     continue
                 if knowledge_base:
-                    groups = knowledge_base.kb_client.search_action_group(group_name)
+                    groups = knowledge_base.search_action_group(group_name)
                     if not groups:
                         continue
                     for group_dict in groups:
@@ -115,44 +292,15 @@ def set_module_arg_key_annotations(task: Task, knowledge_base=None):
         available_keys = []
         required_keys = []
         alias_reverse_map = {}
-        available_args = None
         wrong_keys = []
         missing_required_keys = []
         if not is_set_fact(module_fqcn):
-            if module:
-                for arg in module.arguments:
-                    available_keys.extend(arg.available_keys())
-                    if arg.required:
-                        aliases = arg.aliases if arg.aliases else []
-                        req_k = {"key": arg.name, "aliases": aliases}
-                        required_keys.append(req_k)
-                    if arg.aliases:
-                        for al in arg.aliases:
-                            alias_reverse_map[al] = arg.name
-                available_args = module.arguments
-
-            wrong_keys = [key for key in used_keys if key not in available_keys]
-
-            for k in required_keys:
-                name = k.get("key", "")
-                aliases = k.get("aliases", [])
-                if name in used_keys:
-                    continue
-                if name in default_args:
-                    continue
-                if aliases:
-                    found = False
-                    for a_k in aliases:
-                        if a_k in used_keys:
-                            found = True
-                            break
-                        if a_k in default_args:
-                            found = True
-                            break
-                    if found:
-                        continue
-                # here, the required key was not found
-                missing_required_keys.append(name)
+            if arg_spec is None:
+                arg_spec = get_module_arg_spec(module)
+            available_keys = list(arg_spec.available_keys)
+            required_keys = list(arg_spec.required_keys)
+            alias_reverse_map = arg_spec.alias_reverse_map
+            wrong_keys, missing_required_keys = arg_spec.check_keys(used_keys, default_args)
 
         used_alias_and_real_keys = []
         for k in used_keys:
@@ -177,25 +325,23 @@ def set_module_arg_key_annotations(task: Task, knowledge_base=None):
 
 
 # P003 rule in ARI
-def set_module_arg_value_annotations(task: Task):
-    module = task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY)
+def set_module_arg_value_annotations(task: Task, arg_spec: ModuleArgSpec = None, module_registry: ModuleSpecRegistry = None):
+    module = get_task_module(task, module_registry)
     if task.executable_type == ExecutableType.MODULE_TYPE and module and module.arguments:
         wrong_values = []
         undefined_values = []
         unknown_type_values = []
         module_options = task.module_options
         arguments = task.get_annotation(ARGUMENTS_ANNOTATION_KEY)
+        if arg_spec is None:
+            arg_spec = get_module_arg_spec(module)
         if isinstance(module_options, dict):
             for key in module_options:
                 raw_value = module_options[key]
                 resolved_value = None
                 if arguments and len(arguments.templated) >= 1:
                     resolved_value = arguments.templated[0][key]
-                spec = None
-                for arg_spec in module.arguments:
-                    if key == arg_spec.name or (arg_spec.aliases and key in arg_spec.aliases):
-                        spec = arg_spec
-                        break
+                spec = arg_spec.get_arg_spec(key)
                 if not spec:
                     continue
 
@@ -227,17 +373,7 @@ def set_module_arg_value_annotations(task: Task):
                             actual_type = type(resolved_value).__name__
 
                     if actual_type:
-                        type_wrong = False
-                        if spec.type != "any" and actual_type != spec.type:
-                            type_wrong = True
-                        elements_type_wrong = False
-                        no_elements = False
-                        if spec.elements:
-                            if spec.elements != "any" and actual_type != spec.elements:
-                                elements_type_wrong = True
-                        else:
-                            no_elements = True
-                        if type_wrong and (elements_type_wrong or no_elements):
+                        if arg_spec.type_checkers[key](actual_type):
                             d["expected_type"] = spec.type
                             d["actual_type"] = actual_type
                             d["actual_value"] = raw_value
@@ -267,6 +403,30 @@ def set_module_arg_value_annotations(task: Task):
     return task
 
 
+# set P002/P003 annotations to the tasks grouped by module
+# the compiled argument specs are looked up once for each module
+def set_module_arg_annotations(tasks: list, knowledge_base=None, module_registry: ModuleSpecRegistry = None):
+    if module_registry is None:
+        module_registry = getattr(knowledge_base, "module_registry", None)
+    tasks_by_module = {}
+    for task in tasks:
+        module = get_task_module(task, module_registry)
+        fqcn = module.fqcn if module else ""
+        if fqcn not in tasks_by_module:
+            tasks_by_module[fqcn] = []
+        tasks_by_module[fqcn].append(task)
+    for module_tasks in tasks_by_module.values():
+        arg_spec = None
+        for task in module_tasks:
+            module = get_task_module(task, module_registry)
+            if module and (arg_spec is None or arg_spec.arguments is not module.arguments):
+                arg_spec = get_module_arg_spec(module)
+            _arg_spec = arg_spec if module else None
+            set_module_arg_key_annotations(task, knowledge_base=knowledge_base, arg_spec=_arg_spec, module_registry=module_registry)
+            set_module_arg_value_annotations(task, arg_spec=_arg_spec, module_registry=module_registry)
+    return tasks
+
+
 # P004 rule in ARI
 def set_variable_annotations(task: Task):
     undefined_variables = []
@@ -299,6 +459,7 @@ def set_variable_annotations(task: Task):
 # remove temporary annotations (to remove large object data)
 def omit_object_annotations(task: Task):
     task.delete_annotation(MODULE_OBJECT_ANNOTATION_KEY)
+    task.delete_annotation(MODULE_REF_ANNOTATION_KEY)
     task.delete_annotation(ARGUMENTS_ANNOTATION_KEY)
     return task
 
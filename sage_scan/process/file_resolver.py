@@ -15,28 +15,61 @@ class FileCont:
     current_filepath: str = ""
     used_file: str = ""
     file_obj: File = field(default_factory=File)
+    # files tried in order for `with_first_found` or a list in `vars_files`;
+    # `used_file` is set to the first one found in the project, and it keeps the raw value if none is found
+    candidates: list = field(default_factory=list)
 
     def resolve_file(self):
         return
 
 
-# retrieve file obj from used_file path
-def find_file_obj(fc_list: List[FileCont], objects):
-    if not fc_list:
-        return
+# normalized filepath --> File object in a project
+# this is built once for the project files, and then a file reference is resolved by a single lookup
+@dataclass
+class FileIndex:
+    files: dict = field(default_factory=dict)
 
-    for i, fc in enumerate(fc_list):
-        found = False
+    @classmethod
+    def from_objects(cls, objects):
+        index = cls()
         for obj in objects:
             if not isinstance(obj, File):
                 continue
-            current_dir = os.path.dirname(fc.current_filepath)
-            relative_path = os.path.relpath(obj.filepath, current_dir)
-            norm_used_file = os.path.normpath(fc.used_file)
-            if norm_used_file == relative_path:
-                fc_list[i].file_obj = obj
-                found = True
-            if found:
+            if not obj.filepath:
+                continue
+            key = os.path.normpath(obj.filepath)
+            # the first file object is used if there are duplicates
+            if key not in index.files:
+                index.files[key] = obj
+        return index
+
+    # return the file object referred as `used_file` from `current_filepath`, or None if not found
+    def find(self, used_file: str, current_filepath: str):
+        if not used_file or not isinstance(used_file, str):
+            return None
+        if os.path.isabs(used_file):
+            return None
+        current_dir = os.path.dirname(current_filepath)
+        key = os.path.normpath(os.path.join(current_dir, used_file))
+        return self.files.get(key, None)
+
+
+# retrieve file obj from used_file path
+# if `file_index` is not given, it is built from the objects
+def find_file_obj(fc_list: List[FileCont], objects, file_index: FileIndex = None):
+    if not fc_list:
+        return
+
+    if file_index is None:
+        file_index = FileIndex.from_objects(objects)
+
+    for fc in fc_list:
+        used_files = fc.candidates if fc.candidates else [fc.used_file]
+        for used_file in used_files:
+            file_obj = file_index.find(used_file, fc.current_filepath)
+            if file_obj is not None:
+                fc.used_file = used_file
+                fc.file_obj = file_obj
                 break
     return
 
@@ -48,7 +81,8 @@ def to_fc_list(obj):
         fc_list = get_fc_list_from_play(obj)
     elif isinstance(obj, Task):
         fc = get_fc_from_task(obj)
-        fc_list = [fc]
+        if fc:
+            fc_list = [fc]
     return fc_list
 
 
@@ -61,10 +95,40 @@ def get_fc_list_from_play(obj: Play):
             fc.obj_key = obj.key
             fc.current_filepath = obj.filepath
             fc.used_file = var_file
+            # a list in `vars_files` means the first found file in the list
+            if isinstance(var_file, list):
+                fc.candidates = [f for f in var_file if isinstance(f, str)]
             fc_list.append(fc)
     return fc_list
 
 
+# return candidate files of `with_first_found`
+# the items are file paths or dicts with `files` and `paths` like the `first_found` lookup
+def get_first_found_candidates(first_found):
+    candidates = []
+    items = first_found if isinstance(first_found, list) else [first_found]
+    for item in items:
+        if isinstance(item, str):
+            candidates.append(item)
+        elif isinstance(item, dict):
+            files = item.get("files", [])
+            paths = item.get("paths", [])
+            if isinstance(files, str):
+                files = [files]
+            if isinstance(paths, str):
+                paths = [paths]
+            for f in files:
+                if not isinstance(f, str):
+                    continue
+                if paths:
+                    for p in paths:
+                        if isinstance(p, str):
+                            candidates.append(os.path.join(p, f))
+                else:
+                    candidates.append(f)
+    return candidates
+
+
 # return fc from task obj
 def get_fc_from_task(obj: Task):
     fc = None
@@ -79,30 +143,34 @@ def get_fc_from_task(obj: Task):
             if "file" in mo:
                 fc.used_file = mo["file"]
             # TODO: support other args
+        if isinstance(obj.options, dict) and "with_first_found" in obj.options:
+            fc.candidates = get_first_found_candidates(obj.options["with_first_found"])
     return fc
 
 
 # return fc list with file obj
-def resolve_file(obj, file_objects):
+def resolve_file(obj, file_objects, file_index: FileIndex = None):
     fc_list = to_fc_list(obj)
     if not fc_list:
         return None
-    find_file_obj(fc_list, file_objects)
+    find_file_obj(fc_list, file_objects, file_index)
     return fc_list
 
 
 # return obj and fc list pairs in call_seq
-def resolve_files_for_object_data(pd: PlaybookData | TaskFileData):
+def resolve_files_for_object_data(pd: PlaybookData | TaskFileData, file_index: FileIndex = None):
     call_seq = []
     file_objects = []
     if pd:
         call_seq = pd.call_seq
         file_objects = pd.project.files
+    if file_index is None:
+        file_index = FileIndex.from_objects(file_objects)
     obj_fc_list_pairs = []
     for obj in call_seq:
         if not obj:
             continue
-        fc_list = resolve_file(obj, file_objects)
+        fc_list = resolve_file(obj, file_objects, file_index)
         if not fc_list:
             continue
         obj_fc_list_pairs.append((obj, fc_list))
@@ -123,9 +191,10 @@ def main():
     results = []
     for project in projects:
         file_objs = project.files
+        file_index = FileIndex.from_objects(file_objs)
         tasks = project.tasks
         for task in tasks:
-            fc_list = resolve_file(task, file_objs)
+            fc_list = resolve_file(task, file_objs, file_index)
             if fc_list:
                 for fc in fc_list:
                     results.append(jsonpickle.encode(fc, make_refs=False) + "\n")
@@ -0,0 +1,311 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2023 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import mmap
+import struct
+import argparse
+from dataclasses import dataclass, field
+from ansible_risk_insight.models import (
+    Module as ARIModule,
+    ModuleArgument,
+    Role as ARIRole,
+    TaskFile as ARITaskFile,
+)
+from ansible_risk_insight.model_loader import load_builtin_modules
+from ansible_risk_insight.risk_assessment_model import RAMClient
+
+
+# if specified, KB searches use this prebuilt index file instead of the KB data dir
+SAGE_KB_INDEX_FILE = os.getenv("SAGE_KB_INDEX_FILE", None)
+
+# the index file layout:
+#   header:   magic (8 bytes) + (table offset, number of entries) for each section
+#   tables:   (key offset, key length, value offset, value length) for each entry, sorted by the key
+#   data:     utf-8 keys and json-encoded values
+# a lookup is a binary search over the table in the mmap-ed file, so loading the file does not read
+# any entries and the pages are shared by all the processes which map the same file
+kb_index_magic = b"SAGEKBI1"
+kb_index_sections = ["modules", "module_fallbacks", "roles", "taskfiles", "action_groups"]
+kb_index_header_format = "<8s" + "QQ" * len(kb_index_sections)
+kb_index_entry_format = "<QIQI"
+kb_index_header_size = struct.calcsize(kb_index_header_format)
+kb_index_entry_size = struct.calcsize(kb_index_entry_format)
+
+
+# summary of a module which has what the annotations use
+def make_module_summary(module: ARIModule):
+    arguments = []
+    for arg in module.arguments:
+        arguments.append(
+            {
+                "name": arg.name,
+                "type": arg.type,
+                "elements": arg.elements,
+                "default": arg.default,
+                "required": arg.required,
+                "choices": arg.choices,
+                "aliases": arg.aliases,
+            }
+        )
+    return {
+        "name": module.name,
+        "fqcn": module.fqcn,
+        "key": module.key,
+        "collection": module.collection,
+        "role": module.role,
+        "examples": module.examples,
+        "builtin": module.builtin,
+        "arguments": arguments,
+    }
+
+
+def module_from_summary(summary: dict):
+    arguments = [ModuleArgument(**arg) for arg in summary.get("arguments", [])]
+    return ARIModule(
+        name=summary.get("name", ""),
+        fqcn=summary.get("fqcn", ""),
+        key=summary.get("key", ""),
+        collection=summary.get("collection", ""),
+        role=summary.get("role", ""),
+        examples=summary.get("examples", ""),
+        builtin=summary.get("builtin", False),
+        arguments=arguments,
+    )
+
+
+# return the first object found by a RAMClient search
+def _get_first_object(result):
+    if not result or not isinstance(result, list) or not isinstance(result[0], dict):
+        return None
+    return result[0].get("object", None)
+
+
+# search all the entries in the KB data dir with RAMClient and collect them into sections
+def collect_kb_index_sections(kb_dir: str):
+    ram_client = RAMClient(root_dir=kb_dir)
+    sections = {name: {} for name in kb_index_sections}
+
+    module_names = set()
+    for short_name in load_builtin_modules():
+        module_names.add(short_name)
+        module_names.add(f"ansible.builtin.{short_name}")
+    for short_name, candidates in ram_client.module_index.items():
+        module_names.add(short_name)
+        for candidate in candidates:
+            fqcn = candidate.get("fqcn", "") if isinstance(candidate, dict) else ""
+            if fqcn:
+                module_names.add(fqcn)
+    for name in sorted(module_names):
+        module = _get_first_object(ram_client.search_module(name=name))
+        if isinstance(module, ARIModule):
+            sections["modules"][name] = make_module_summary(module)
+    # RAMClient finds a module by its short name when a FQCN does not match any candidate,
+    # so keep the module found for an unknown FQCN for each short name
+    for short_name in ram_client.module_index:
+        module = _get_first_object(ram_client.search_module(name=f"__unknown__.{short_name}"))
+        if isinstance(module, ARIModule):
+            sections["module_fallbacks"][short_name] = make_module_summary(module)
+
+    for name in ram_client.role_index:
+        role = _get_first_object(ram_client.search_role(name=name))
+        if role is not None:
+            sections["roles"][name] = {"fqcn": role.fqcn, "defined_in": role.defined_in, "key": role.key}
+
+    for name in ram_client.taskfile_index:
+        taskfile = _get_first_object(ram_client.search_taskfile(name=name, is_key=True))
+        if taskfile is not None:
+            sections["taskfiles"][name] = {"defined_in": taskfile.defined_in, "key": taskfile.key}
+
+    for name, groups in ram_client.action_group_index.items():
+        sections["action_groups"][name] = groups
+    return sections
+
+
+def write_kb_index(sections: dict, fpath: str):
+    tables = []
+    data = bytearray()
+    data_offset = kb_index_header_size + kb_index_entry_size * sum(len(sections.get(name, {})) for name in kb_index_sections)
+    for name in kb_index_sections:
+        entries = []
+        for key, value in sections.get(name, {}).items():
+            entries.append((key.encode("utf-8"), json.dumps(value).encode("utf-8")))
+        entries.sort(key=lambda x: x[0])
+        table = []
+        for key_bytes, value_bytes in entries:
+            key_offset = data_offset + len(data)
+            data.extend(key_bytes)
+            value_offset = data_offset + len(data)
+            data.extend(value_bytes)
+            table.append((key_offset, len(key_bytes), value_offset, len(value_bytes)))
+        tables.append(table)
+
+    header_values = []
+    table_offset = kb_index_header_size
+    for table in tables:
+        header_values.extend([table_offset, len(table)])
+        table_offset += kb_index_entry_size * len(table)
+
+    tmp_path = f"{fpath}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(struct.pack(kb_index_header_format, kb_index_magic, *header_values))
+        for table in tables:
+            for entry in table:
+                file.write(struct.pack(kb_index_entry_format, *entry))
+        file.write(data)
+    os.replace(tmp_path, fpath)
+    return
+
+
+def build_kb_index(kb_dir: str, fpath: str):
+    sections = collect_kb_index_sections(kb_dir)
+    write_kb_index(sections, fpath)
+    return sections
+
+
+# a read-only KB client over an index file
+# the search methods return the results in the same format as RAMClient
+@dataclass
+class KBIndex(object):
+    fpath: str = ""
+
+    _buffer: mmap.mmap = None
+    _tables: dict = field(default_factory=dict)
+    # decoded values for each section
+    _values: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if not os.path.exists(self.fpath):
+            raise ValueError(f"the KB index file does not exist: {self.fpath}")
+        with open(self.fpath, "rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = struct.unpack_from(kb_index_header_format, self._buffer, 0)
+        if header[0] != kb_index_magic:
+            raise ValueError(f"not a KB index file: {self.fpath}")
+        for i, name in enumerate(kb_index_sections):
+            self._tables[name] = (header[1 + 2 * i], header[2 + 2 * i])
+            self._values[name] = {}
+
+    # mmap cannot be pickled, so the file is mapped again in the process which unpickles this
+    def __reduce__(self):
+        return (get_kb_index, (self.fpath,))
+
+    @property
+    def root_dir(self):
+        return self.fpath
+
+    def _get_entry(self, section: str, i: int):
+        table_offset, _ = self._tables[section]
+        return struct.unpack_from(kb_index_entry_format, self._buffer, table_offset + kb_index_entry_size * i)
+
+    # binary search of the key in the section table
+    def get(self, section: str, key: str):
+        values = self._values[section]
+        if key in values:
+            return values[key]
+        key_bytes = key.encode("utf-8")
+        value = None
+        lo, hi = 0, self._tables[section][1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_len, value_offset, value_len = self._get_entry(section, mid)
+            mid_key = self._buffer[key_offset : key_offset + key_len]
+            if mid_key < key_bytes:
+                lo = mid + 1
+            elif mid_key > key_bytes:
+                hi = mid
+            else:
+                value = json.loads(self._buffer[value_offset : value_offset + value_len])
+                break
+        values[key] = value
+        return value
+
+    def keys(self, section: str):
+        for i in range(self._tables[section][1]):
+            key_offset, key_len, _, _ = self._get_entry(section, i)
+            yield self._buffer[key_offset : key_offset + key_len].decode("utf-8")
+
+    def search_module(self, name, used_in=""):
+        summary = self.get("modules", name)
+        if summary is None and "." in name:
+            summary = self.get("module_fallbacks", name.split(".")[-1])
+        if summary is None:
+            return []
+        module = module_from_summary(summary)
+        return [{"type": "module", "name": module.fqcn, "object": module, "used_in": used_in}]
+
+    # batched version of `search_module()`; returns a dict of name --> search result
+    def search_modules(self, names: list, used_in=""):
+        return {name: self.search_module(name, used_in=used_in) for name in names}
+
+    def search_role(self, name, used_in=""):
+        summary = self.get("roles", name)
+        if summary is None:
+            return []
+        role = ARIRole(fqcn=summary["fqcn"], defined_in=summary["defined_in"], key=summary["key"])
+        return [{"type": "role", "name": role.fqcn, "object": role, "used_in": used_in}]
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        # only the search by a taskfile key is supported
+        if not is_key:
+            return []
+        summary = self.get("taskfiles", name)
+        if summary is None:
+            return []
+        taskfile = ARITaskFile(defined_in=summary["defined_in"], key=summary["key"])
+        return [{"type": "taskfile", "name": taskfile.key, "object": taskfile, "used_in": used_in}]
+
+    def search_action_group(self, name, max_match=-1):
+        if max_match == 0:
+            return []
+        found_groups = self.get("action_groups", name) or []
+        if max_match > 0 and len(found_groups) > max_match:
+            found_groups = found_groups[:max_match]
+        return found_groups
+
+
+# index file path --> KBIndex; an index file is mapped only once in a process
+_kb_indices = {}
+
+
+def get_kb_index(fpath: str):
+    kb_index = _kb_indices.get(fpath, None)
+    if kb_index is None:
+        kb_index = KBIndex(fpath=fpath)
+        _kb_indices[fpath] = kb_index
+    return kb_index
+
+
+# return a KB client for module/role/taskfile searches
+# the index file is used if it is specified, otherwise RAMClient is created for the KB data dir
+def load_kb_client(kb_dir: str, index_file: str = None):
+    if index_file is None:
+        index_file = SAGE_KB_INDEX_FILE
+    if index_file:
+        return get_kb_index(index_file)
+    return RAMClient(root_dir=kb_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build a KB index file from a KB data dir")
+    parser.add_argument("-d", "--dir", help="KB data dir")
+    parser.add_argument("-o", "--output", help="output index file")
+    args = parser.parse_args()
+
+    sections = build_kb_index(args.dir, args.output)
+    for name in kb_index_sections:
+        print(f"{name}: {len(sections[name])}")
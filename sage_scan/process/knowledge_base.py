@@ -15,13 +15,24 @@
 # limitations under the License.
 
 import os
-from dataclasses import dataclass
+import json
+import atexit
+import hashlib
+import jsonpickle
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from sage_scan.models import (
     Task,
     Module,
     SageProject,
+    update_include_info_generation,
 )
-from sage_scan.process.annotations import MODULE_OBJECT_ANNOTATION_KEY
+from sage_scan.process.annotations import (
+    MODULE_OBJECT_ANNOTATION_KEY,
+    MODULE_REF_ANNOTATION_KEY,
+    ModuleSpecRegistry,
+)
+from sage_scan.process.kb_index import SAGE_KB_INDEX_FILE, KBIndex, get_kb_index
 from ansible_risk_insight.models import (
     ExecutableType,
     Module as ARIModule,
@@ -37,16 +48,169 @@ SAGE_KB_DATA_DIR = os.getenv("SAGE_KB_DATA_DIR", None)
 if not SAGE_KB_DATA_DIR:
     SAGE_KB_DATA_DIR = os.getenv("ARI_KB_DATA_DIR", None)
 
+# the max number of KB search results kept in memory for each KB data dir
+SAGE_KB_CACHE_SIZE = int(os.getenv("SAGE_KB_CACHE_SIZE", "4096"))
+# if specified, the KB search results are also saved to this file at exit and reused by later processes
+SAGE_KB_CACHE_FILE = os.getenv("SAGE_KB_CACHE_FILE", None)
+
+
+# return a string which changes when the KB data dir is updated
+# the dir itself and the index files are checked instead of walking all the findings
+def get_kb_dir_fingerprint(kb_dir: str):
+    if not kb_dir or not os.path.exists(kb_dir):
+        return ""
+    stats = []
+    stat = os.stat(kb_dir)
+    stats.append(["", stat.st_mtime_ns])
+    indices_dir = os.path.join(kb_dir, "indices")
+    if os.path.isdir(indices_dir):
+        for fname in sorted(os.listdir(indices_dir)):
+            stat = os.stat(os.path.join(indices_dir, fname))
+            stats.append([fname, stat.st_mtime_ns, stat.st_size])
+    return hashlib.sha256(json.dumps([os.path.abspath(kb_dir), stats]).encode()).hexdigest()
+
+
+# LRU cache of KB search results keyed by the query
+# results are stored even if nothing is found, so that the same search is not repeated
+# the fingerprint of the KB data dir is computed when the first result is cached or loaded,
+# so that a cache which is never used does not check the dir
+@dataclass
+class KBSearchCache(object):
+    kb_dir: str = ""
+    max_size: int = SAGE_KB_CACHE_SIZE
+    cache_file: str = None
+    fingerprint: str = None
+
+    _entries: OrderedDict = field(default_factory=OrderedDict)
+    _updated: bool = False
+
+    def __post_init__(self):
+        self.load()
+
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            self.fingerprint = get_kb_dir_fingerprint(self.kb_dir)
+        return self.fingerprint
+
+    # drop all the results if the KB data dir has been changed since they were cached
+    def validate(self):
+        if self.fingerprint is None:
+            return
+        fingerprint = get_kb_dir_fingerprint(self.kb_dir)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.clear()
+        return
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self._updated = True
+        return
+
+    @staticmethod
+    def make_key(search_type: str, *args):
+        return json.dumps([search_type, *args])
+
+    # return (True, result) if the query is cached, otherwise (False, None)
+    def get(self, key: str):
+        if key not in self._entries:
+            return False, None
+        self._entries.move_to_end(key)
+        return True, self._entries[key]
+
+    def put(self, key: str, result):
+        self.get_fingerprint()
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if self.max_size > 0:
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        self._updated = True
+        return
+
+    def load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as file:
+                data = jsonpickle.decode(file.read())
+        except Exception:
+            return
+        if not isinstance(data, dict) or data.get("fingerprint", None) != self.get_fingerprint():
+            return
+        entries = data.get("entries", [])
+        if self.max_size > 0:
+            entries = entries[-self.max_size:]
+        self._entries = OrderedDict(entries)
+        return
+
+    def save(self):
+        if not self.cache_file or not self._updated:
+            return
+        data = {
+            "fingerprint": self.get_fingerprint(),
+            "entries": list(self._entries.items()),
+        }
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first so that other processes never read a partial file
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as file:
+            file.write(jsonpickle.encode(data, make_refs=False))
+        os.replace(tmp_file, self.cache_file)
+        self._updated = False
+        return
+
+
+# return the search types whose results the KB client keeps in memory by itself
+# RAMClient caches module/role/taskfile searches, and KBIndex caches the decoded entries of all the searches;
+# other clients can declare them by a `cached_search_types` attribute
+def get_client_cached_search_types(kb_client):
+    if isinstance(kb_client, RAMClient):
+        return ["module", "role", "taskfile"]
+    if isinstance(kb_client, KBIndex):
+        return ["module", "role", "taskfile", "action_group"]
+    return getattr(kb_client, "cached_search_types", [])
+
+
+# KB dir --> KBSearchCache; shared by all KnowledgeBase instances in the process
+_kb_search_caches = {}
+
+
+def get_kb_search_cache(kb_dir: str, cache_file: str = None):
+    cache = _kb_search_caches.get(kb_dir, None)
+    if cache is None:
+        if cache_file is None:
+            cache_file = SAGE_KB_CACHE_FILE
+        cache = KBSearchCache(kb_dir=kb_dir, cache_file=cache_file)
+        _kb_search_caches[kb_dir] = cache
+        if cache.cache_file:
+            atexit.register(cache.save)
+    else:
+        cache.validate()
+    return cache
+
 
 @dataclass
 class KnowledgeBase(object):
     kb_client: RAMClient = None
+    search_cache: KBSearchCache = None
+    # specs of the modules found for tasks; tasks refer to them by FQCN if this is passed to `resolve_*()`
+    module_registry: ModuleSpecRegistry = field(default_factory=ModuleSpecRegistry)
 
     def __post_init__(self):
         if not self.kb_client:
             self.init_kb_client()
+        if not self.search_cache:
+            self.init_search_cache()
 
     def init_kb_client(self):
+        # a prebuilt index file can be used without the KB data dir
+        if SAGE_KB_INDEX_FILE:
+            self.kb_client = get_kb_index(SAGE_KB_INDEX_FILE)
+            return
+
         if SAGE_KB_DATA_DIR is None:
             raise ValueError(f"Please specify an existing SAGE KB dir by an env param:\n$ export SAGE_KB_DATA_DIR=<PATH/TO/SAGE_KB_DATA_DIR>")
 
@@ -59,74 +223,174 @@ class KnowledgeBase(object):
     def set_kb_client_from_ram_client(self, ram_client=None):
         if ram_client:
             self.kb_client = ram_client
+            self.init_search_cache()
+        return
+
+    def init_search_cache(self):
+        kb_dir = getattr(self.kb_client, "root_dir", "")
+        if kb_dir:
+            self.search_cache = get_kb_search_cache(kb_dir)
+        else:
+            # the results of a client without a data dir can not be shared
+            self.search_cache = KBSearchCache()
+        return
+
+    def save_search_cache(self):
+        if self.search_cache:
+            self.search_cache.save()
         return
 
-    def resolve_task(self, task: Task, set_module_object_annotation: bool = False):
+    # RAMClient and KBIndex keep search results in memory, so the search cache is used for them only
+    # if it is saved to a file for later processes
+    def _use_search_cache(self, search_type: str):
+        if self.search_cache.cache_file:
+            return True
+        return search_type not in get_client_cached_search_types(self.kb_client)
+
+    # search the KB through the search cache
+    def _search(self, search_type: str, search_func, *args):
+        if not self._use_search_cache(search_type):
+            return search_func()
+        key = KBSearchCache.make_key(search_type, *args)
+        found, result = self.search_cache.get(key)
+        if not found:
+            result = search_func()
+            self.search_cache.put(key, result)
+        return result
+
+    def search_module(self, name):
+        return self._search("module", lambda: self.kb_client.search_module(name=name), name)
+
+    # search modules by names at once; returns a dict of name --> search result
+    # names not in the search cache are searched with a single batched query if the KB client supports it
+    def search_modules(self, names: list):
+        results = {}
+        missing_names = []
+        use_search_cache = self._use_search_cache("module")
+        for name in names:
+            if not use_search_cache:
+                missing_names.append(name)
+                continue
+            key = KBSearchCache.make_key("module", name)
+            found, result = self.search_cache.get(key)
+            if found:
+                results[name] = result
+            else:
+                missing_names.append(name)
+        if not missing_names:
+            return results
+        if hasattr(self.kb_client, "search_modules"):
+            found_results = self.kb_client.search_modules(missing_names)
+        else:
+            found_results = {name: self.kb_client.search_module(name=name) for name in missing_names}
+        for name in missing_names:
+            result = found_results.get(name, [])
+            if use_search_cache:
+                self.search_cache.put(KBSearchCache.make_key("module", name), result)
+            results[name] = result
+        return results
+
+    def search_role(self, name):
+        return self._search("role", lambda: self.kb_client.search_role(name=name), name)
+
+    def search_taskfile(self, name):
+        return self._search("taskfile", lambda: self.kb_client.search_taskfile(name=name, is_key=True), name)
+
+    def search_action_group(self, name):
+        return self._search("action_group", lambda: self.kb_client.search_action_group(name), name)
+
+    # if `module_registry` is given, the module annotation of the task is a reference to the module spec in it
+    # (e.g. `kb.module_registry`), otherwise the Module object is set
+    def resolve_task(self, task: Task, set_module_object_annotation: bool = False, module_registry: ModuleSpecRegistry = None):
         exec_type = task.executable_type
-        include_types = [ExecutableType.ROLE_TYPE, ExecutableType.TASKFILE_TYPE]
 
-        task = self.set_module_info(task, set_module_object_annotation)
+        task = self.set_module_info(task, set_module_object_annotation, module_registry)
         if exec_type in include_types:
             task = self.set_include_info(task)
 
-        if exec_type == ExecutableType.MODULE_TYPE:
-            if task.module_info and isinstance(task.module_info, dict):
-                task.resolved_name = task.module_info.get("fqcn", "")
-        elif exec_type == ExecutableType.ROLE_TYPE:
-            if task.include_info and isinstance(task.include_info, dict):
-                task.resolved_name = task.include_info.get("fqcn", "")
-        elif exec_type == ExecutableType.TASKFILE_TYPE:
-            if task.include_info and isinstance(task.include_info, dict):
-                task.resolved_name = task.include_info.get("key", "")
+        return set_resolved_name(task)
 
-        return task
+    # resolve module/include info of all the tasks at once
+    # each distinct module name and include target is searched only once, and the results are set to all the tasks
+    def resolve_tasks(self, tasks: list, set_module_object_annotation: bool = False, module_registry: ModuleSpecRegistry = None):
+        for task in tasks:
+            if not isinstance(task, Task):
+                raise ValueError(f"expect a task object, but {type(task)}")
 
-    def set_module_info(self, task: Task, set_module_object_annotation: bool = False):
+        module_names = list(dict.fromkeys(task.module for task in tasks))
+        modules = self.get_modules(module_names)
+
+        include_targets = list(dict.fromkeys((task.executable_type, task.executable) for task in tasks if task.executable_type in include_types))
+        include_info_updated = False
+        include_info_map = {}
+        for exec_type, exec_target in include_targets:
+            include_info_map[(exec_type, exec_target)] = self.get_include_info(exec_type, exec_target)
+
+        for task in tasks:
+            _set_module_info(task, modules.get(task.module, None), set_module_object_annotation, module_registry)
+            exec_type = task.executable_type
+            if exec_type in include_types:
+                include_info = include_info_map.get((exec_type, task.executable), None)
+                if include_info is not None:
+                    task.include_info = include_info.copy()
+                    include_info_updated = True
+            set_resolved_name(task)
+        # call graphs which have been built with the old include info must be rebuilt
+        if include_info_updated:
+            update_include_info_generation()
+        return tasks
+
+    def resolve_project(self, project: SageProject, set_module_object_annotation: bool = False, module_registry: ModuleSpecRegistry = None):
+        self.resolve_tasks(project.tasks, set_module_object_annotation, module_registry)
+        project.invalidate_call_graphs()
+        return project
+
+    def set_module_info(self, task: Task, set_module_object_annotation: bool = False, module_registry: ModuleSpecRegistry = None):
         if not isinstance(task, Task):
             raise ValueError(f"expect a task object, but {type(task)}")
 
-        raw_module_name = task.module
-        result = self.kb_client.search_module(name=raw_module_name)
-        module = None
-        if result and isinstance(result, list) and isinstance(result[0], dict):
-            _module = result[0].get("object", None)
-            if isinstance(_module, Module):
-                module = _module
-            elif isinstance(_module, ARIModule):
-                module = Module.from_ari_obj(_module)
-        if module:
-            task.module_info = {
-                "collection": module.collection,
-                "short_name": module.name,
-                "fqcn": module.fqcn,
-                "key": module.key,
-            }
-            if set_module_object_annotation:
-                task.set_annotation(MODULE_OBJECT_ANNOTATION_KEY, module)
+        module = self.get_module(task.module)
+        return _set_module_info(task, module, set_module_object_annotation, module_registry)
 
-        return task
+    # return a Module found by the module name, or None if not found
+    def get_module(self, name: str):
+        result = self.search_module(name=name)
+        return _get_module_from_search_result(result)
+
+    # return a dict of module name --> Module (or None) for the module names
+    def get_modules(self, names: list):
+        results = self.search_modules(names)
+        return {name: _get_module_from_search_result(results.get(name, None)) for name in names}
 
     def set_include_info(self, task: Task):
         if not isinstance(task, Task):
             raise ValueError(f"expect a task object, but {type(task)}")
 
-        exec_target = task.executable
-        exec_type = task.executable_type
+        include_info = self.get_include_info(task.executable_type, task.executable)
+        if include_info is None:
+            return task
+
+        task.include_info = include_info
+        update_include_info_generation()
+        return task
+
+    # return include info of the role/taskfile, or None if not found
+    def get_include_info(self, exec_type: str, exec_target: str):
         include_info = {}
         if exec_type == ExecutableType.ROLE_TYPE:
-            result = self.kb_client.search_role(name=exec_target)
+            result = self.search_role(name=exec_target)
             if not result:
-                return task
+                return None
 
             if not isinstance(result, list):
-                return task
+                return None
 
             if not isinstance(result[0], dict):
-                return task
+                return None
 
             role = result[0].get("object", None)
             if not role:
-                return task
+                return None
 
             include_info = {
                 "type": "role",
@@ -136,19 +400,19 @@ class KnowledgeBase(object):
             }
 
         elif exec_type == ExecutableType.TASKFILE_TYPE:
-            result = self.kb_client.search_taskfile(name=exec_target, is_key=True)
+            result = self.search_taskfile(name=exec_target)
             if not result:
-                return task
+                return None
 
             if not isinstance(result, list):
-                return task
+                return None
 
             if not isinstance(result[0], dict):
-                return task
+                return None
 
             taskfile = result[0].get("object", None)
             if not taskfile:
-                return task
+                return None
 
             include_info = {
                 "type": "taskfile",
@@ -156,5 +420,49 @@ class KnowledgeBase(object):
                 "key": taskfile.key,
             }
 
-        task.include_info = include_info
-        return task
+        return include_info
+
+
+include_types = [ExecutableType.ROLE_TYPE, ExecutableType.TASKFILE_TYPE]
+
+
+def _get_module_from_search_result(result):
+    module = None
+    if result and isinstance(result, list) and isinstance(result[0], dict):
+        _module = result[0].get("object", None)
+        if isinstance(_module, Module):
+            module = _module
+        elif isinstance(_module, ARIModule):
+            module = Module.from_ari_obj(_module)
+    return module
+
+
+# if a module registry is given, the module is registered and the task keeps only its FQCN as the module annotation
+def _set_module_info(task: Task, module: Module, set_module_object_annotation: bool = False, module_registry: ModuleSpecRegistry = None):
+    if module:
+        task.module_info = {
+            "collection": module.collection,
+            "short_name": module.name,
+            "fqcn": module.fqcn,
+            "key": module.key,
+        }
+        if set_module_object_annotation:
+            if module_registry is not None:
+                task.set_annotation(MODULE_REF_ANNOTATION_KEY, module_registry.register(module))
+            else:
+                task.set_annotation(MODULE_OBJECT_ANNOTATION_KEY, module)
+    return task
+
+
+def set_resolved_name(task: Task):
+    exec_type = task.executable_type
+    if exec_type == ExecutableType.MODULE_TYPE:
+        if task.module_info and isinstance(task.module_info, dict):
+            task.resolved_name = task.module_info.get("fqcn", "")
+    elif exec_type == ExecutableType.ROLE_TYPE:
+        if task.include_info and isinstance(task.include_info, dict):
+            task.resolved_name = task.include_info.get("fqcn", "")
+    elif exec_type == ExecutableType.TASKFILE_TYPE:
+        if task.include_info and isinstance(task.include_info, dict):
+            task.resolved_name = task.include_info.get("key", "")
+    return task
@@ -0,0 +1,194 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2023 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable
+
+from sage_scan.models import SageProject, create_entrypoint_data_list
+
+# numpy is optional; the reductions fall back to plain python loops when it is not installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# assign an integer code to each distinct value (e.g. filepath) of a column
+@dataclass
+class CodeTable(object):
+    values: list = field(default_factory=list)
+    codes: dict = field(default_factory=dict)
+
+    def code(self, value):
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# integer-coded columns of tasks and plays in a project and their membership to entrypoints
+# a membership row (entrypoint, row) exists for each occurrence of the object in the entrypoint data,
+# so an object appearing twice in a call sequence is counted twice like `len(PlaybookData.tasks)`
+@dataclass
+class ProjectTable(object):
+    data_list: list = field(default_factory=list)
+
+    filepaths: CodeTable = field(default_factory=CodeTable)
+    modules: CodeTable = field(default_factory=CodeTable)
+    roles: CodeTable = field(default_factory=CodeTable)
+
+    # entrypoint columns
+    entrypoint_filepath: array = field(default_factory=lambda: array("q"))
+
+    # task columns
+    task_keys: CodeTable = field(default_factory=CodeTable)
+    task_filepath: array = field(default_factory=lambda: array("q"))
+    task_module: array = field(default_factory=lambda: array("q"))
+    task_role: array = field(default_factory=lambda: array("q"))
+    task_member_entrypoint: array = field(default_factory=lambda: array("q"))
+    task_member_row: array = field(default_factory=lambda: array("q"))
+
+    # play columns
+    play_keys: CodeTable = field(default_factory=CodeTable)
+    play_filepath: array = field(default_factory=lambda: array("q"))
+    play_member_entrypoint: array = field(default_factory=lambda: array("q"))
+    play_member_row: array = field(default_factory=lambda: array("q"))
+
+    @classmethod
+    def from_data_list(cls, data_list: list):
+        table = cls(data_list=list(data_list))
+        # the objects are python objects, so each one is visited once here, but the columns are extended per
+        # entrypoint and the rows of objects shared by entrypoints are looked up without adding them again
+        task_rows = table.task_keys.codes
+        play_rows = table.play_keys.codes
+        for i, data in enumerate(table.data_list):
+            table.entrypoint_filepath.append(table.filepaths.code(data.object.filepath))
+            rows = [task_rows[task.key] if task.key in task_rows else table._task_row(task) for task in data.tasks]
+            table.task_member_entrypoint.extend(array("q", [i]) * len(rows))
+            table.task_member_row.extend(rows)
+            # TaskFileData does not have plays
+            rows = [play_rows[play.key] if play.key in play_rows else table._play_row(play) for play in getattr(data, "plays", [])]
+            table.play_member_entrypoint.extend(array("q", [i]) * len(rows))
+            table.play_member_row.extend(rows)
+        return table
+
+    @classmethod
+    def from_project(cls, project: SageProject, follow_include_for_used_vars: bool=True):
+        data_list = create_entrypoint_data_list(project, follow_include_for_used_vars=follow_include_for_used_vars)
+        return cls.from_data_list(data_list)
+
+    def _task_row(self, task):
+        num_rows = len(self.task_keys)
+        row = self.task_keys.code(task.key)
+        if row == num_rows:
+            self.task_filepath.append(self.filepaths.code(task.filepath))
+            self.task_module.append(self.modules.code(task.module))
+            self.task_role.append(self.roles.code(task.role))
+        return row
+
+    def _play_row(self, play):
+        num_rows = len(self.play_keys)
+        row = self.play_keys.code(play.key)
+        if row == num_rows:
+            self.play_filepath.append(self.filepaths.code(play.filepath))
+        return row
+
+    @property
+    def num_of_entrypoints(self):
+        return len(self.data_list)
+
+
+# count memberships per entrypoint
+# if `mask` is given, only the memberships whose mask value is True are counted
+def count_by_entrypoint(member_entrypoint: array, num_of_entrypoints: int, mask=None):
+    if np is not None:
+        _member_entrypoint = np.asarray(member_entrypoint, dtype=np.int64)
+        if mask is not None:
+            _member_entrypoint = _member_entrypoint[np.asarray(mask, dtype=bool)]
+        return np.bincount(_member_entrypoint, minlength=num_of_entrypoints).tolist()
+
+    counts = [0] * num_of_entrypoints
+    if mask is None:
+        for ep in member_entrypoint:
+            counts[ep] += 1
+    else:
+        for ep, m in zip(member_entrypoint, mask):
+            if m:
+                counts[ep] += 1
+    return counts
+
+
+# True for each membership if the object is defined in the entrypoint file
+def same_file_mask(member_entrypoint: array, member_row: array, row_filepath: array, entrypoint_filepath: array):
+    if np is not None:
+        _member_entrypoint = np.asarray(member_entrypoint, dtype=np.int64)
+        _member_row = np.asarray(member_row, dtype=np.int64)
+        _row_filepath = np.asarray(row_filepath, dtype=np.int64)
+        _entrypoint_filepath = np.asarray(entrypoint_filepath, dtype=np.int64)
+        if len(_member_row) == 0:
+            return np.zeros(0, dtype=bool)
+        return _row_filepath[_member_row] == _entrypoint_filepath[_member_entrypoint]
+
+    return [row_filepath[row] == entrypoint_filepath[ep] for ep, row in zip(member_entrypoint, member_row)]
+
+
+# sample metrics; the same values as `get_num_of_tasks()`/`get_num_of_plays()` of PlaybookData/TaskFileData
+def num_of_tasks(table: ProjectTable):
+    mask = same_file_mask(table.task_member_entrypoint, table.task_member_row, table.task_filepath, table.entrypoint_filepath)
+    return count_by_entrypoint(table.task_member_entrypoint, table.num_of_entrypoints, mask)
+
+
+def num_of_plays(table: ProjectTable):
+    mask = same_file_mask(table.play_member_entrypoint, table.play_member_row, table.play_filepath, table.entrypoint_filepath)
+    return count_by_entrypoint(table.play_member_entrypoint, table.num_of_entrypoints, mask)
+
+
+# a metric computed for all entrypoints at once
+# `func` receives a ProjectTable and returns a list of values, one for each entrypoint
+@dataclass
+class MetricsReduction(object):
+    key: str = ""
+    func: Callable = None
+
+
+default_metrics_reductions = [
+    MetricsReduction(key="num_of_tasks", func=num_of_tasks),
+    MetricsReduction(key="num_of_plays", func=num_of_plays),
+]
+
+
+# compute metrics for all entrypoint data in the table and set them to `metrics` of each data
+# `metrics_to_json()` of each data can be used as before
+def compute_metrics_for_table(table: ProjectTable, reductions: list=None):
+    if reductions is None:
+        reductions = default_metrics_reductions
+    for reduction in reductions:
+        values = reduction.func(table)
+        if len(values) != table.num_of_entrypoints:
+            raise ValueError(f"metrics `{reduction.key}` must return {table.num_of_entrypoints} values, but got {len(values)}")
+        for data, value in zip(table.data_list, values):
+            setattr(data.metrics, reduction.key, value)
+    return table.data_list
+
+
+# create entrypoint data for the project and compute their metrics
+def compute_metrics_for_project(project: SageProject, reductions: list=None, follow_include_for_used_vars: bool=True):
+    table = ProjectTable.from_project(project, follow_include_for_used_vars=follow_include_for_used_vars)
+    return compute_metrics_for_table(table, reductions)
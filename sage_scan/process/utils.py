@@ -18,13 +18,8 @@ import os
 from sage_scan.models import SageObject, SageProject, Playbook, TaskFile, Play, Task, Role
 from sage_scan.process.variable_resolver import VariableResolver
 from sage_scan.process.knowledge_base import KnowledgeBase, MODULE_OBJECT_ANNOTATION_KEY
-from sage_scan.process.annotations import (
-    set_module_spec_annotations,
-    set_module_arg_key_annotations,
-    set_module_arg_value_annotations,
-    set_variable_annotations,
-    omit_object_annotations,
-)
+from sage_scan.process.annotations import omit_object_annotations, FEATURE_TASK_MODULE_EXAMPLES
+from sage_scan.process.annotation_engine import AnnotationEngine
 from ansible_risk_insight.models import Annotation
 
 
@@ -100,16 +95,7 @@ def get_plays(playbook: Playbook, project: SageProject):
 
 # find all taskfiles in the speciifed role from SageProject
 def get_taskfiles_in_role(role: Role, project: SageProject):
-    taskfile_keys = role.taskfiles
-    taskfiles = []
-    for tf_key in taskfile_keys:
-        taskfile = project.get_object(key=tf_key)
-        if not taskfile:
-            continue
-        if not isinstance(taskfile, TaskFile):
-            continue
-        taskfiles.append(taskfile)
-    return taskfiles
+    return project.get_taskfiles_in_role(role)
 
 
 # find main.yml or main.yaml in the specified role from SageProject
@@ -124,11 +110,7 @@ def get_main_taskfile_for_role(role: Role, project: SageProject):
 
 # find a parent role for the specified taskfile if it exists
 def find_parent_role(taskfile: TaskFile, project: SageProject):
-    for role in project.roles:
-        taskfile_keys = role.taskfiles
-        if taskfile.key in taskfile_keys:
-            return role
-    return None
+    return project.find_parent_role(taskfile)
 
 
 # get call tree which starts from the specified entrypoint
@@ -149,6 +131,11 @@ def get_call_sequence_for_task(task: Task, project: SageProject, follow_include:
     return project.get_call_sequence_for_task(task, follow_include)
 
 
+# get all call sequences which contain the specified task
+def get_call_sequences_for_task(task: Task, project: SageProject, follow_include: bool = True):
+    return project.get_call_sequences_for_task(task, follow_include)
+
+
 # get call sequence which starts from the specified entrypoint
 def get_call_sequence_by_entrypoint(entrypoint: Playbook | Role | TaskFile, project: SageProject, follow_include: bool = True):
     return project.get_call_sequence_by_entrypoint(entrypoint, follow_include)
@@ -266,28 +253,27 @@ def set_module_info_to_task(task: Task):
     return kb.set_module_info(task)
 
 
-def set_primary_annotations_to_project(project: SageProject):
+def set_primary_annotations_to_project(project: SageProject, engine: AnnotationEngine = None):
     resolver = VariableResolver()
     # set variable data
     project = resolver.resolve_all_vars_in_project(project=project)
     kb = KnowledgeBase()
+    # set module_info/include_info of all tasks at once
+    kb.resolve_project(project, set_module_object_annotation=True, module_registry=kb.module_registry)
     tasks = project.tasks
-    for task in tasks:
-        # set module_info/include_info
-        kb.resolve_task(task, set_module_object_annotation=True)
-
-        # set P001 annotations
-        set_module_spec_annotations(task)
 
-        # set P002 annotations
-        set_module_arg_key_annotations(task, knowledge_base=kb)
+    # set P001 - P004 annotations
+    if engine is None:
+        engine = AnnotationEngine()
+    engine.annotate(tasks, knowledge_base=kb)
 
-        # set P003 annotations
-        set_module_arg_value_annotations(task)
-
-        # set P004 annotations
-        set_variable_annotations(task)
+    # save module examples once per module instead of in each task
+    if not FEATURE_TASK_MODULE_EXAMPLES:
+        project.set_module_examples(kb.module_registry.examples_map())
 
+    for task in tasks:
         # remove temporary annotations (to avoid saving large data)
         omit_object_annotations(task)
+    # `include_info` of tasks could be updated above, so the cached call graphs are no longer valid
+    project.invalidate_call_graphs()
     return project
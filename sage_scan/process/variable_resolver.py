@@ -14,9 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
 import copy
+import hashlib
+from bisect import bisect_left
+from itertools import islice
+from collections.abc import Mapping
 from pathlib import Path
+import jsonpickle
+import jsonpickle.handlers
 from dataclasses import dataclass, field
 from sage_scan.models import (
     Collection,
@@ -28,9 +35,10 @@ from sage_scan.models import (
     SageObject,
     SageProject,
 )
-from sage_scan.utils import extract_variable_names
+from sage_scan.utils import extract_variable_names, strtobool
 from sage_scan.process.annotations import (
     ARGUMENTS_ANNOTATION_KEY,
+    LOOP_SUMMARY_ANNOTATION_KEY,
     VARIABLES_SET_ANNOTATION_KEY,
     VARIABLES_USED_ANNOTATION_KEY,
     is_loop_var,
@@ -49,14 +57,236 @@ from ansible_risk_insight.models import (
 variable_block_re = re.compile(r"{{[^}]+}}")
 p = Path(__file__).resolve().parent.parent
 ansible_special_variables = [line.replace("\n", "") for line in open(p / "ansible_variables.txt", "r").read().splitlines()]
+# set for membership checks
+ansible_special_variable_set = set(ansible_special_variables)
+
+# when the lazy loop templating is on, module options of a task with a loop are templated only with
+# the first loop item, and the summary of the loop items is set to the `loop_summary` annotation
+_lazy_loop_templating_feature_env_key = "SAGE_LAZY_LOOP_TEMPLATING"
+FEATURE_LAZY_LOOP_TEMPLATING = strtobool(os.getenv(_lazy_loop_templating_feature_env_key, "False"))
+# the max number of loop items to be templated for a task (0 means no limit)
+_max_loop_items_env_key = "SAGE_MAX_LOOP_ITEMS"
+MAX_LOOP_ITEMS = int(os.getenv(_max_loop_items_env_key, "0"))
+
+
+# append-only history of variables set/used during a traversal
+# `snapshot()` returns a view of the history at that point without copying it, so each task can keep
+# its own history cheaply; variables in the history must not be modified after they are added
+# a forked history shares the log before the fork point with `parent`, and has only the variables added after it
+@dataclass
+class VariableHistory(object):
+    # var_name --> log positions and variables of the var_name added to this history
+    positions: dict = field(default_factory=dict)
+    variables: dict = field(default_factory=dict)
+    # var_names which are not in `parent` in the order they were first added, and their first log positions
+    names: list = field(default_factory=list)
+    first_positions: list = field(default_factory=list)
+    size: int = 0
+    parent: "VariableHistorySnapshot" = None
+
+    # (var_name, variable) added to this history in the order
+    _log: list = field(default_factory=list)
+    # digests of the log up to each position, which are computed on demand by `get_digest()`
+    _digests: list = field(default_factory=list)
+    # the digest of the parent at the fork point
+    _base_digest: str = None
+
+    def append(self, var_name: str, variable: Variable):
+        if var_name not in self.positions:
+            self.positions[var_name] = []
+            self.variables[var_name] = []
+            if self.parent is None or var_name not in self.parent:
+                self.names.append(var_name)
+                self.first_positions.append(self.size)
+        self.positions[var_name].append(self.size)
+        self.variables[var_name].append(variable)
+        self._log.append((var_name, variable))
+        self.size += 1
+        return
+
+    def snapshot(self):
+        return VariableHistorySnapshot(history=self, size=self.size)
+
+    # return a new history which has the same log, so that both can be appended independently
+    # the log is not copied; the new history reads it through a snapshot at this point
+    def fork(self):
+        parent = self.parent
+        if parent is None or parent.size != self.size:
+            parent = self.snapshot()
+        return VariableHistory(size=self.size, parent=parent)
+
+    # return the history as a dict like `{var_name: [Variable, ...]}`
+    def to_dict(self):
+        return dict(self.snapshot())
+
+    # return a digest of the first `size` variables in the log, which is the same for the same log
+    # even if the history is forked; digests are chained by position, so each variable is encoded only once
+    def get_digest(self, size: int):
+        # the base digests of forked histories are computed from the oldest one
+        chain = []
+        history = self
+        while history.parent is not None and history._base_digest is None:
+            chain.append(history)
+            history = history.parent.history
+        for history in reversed(chain):
+            history._base_digest = history.parent.history._extend_digests(history.parent.size)
+        return self._extend_digests(size)
+
+    def _extend_digests(self, size: int):
+        start = self.parent.size if self.parent is not None else 0
+        num = size - start
+        while len(self._digests) < num:
+            prev_digest = self._digests[-1] if self._digests else (self._base_digest or "")
+            var_name, variable = self._log[len(self._digests)]
+            data = jsonpickle.encode([prev_digest, var_name, variable], make_refs=False, unpicklable=False)
+            self._digests.append(hashlib.sha256(data.encode("utf-8")).hexdigest())
+        if num <= 0:
+            return self._base_digest or ""
+        return self._digests[num - 1]
+
+
+# a read-only view of VariableHistory at some point, which works as a dict like `{var_name: [Variable, ...]}`
+class VariableHistorySnapshot(Mapping):
+    __slots__ = ("history", "size", "_num_of_names")
+
+    def __init__(self, history: VariableHistory, size: int):
+        self.history = history
+        self.size = size
+        self._num_of_names = bisect_left(history.first_positions, size)
+
+    @property
+    def parent(self):
+        return self.history.parent
+
+    # a digest of the content of this snapshot, which is cheaper than encoding it
+    def digest(self):
+        return self.history.get_digest(self.size)
+
+    # the number of variables of the var_name in this snapshot, excluding the ones in the parent
+    def _num_of_variables(self, var_name):
+        positions = self.history.positions.get(var_name, None)
+        if not positions:
+            return 0
+        return bisect_left(positions, self.size)
+
+    def __getitem__(self, var_name):
+        num = self._num_of_variables(var_name)
+        if self.parent is not None and var_name in self.parent:
+            return self.parent[var_name] + self.history.variables[var_name][:num] if num else self.parent[var_name]
+        if num == 0:
+            raise KeyError(var_name)
+        return self.history.variables[var_name][:num]
+
+    def __contains__(self, var_name):
+        if self._num_of_variables(var_name) > 0:
+            return True
+        return self.parent is not None and var_name in self.parent
+
+    def __iter__(self):
+        if self.parent is not None:
+            yield from self.parent
+        names = self.history.names
+        for i in range(self._num_of_names):
+            yield names[i]
+
+    def __len__(self):
+        num = self._num_of_names
+        if self.parent is not None:
+            num += len(self.parent)
+        return num
+
+    # return the first/last variable of the var_name in this snapshot without copying the list
+    def first(self, var_name):
+        if self.parent is not None and var_name in self.parent:
+            return self.parent.first(var_name)
+        return self.history.variables[var_name][0]
+
+    def last(self, var_name):
+        num = self._num_of_variables(var_name)
+        if num == 0:
+            return self.parent.last(var_name)
+        return self.history.variables[var_name][num - 1]
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        # pickle/deepcopy as a plain dict
+        return (dict, (dict(self),))
+
+
+# serialize snapshots as plain dicts, so object files are the same as before
+class VariableHistorySnapshotHandler(jsonpickle.handlers.BaseHandler):
+    def flatten(self, obj, data):
+        return self.context.flatten(dict(obj), reset=False)
+
+    def restore(self, data):
+        return data
+
+
+jsonpickle.handlers.register(VariableHistorySnapshot, VariableHistorySnapshotHandler)
+
+
+# a node of CallSequenceTrie; `last_seq_index` is the index of the last sequence which passes through this node
+@dataclass
+class CallSequenceTrieNode(object):
+    obj: SageObject = None
+    depth: int = 0
+    last_seq_index: int = -1
+    children: list = field(default_factory=list)
+    _children_by_key: dict = field(default_factory=dict)
+
+    def get_or_add_child(self, obj: SageObject):
+        child = self._children_by_key.get(obj.key, None)
+        if child is None:
+            child = CallSequenceTrieNode(obj=obj, depth=self.depth + 1)
+            self._children_by_key[obj.key] = child
+            self.children.append(child)
+        return child
+
+
+# a trie of call sequences where sequences sharing a prefix share the nodes of the prefix
+@dataclass
+class CallSequenceTrie(CallSequenceTrieNode):
+    @classmethod
+    def from_sequences(cls, call_sequences: list):
+        trie = cls(depth=-1)
+        for i, call_seq in enumerate(call_sequences):
+            node = trie
+            for obj in call_seq:
+                node = node.get_or_add_child(obj)
+                node.last_seq_index = i
+        return trie
 
 
 @dataclass
 class VariableResolver(object):
+    # this gives the same annotations as calling `traverse()` for each call sequence,
+    # but call sequences are traversed as a trie so that their common prefixes are resolved only once
     def resolve_all_vars_in_project(self, project: SageProject):
         all_call_sequences = project.get_all_call_sequences()
-        for call_seq in all_call_sequences:
-            self.traverse(call_seq=call_seq)
+        trie = CallSequenceTrie.from_sequences(all_call_sequences)
+
+        # task key --> (order, annotations); the annotations of the last traversal win like the sequential traversals
+        task_annotations = {}
+        stack = [(child, VariableContext()) for child in reversed(trie.children)]
+        while stack:
+            node, context = stack.pop()
+            obj = node.obj
+            context.add(obj)
+            if isinstance(obj, Task):
+                annotations = self.resolve_task_variables(context, obj)
+                order = (node.last_seq_index, node.depth)
+                if obj.key not in task_annotations or task_annotations[obj.key][0] < order:
+                    task_annotations[obj.key] = (order, obj, annotations)
+            # the last child takes over the context and the others resume from a checkpoint
+            children = node.children
+            for i, child in enumerate(reversed(children)):
+                child_context = context if i == 0 else context.checkpoint()
+                stack.append((child, child_context))
+
+        for _, task, (defined_vars, used_vars, arguments, loop_summary) in task_annotations.values():
+            set_task_variable_annotations(task, defined_vars, used_vars, arguments, loop_summary)
         return project
 
     def get_defined_vars(self, object: SageObject, call_seq: list):
@@ -88,112 +318,9 @@ class VariableResolver(object):
             context.add(obj)
             if isinstance(obj, Task):
                 task = obj
-                resolved = resolve_module_options(context, task)
-                resolved_module_options = resolved[0]
-                resolved_variables = resolved[1]
-                used_variables = resolved[3]
-
-                _vars = []
-                is_mutable = False
-                for rv in resolved_variables:
-                    v_name = rv.get("key", "")
-                    v_value = rv.get("value", "")
-                    v_type = rv.get("type", VariableType.Unknown)
-                    elements = []
-                    if v_name in used_variables:
-                        if not isinstance(used_variables[v_name], dict):
-                            continue
-                        for u_v_name, info in used_variables[v_name].items():
-                            if u_v_name == v_name:
-                                continue
-                            u_v_value = info.get("value", "")
-                            u_v_type = info.get("type", VariableType.Unknown)
-                            u_v = Variable(
-                                name=u_v_name,
-                                value=u_v_value,
-                                type=u_v_type,
-                                used_in=task.key,
-                            )
-                            elements.append(u_v)
-                    v = Variable(
-                        name=v_name,
-                        value=v_value,
-                        type=v_type,
-                        elements=elements,
-                        used_in=task.key,
-                    )
-                    _vars.append(v)
-                    if v.is_mutable:
-                        is_mutable = True
-
-                for v in _vars:
-                    history = context.var_use_history.get(v.name, [])
-                    history.append(v)
-                    context.var_use_history[v.name] = history
-
-                m_opts = task.module_options
-                if isinstance(m_opts, list):
-                    args_type = ArgumentsType.LIST
-                elif isinstance(m_opts, dict):
-                    args_type = ArgumentsType.DICT
-                else:
-                    args_type = ArgumentsType.SIMPLE
-                arguments = Arguments(
-                    type=args_type,
-                    raw=m_opts,
-                    vars=_vars,
-                    resolved=True,  # TODO: False if not resolved
-                    templated=resolved_module_options,
-                    is_mutable=is_mutable,
-                )
-                # deep copy the history here because the context is updated by subsequent taskcalls
-                defined_vars = copy.deepcopy(context.var_set_history)
-                used_vars = copy.deepcopy(context.var_use_history)
-                task.set_annotation(VARIABLES_SET_ANNOTATION_KEY, defined_vars)
-                task.set_annotation(VARIABLES_USED_ANNOTATION_KEY, used_vars)
-                task.set_annotation(ARGUMENTS_ANNOTATION_KEY, arguments)
-
-                defined_vars_key_value = {k: v[0].value for k, v in defined_vars.items() if v and isinstance(v[0], Variable)}
-                used_vars_key_value = {}
-                for k, v in used_vars.items():
-                    if not v:
-                        continue
-                    _var = v[0]
-                    if not isinstance(_var, Variable):
-                        continue
-
-                    # skip if this var is registered one
-                    parent_var_name = _var.name
-                    if "." in parent_var_name:
-                        parent_var_name = parent_var_name.split(".")[0]
-                    is_registered_var = False
-                    for p, q in defined_vars.items():
-                        if not q:
-                            continue
-                        _var_q = q[0]
-                        if not isinstance(_var_q, Variable):
-                            continue
-                        if _var_q.name == parent_var_name and _var_q.type == VariableType.RegisteredVars:
-                            is_registered_var = True
-                            break
-                    if is_registered_var:
-                        continue
-
-                    # skip loop var by type
-                    if _var.type == VariableType.LoopVars:
-                        continue
-
-                    # skip loop var by name
-                    # (this may be removed in the future because the type check above could be enough)
-                    var_block = "{{ " + k + " }}"
-                    if is_loop_var(var_block, task):
-                        continue
-
-                    value = _var.value
-                    if _var.type == VariableType.Unknown:
-                        value = make_value_placeholder(k)
-                    used_vars_key_value[k] = value
-
+                defined_vars, used_vars, arguments, loop_summary = self.resolve_task_variables(context, task)
+                set_task_variable_annotations(task, defined_vars, used_vars, arguments, loop_summary)
+                defined_vars_key_value, used_vars_key_value = self.get_vars_key_value(task, defined_vars, used_vars)
                 obj_and_vars_list.append((obj, defined_vars_key_value, used_vars_key_value))
             else:
                 last_defined = {}
@@ -203,6 +330,108 @@ class VariableResolver(object):
                 obj_and_vars_list.append((obj, last_defined, last_used))
         return obj_and_vars_list
 
+    # resolve variables used in the task with the current context
+    # this returns snapshots of defined/used vars history, Arguments and the loop summary of the task
+    def resolve_task_variables(self, context, task: Task):
+        resolved = resolve_module_options(context, task)
+        resolved_module_options = resolved[0]
+        resolved_variables = resolved[1]
+        used_variables = resolved[3]
+        loop_summary = resolved[4]
+
+        _vars = []
+        is_mutable = False
+        for rv in resolved_variables:
+            v_name = rv.get("key", "")
+            v_value = rv.get("value", "")
+            v_type = rv.get("type", VariableType.Unknown)
+            elements = []
+            if v_name in used_variables:
+                if not isinstance(used_variables[v_name], dict):
+                    continue
+                for u_v_name, info in used_variables[v_name].items():
+                    if u_v_name == v_name:
+                        continue
+                    u_v_value = info.get("value", "")
+                    u_v_type = info.get("type", VariableType.Unknown)
+                    u_v = Variable(
+                        name=u_v_name,
+                        value=u_v_value,
+                        type=u_v_type,
+                        used_in=task.key,
+                    )
+                    elements.append(u_v)
+            v = Variable(
+                name=v_name,
+                value=v_value,
+                type=v_type,
+                elements=elements,
+                used_in=task.key,
+            )
+            _vars.append(v)
+            if v.is_mutable:
+                is_mutable = True
+
+        for v in _vars:
+            context.var_use_history.append(v.name, v)
+
+        m_opts = task.module_options
+        if isinstance(m_opts, list):
+            args_type = ArgumentsType.LIST
+        elif isinstance(m_opts, dict):
+            args_type = ArgumentsType.DICT
+        else:
+            args_type = ArgumentsType.SIMPLE
+        arguments = Arguments(
+            type=args_type,
+            raw=m_opts,
+            vars=_vars,
+            resolved=True,  # TODO: False if not resolved
+            templated=resolved_module_options,
+            is_mutable=is_mutable,
+        )
+        # take snapshots of the history here because the context is updated by subsequent taskcalls
+        defined_vars = context.var_set_history.snapshot()
+        used_vars = context.var_use_history.snapshot()
+        return defined_vars, used_vars, arguments, loop_summary
+
+    # return dicts of defined vars and used vars with their values
+    def get_vars_key_value(self, task: Task, defined_vars, used_vars):
+        first_defined_vars = {k: defined_vars.first(k) for k in defined_vars}
+        defined_vars_key_value = {k: v.value for k, v in first_defined_vars.items() if isinstance(v, Variable)}
+        registered_var_names = set([
+            v.name for v in first_defined_vars.values() if isinstance(v, Variable) and v.type == VariableType.RegisteredVars
+        ])
+        used_vars_key_value = {}
+        for k in used_vars:
+            _var = used_vars.first(k)
+            if not isinstance(_var, Variable):
+                continue
+
+            # skip if this var is registered one
+            parent_var_name = _var.name
+            if "." in parent_var_name:
+                parent_var_name = parent_var_name.split(".")[0]
+            if parent_var_name in registered_var_names:
+                continue
+
+            # skip loop var by type
+            if _var.type == VariableType.LoopVars:
+                continue
+
+            # skip loop var by name
+            # (this may be removed in the future because the type check above could be enough)
+            var_block = "{{ " + k + " }}"
+            if is_loop_var(var_block, task):
+                continue
+
+            value = _var.value
+            if _var.type == VariableType.Unknown:
+                value = make_value_placeholder(k)
+            used_vars_key_value[k] = value
+
+        return defined_vars_key_value, used_vars_key_value
+
     def update_resolved_vars_dict(self, vars_dict, var_name, var_value):
         def _recursive_update(d, keys, value):
             if not isinstance(d, dict):
@@ -230,6 +459,15 @@ class VariableResolver(object):
         return updated
 
 
+def set_task_variable_annotations(task: Task, defined_vars, used_vars, arguments, loop_summary=None):
+    task.set_annotation(VARIABLES_SET_ANNOTATION_KEY, defined_vars)
+    task.set_annotation(VARIABLES_USED_ANNOTATION_KEY, used_vars)
+    task.set_annotation(ARGUMENTS_ANNOTATION_KEY, arguments)
+    if loop_summary is not None:
+        task.set_annotation(LOOP_SUMMARY_ANNOTATION_KEY, loop_summary)
+    return
+
+
 def make_value_placeholder(var_name: str):
     if "." in var_name:
         var_name = var_name.replace(".", "_")
@@ -285,11 +523,29 @@ class VariableContext:
     become: BecomeInfo = None
     module_defaults: dict = field(default_factory=dict)
 
-    var_set_history: dict = field(default_factory=dict)
-    var_use_history: dict = field(default_factory=dict)
+    var_set_history: VariableHistory = field(default_factory=VariableHistory)
+    var_use_history: VariableHistory = field(default_factory=VariableHistory)
 
     _flat_vars: dict = field(default_factory=dict)
 
+    # sets of the names in the lists above for type classification
+    _role_defaults_set: set = field(init=False, repr=False, compare=False)
+    _role_vars_set: set = field(init=False, repr=False, compare=False)
+    _registered_vars_set: set = field(init=False, repr=False, compare=False)
+    _set_facts_set: set = field(init=False, repr=False, compare=False)
+
+    # results of top-level `resolve_variable()` calls and the reverse dependencies of them
+    # (variable name --> names of the cached variables whose resolution consulted it)
+    _resolve_cache: dict = field(init=False, repr=False, compare=False, default_factory=dict)
+    _resolve_deps: dict = field(init=False, repr=False, compare=False, default_factory=dict)
+    _inventory_vars_cache: tuple = field(init=False, repr=False, compare=False, default=None)
+
+    def __post_init__(self):
+        self._role_defaults_set = set(self.role_defaults)
+        self._role_vars_set = set(self.role_vars)
+        self._registered_vars_set = set(self.registered_vars)
+        self._set_facts_set = set(self.set_facts)
+
     def add(self, obj):
         _spec = None
         if isinstance(obj, SageObject):
@@ -299,16 +555,12 @@ class VariableContext:
             self.variables.update(_spec.variables)
             self.update_flat_vars(_spec.variables)
             for key, val in _spec.variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.PlaybookGroupVarsAll, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.PlaybookGroupVarsAll, setter=_spec.key))
         elif isinstance(_spec, Play):
             self.variables.update(_spec.variables)
             self.update_flat_vars(_spec.variables)
             for key, val in _spec.variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.PlayVars, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.PlayVars, setter=_spec.key))
             if _spec.become:
                 self.become = _spec.become
             if _spec.module_defaults:
@@ -320,16 +572,14 @@ class VariableContext:
             self.update_flat_vars(_spec.variables)
             for var_name in _spec.default_variables:
                 self.role_defaults.append(var_name)
+                self._role_defaults_set.add(var_name)
             for var_name in _spec.variables:
                 self.role_vars.append(var_name)
+                self._role_vars_set.add(var_name)
             for key, val in _spec.default_variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.RoleDefaults, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.RoleDefaults, setter=_spec.key))
             for key, val in _spec.variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.RoleVars, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.RoleVars, setter=_spec.key))
         elif isinstance(_spec, Collection):
             self.variables.update(_spec.variables)
             self.update_flat_vars(_spec.variables)
@@ -345,20 +595,16 @@ class VariableContext:
             self.update_flat_vars(_spec.set_facts)
             for var_name in _spec.registered_variables:
                 self.registered_vars.append(var_name)
+                self._registered_vars_set.add(var_name)
             for var_name in _spec.set_facts:
                 self.set_facts.append(var_name)
+                self._set_facts_set.add(var_name)
             for key, val in _spec.variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.TaskVars, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.TaskVars, setter=_spec.key))
             for key, val in _spec.registered_variables.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.RegisteredVars, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.RegisteredVars, setter=_spec.key))
             for key, val in _spec.set_facts.items():
-                current = self.var_set_history.get(key, [])
-                current.append(Variable(name=key, value=val, type=VariableType.SetFacts, setter=_spec.key))
-                self.var_set_history[key] = current
+                self.var_set_history.append(key, Variable(name=key, value=val, type=VariableType.SetFacts, setter=_spec.key))
             if _spec.become:
                 self.become = _spec.become
             if _spec.module_defaults:
@@ -374,83 +620,84 @@ class VariableContext:
             v_type = resolve_history[var_name].get("type", VariableType.Unknown)
             return val, v_type, resolve_history
 
-        _resolve_history = resolve_history.copy()
+        if resolve_history:
+            return self._resolve_variable(var_name, resolve_history.copy())
+
+        # a top-level resolution does not depend on any history, so its result can be reused
+        # until one of the variables it depends on is updated by `add()`
+        cached = self._resolve_cache.get(var_name, None)
+        if cached is None:
+            cached = self._resolve_variable(var_name, {})
+            self._resolve_cache[var_name] = cached
+            # names in the history are the variables consulted during the resolution
+            for dep_name in cached[2]:
+                if dep_name not in self._resolve_deps:
+                    self._resolve_deps[dep_name] = set()
+                self._resolve_deps[dep_name].add(var_name)
+        val, v_type, _resolve_history = cached
+        if isinstance(val, list):
+            val = val.copy()
+        return val, v_type, _resolve_history.copy()
+
+    # resolve a variable by updating the given history in place
+    def _resolve_variable(self, var_name, _resolve_history):
+        if var_name in _resolve_history:
+            val = _resolve_history[var_name].get("value", None)
+            v_type = _resolve_history[var_name].get("type", VariableType.Unknown)
+            return val, v_type, _resolve_history
 
         v_type = None
-        if var_name in ansible_special_variables:
+        if var_name in ansible_special_variable_set:
             v_type = VariableType.HostFacts
-            return None, v_type, resolve_history
+            return None, v_type, _resolve_history
 
-        if var_name in self.role_vars:
+        if var_name in self._role_vars_set:
             v_type = VariableType.RoleVars
-        elif var_name in self.role_defaults:
+        elif var_name in self._role_defaults_set:
             v_type = VariableType.RoleDefaults
-        elif var_name in self.registered_vars:
+        elif var_name in self._registered_vars_set:
             v_type = VariableType.RegisteredVars
-        elif var_name in self.set_facts:
+        elif var_name in self._set_facts_set:
             v_type = VariableType.SetFacts
         else:
             v_type = VariableType.TaskVars
 
         val = self.variables.get(var_name, None)
-        if val is not None:
-            _resolve_history[var_name] = {"value": val, "type": v_type}
-
-            if isinstance(val, str):
-                resolved_val, _resolve_history = self.resolve_single_variable(val, _resolve_history)
-                return resolved_val, v_type, _resolve_history
-            elif isinstance(val, list):
-                resolved_val_list = []
-                for vi in val:
-                    resolved_val, _resolve_history = self.resolve_single_variable(vi, _resolve_history)
-                    resolved_val_list.append(resolved_val)
-                return resolved_val_list, v_type, _resolve_history
-            else:
-                return val, v_type, _resolve_history
-
-        val = self._flat_vars.get(var_name, None)
-        if val is not None:
-            _resolve_history[var_name] = {"value": val, "type": v_type}
-
-            if isinstance(val, str):
-                resolved_val, _resolve_history = self.resolve_single_variable(val, _resolve_history)
-                return resolved_val, v_type, _resolve_history
-            elif isinstance(val, list):
-                resolved_val_list = []
-                for vi in val:
-                    resolved_val, _resolve_history = self.resolve_single_variable(vi, _resolve_history)
-                    resolved_val_list.append(resolved_val)
-                return resolved_val_list, v_type, _resolve_history
-            else:
-                return val, v_type, _resolve_history
-
-        # TODO: consider group
-        inventory_for_all = [iv for iv in self.inventories if iv.inventory_type == InventoryType.GROUP_VARS_TYPE and iv.name == "all"]
-        for iv in inventory_for_all:
-            iv_var_dict = flatten_vars_dict(iv.variables)
-            val = iv_var_dict.get(var_name, None)
-
-            if val is not None:
-                _resolve_history[var_name] = {"value": val, "type": v_type}
-                v_type = VariableType.InventoryGroupVarsAll
-                if isinstance(val, str):
-                    resolved_val, _resolve_history = self.resolve_single_variable(val, _resolve_history)
-                    return resolved_val, v_type, _resolve_history
-                elif isinstance(val, list):
-                    resolved_val_list = []
-                    for vi in val:
-                        resolved_val, _resolve_history = self.resolve_single_variable(vi, _resolve_history)
-                        resolved_val_list.append(resolved_val)
-                    return resolved_val_list, v_type, _resolve_history
-                else:
-                    return val, v_type, _resolve_history
+        if val is None:
+            val = self._flat_vars.get(var_name, None)
+        if val is None:
+            # TODO: consider group
+            for iv_var_dict in self._get_inventory_vars_for_all():
+                val = iv_var_dict.get(var_name, None)
+                if val is not None:
+                    _resolve_history[var_name] = {"value": val, "type": v_type}
+                    v_type = VariableType.InventoryGroupVarsAll
+                    return self._resolve_value(val, v_type, _resolve_history)
 
-        _resolve_history[var_name] = {"value": None, "type": VariableType.Unknown}
+            _resolve_history[var_name] = {"value": None, "type": VariableType.Unknown}
+            return None, VariableType.Unknown, _resolve_history
 
-        return None, VariableType.Unknown, _resolve_history
+        _resolve_history[var_name] = {"value": val, "type": v_type}
+        return self._resolve_value(val, v_type, _resolve_history)
+
+    def _resolve_value(self, val, v_type, _resolve_history):
+        if isinstance(val, str):
+            resolved_val, _resolve_history = self._resolve_single_variable(val, _resolve_history)
+            return resolved_val, v_type, _resolve_history
+        elif isinstance(val, list):
+            resolved_val_list = []
+            for vi in val:
+                resolved_val, _resolve_history = self._resolve_single_variable(vi, _resolve_history)
+                resolved_val_list.append(resolved_val)
+            return resolved_val_list, v_type, _resolve_history
+        else:
+            return val, v_type, _resolve_history
 
     def resolve_single_variable(self, txt, resolve_history=[]):
-        new_history = resolve_history.copy()
+        return self._resolve_single_variable(txt, resolve_history.copy())
+
+    # resolve variables in a text by updating the given history in place
+    def _resolve_single_variable(self, txt, new_history):
         if not isinstance(txt, str):
             return txt, new_history
         if "{{" in txt:
@@ -462,9 +709,9 @@ class VariableContext:
                 original_block = var_name_in_txt.get("original", "")
                 var_name = var_name_in_txt.get("name", "")
                 default_var_name = var_name_in_txt.get("default", "")
-                var_val_in_txt, _, new_history = self.resolve_variable(var_name, new_history)
+                var_val_in_txt, _, new_history = self._resolve_variable(var_name, new_history)
                 if var_val_in_txt is None and default_var_name != "":
-                    var_val_in_txt, _, new_history = self.resolve_variable(default_var_name, new_history)
+                    var_val_in_txt, _, new_history = self._resolve_variable(default_var_name, new_history)
                 if var_val_in_txt is None:
                     return resolved_txt, new_history
                 if txt == original_block:
@@ -474,18 +721,61 @@ class VariableContext:
         else:
             return txt, new_history
 
+    # flattened variables of the inventories for `all` group, which are computed only once
+    def _get_inventory_vars_for_all(self):
+        cache_key = (id(self.inventories), len(self.inventories))
+        if self._inventory_vars_cache is None or self._inventory_vars_cache[0] != cache_key:
+            inventory_for_all = [iv for iv in self.inventories if iv.inventory_type == InventoryType.GROUP_VARS_TYPE and iv.name == "all"]
+            self._inventory_vars_cache = (cache_key, [flatten_vars_dict(iv.variables) for iv in inventory_for_all])
+        return self._inventory_vars_cache[1]
+
+    # drop the cached resolutions which depend on the updated variable
+    def _invalidate_resolve_cache(self, var_name):
+        if not self._resolve_cache:
+            return
+        dependents = self._resolve_deps.pop(var_name, None)
+        if not dependents:
+            return
+        for dependent in dependents:
+            self._resolve_cache.pop(dependent, None)
+
     def update_flat_vars(self, new_vars: dict, _prefix: str = ""):
         for k, v in new_vars.items():
             if isinstance(v, dict):
                 flat_var_name = f"{_prefix}{k}"
                 self._flat_vars.update({flat_var_name: v})
+                self._invalidate_resolve_cache(flat_var_name)
                 new_prefix = f"{flat_var_name}."
                 self.update_flat_vars(v, new_prefix)
             else:
                 flat_key = f"{_prefix}{k}"
                 self._flat_vars.update({flat_key: v})
+                self._invalidate_resolve_cache(flat_key)
         return
 
+    # return a copy of this context to resume a traversal from this point
+    # unlike `copy()`, all the state including the variable history is copied
+    def checkpoint(self):
+        new_context = VariableContext(
+            keep_obj=self.keep_obj,
+            variables=copy.copy(self.variables),
+            options=copy.copy(self.options),
+            inventories=copy.copy(self.inventories),
+            role_defaults=copy.copy(self.role_defaults),
+            role_vars=copy.copy(self.role_vars),
+            registered_vars=copy.copy(self.registered_vars),
+            set_facts=copy.copy(self.set_facts),
+            task_vars=copy.copy(self.task_vars),
+            become=self.become,
+            module_defaults=copy.copy(self.module_defaults),
+            var_set_history=self.var_set_history.fork(),
+            var_use_history=self.var_use_history.fork(),
+            _flat_vars=copy.copy(self._flat_vars),
+        )
+        new_context._resolve_cache = copy.copy(self._resolve_cache)
+        new_context._resolve_deps = {name: dependents.copy() for name, dependents in self._resolve_deps.items()}
+        return new_context
+
     def copy(self):
         return VariableContext(
             keep_obj=self.keep_obj,
@@ -499,12 +789,57 @@ class VariableContext:
         # return copy.deepcopy(self)
 
 
-def resolve_module_options(context: VariableContext, task: Task):
+# resolve variables in module options of the task with the context
+# module options are templated for each loop item; if `lazy_loop` is True, only the first item is templated
+# and the rest can be expanded later by `expand_loop_module_options()`. `max_loop_items` limits the number
+# of templated items (0 means no limit). the loop summary is None if all the loop items are templated
+def resolve_module_options(context: VariableContext, task: Task, lazy_loop: bool = None, max_loop_items: int = None):
+    if lazy_loop is None:
+        lazy_loop = FEATURE_LAZY_LOOP_TEMPLATING
+    if max_loop_items is None:
+        max_loop_items = MAX_LOOP_ITEMS
+
     resolved_vars = []
-    variables_in_loop = []
     used_variables = {}
+
+    def resolve(var_name):
+        resolved_var_val, v_type, resolve_history = context.resolve_variable(var_name)
+        used_variables[var_name] = resolve_history
+        return resolved_var_val, v_type
+
+    # the max number of items to be templated (-1 means no limit)
+    max_templated_items = -1
+    if lazy_loop:
+        max_templated_items = 1
+    if max_loop_items > 0:
+        max_templated_items = max_loop_items if max_templated_items < 0 else min(max_templated_items, max_loop_items)
+
+    # all the loop items are iterated to resolve the variables in them, but only the items to be templated are kept;
+    # the rest are only counted in the loop summary
+    variables_to_template = []
+    loop_summary = None
+    for variables in iter_variables_in_loop(task, resolve, resolved_vars):
+        if max_templated_items < 0 or len(variables_to_template) < max_templated_items:
+            variables_to_template.append(variables)
+            continue
+        if loop_summary is None:
+            loop_summary = make_loop_summary(task, variables_to_template, len(variables_to_template))
+        add_item_to_loop_summary(loop_summary, task, variables)
+
+    resolved_opts_in_loop = []
+    mutable_vars_per_mo = {}
+    for variables in variables_to_template:
+        resolved_opts = template_module_options(task.module_options, variables, resolve, resolved_vars, mutable_vars_per_mo)
+        resolved_opts_in_loop.append(resolved_opts)
+    return resolved_opts_in_loop, resolved_vars, mutable_vars_per_mo, used_variables, loop_summary
+
+
+# yield variable dicts, each of which has the variables for a single loop item
+# `resolve` takes a variable name and returns its resolved value and type
+# variables used in the loop are resolved and added to `resolved_vars` while the items are iterated
+def iter_variables_in_loop(task: Task, resolve, resolved_vars: list):
     if len(task.loop) == 0:
-        variables_in_loop = [{}]
+        yield {}
     else:
         loop_key = list(task.loop.keys())[0]
         loop_values = task.loop.get(loop_key, [])
@@ -518,11 +853,10 @@ def resolve_module_options(context: VariableContext, task: Task):
         if isinstance(loop_values, str):
             var_names = extract_variable_names(loop_values)
             if len(var_names) == 0:
-                variables_in_loop.append({loop_key: loop_values})
+                yield {loop_key: loop_values}
             else:
                 var_name = var_names[0].get("name", "")
-                resolved_vars_in_item, v_type, resolve_history = context.resolve_variable(var_name)
-                used_variables[var_name] = resolve_history
+                resolved_vars_in_item, v_type = resolve(var_name)
                 new_var = {
                     "key": var_name,
                     "value": resolved_vars_in_item,
@@ -532,7 +866,7 @@ def resolve_module_options(context: VariableContext, task: Task):
                     resolved_vars.append(new_var)
                 if isinstance(resolved_vars_in_item, list):
                     for vi in resolved_vars_in_item:
-                        variables_in_loop.append(
+                        yield (
                             {
                                 loop_key: vi,
                                 "__v_type__": v_type,
@@ -541,7 +875,7 @@ def resolve_module_options(context: VariableContext, task: Task):
                         )
                 if isinstance(resolved_vars_in_item, dict):
                     for vi_key, vi_value in resolved_vars_in_item.items():
-                        variables_in_loop.append(
+                        yield (
                             {
                                 loop_key + ".key": vi_key,
                                 loop_key + ".value": vi_value,
@@ -549,7 +883,7 @@ def resolve_module_options(context: VariableContext, task: Task):
                             }
                         )
                 else:
-                    variables_in_loop.append(
+                    yield (
                         {
                             loop_key: resolved_vars_in_item,
                             "__v_type__": v_type,
@@ -561,11 +895,10 @@ def resolve_module_options(context: VariableContext, task: Task):
                 if isinstance(v, str) and variable_block_re.search(v):
                     var_names = extract_variable_names(v)
                     if len(var_names) == 0:
-                        variables_in_loop.append({loop_key: v})
+                        yield {loop_key: v}
                         continue
                     var_name = var_names[0].get("name", "")
-                    resolved_vars_in_item, v_type, resolve_history = context.resolve_variable(var_name)
-                    used_variables[var_name] = resolve_history
+                    resolved_vars_in_item, v_type = resolve(var_name)
                     new_var = {
                         "key": var_name,
                         "value": resolved_vars_in_item,
@@ -574,7 +907,7 @@ def resolve_module_options(context: VariableContext, task: Task):
                     if not resolved_vars_contains(resolved_vars, new_var):
                         resolved_vars.append(new_var)
                     if not isinstance(resolved_vars_in_item, list):
-                        variables_in_loop.append(
+                        yield (
                             {
                                 loop_key: resolved_vars_in_item,
                                 "__v_type__": v_type,
@@ -583,7 +916,7 @@ def resolve_module_options(context: VariableContext, task: Task):
                         )
                         continue
                     for vi in resolved_vars_in_item:
-                        variables_in_loop.append(
+                        yield (
                             {
                                 loop_key: vi,
                                 "__v_type__": v_type,
@@ -596,155 +929,159 @@ def resolve_module_options(context: VariableContext, task: Task):
                         for k2, v2 in v.items():
                             key = "{}.{}".format(loop_key, k2)
                             tmp_variables.update({key: v2})
-                        variables_in_loop.append(tmp_variables)
+                        yield tmp_variables
                     else:
-                        variables_in_loop.append({loop_key: v})
+                        yield {loop_key: v}
         elif isinstance(loop_values, dict):
             tmp_variables = {}
             for k, v in loop_values.items():
                 key = "{}.{}".format(loop_key, k)
                 tmp_variables.update({key: v})
-            variables_in_loop.append(tmp_variables)
+            yield tmp_variables
         else:
             if loop_values:
                 raise ValueError("loop_values of type {} is not supported yet".format(type(loop_values).__name__))
 
-    resolved_opts_in_loop = []
-    mutable_vars_per_mo = {}
+
+# return a list of variable dicts for all the loop items
+def get_variables_in_loop(task: Task, resolve, resolved_vars: list):
+    return list(iter_variables_in_loop(task, resolve, resolved_vars))
+
+
+# template module options with the variables of a single loop item
+# variables not in `variables` are resolved by `resolve`
+def template_module_options(module_options, variables: dict, resolve, resolved_vars: list, mutable_vars_per_mo: dict):
+    if isinstance(module_options, dict):
+        resolved_opts = {}
+        for (
+            module_opt_key,
+            module_opt_val,
+        ) in module_options.items():
+            if not isinstance(module_opt_val, str):
+                resolved_opts[module_opt_key] = module_opt_val
+                continue
+            if not variable_block_re.search(module_opt_val):
+                resolved_opts[module_opt_key] = module_opt_val
+                continue
+            # if variables are used in the module option value string
+            resolved_opts[module_opt_key] = template_module_option_value(
+                module_opt_key, module_opt_val, variables, resolve, resolved_vars, mutable_vars_per_mo
+            )
+        return resolved_opts
+    elif isinstance(module_options, str):
+        resolved_opt_val = module_options
+        if variable_block_re.search(resolved_opt_val):
+            resolved_opt_val = template_module_option_value("", module_options, variables, resolve, resolved_vars, mutable_vars_per_mo)
+        return resolved_opt_val
+    else:
+        return module_options
+
+
+def template_module_option_value(module_opt_key, module_opt_val, variables: dict, resolve, resolved_vars: list, mutable_vars_per_mo: dict):
+    var_names = extract_variable_names(module_opt_val)
+    resolved_opt_val = module_opt_val
+    for var_name_dict in var_names:
+        original_block = var_name_dict.get("original", "")
+        var_name = var_name_dict.get("name", "")
+        default_var_name = var_name_dict.get("default", "")
+        resolved_var_val = variables.get(var_name, None)
+        if resolved_var_val is not None:
+            loop_var_type = variables.get("__v_type__", VariableType.Unknown)
+            loop_var_name = variables.get("__v_name__", "")
+            if loop_var_type not in immutable_var_types:
+                if module_opt_key not in mutable_vars_per_mo:
+                    mutable_vars_per_mo[module_opt_key] = []
+                mutable_vars_per_mo[module_opt_key].append(loop_var_name)
+        if resolved_var_val is None:
+            resolved_var_val, v_type = resolve(var_name)
+            if resolved_var_val is not None:
+                new_var = {
+                    "key": var_name,
+                    "value": resolved_var_val,
+                    "type": v_type,
+                }
+                if not resolved_vars_contains(resolved_vars, new_var):
+                    resolved_vars.append(new_var)
+                if v_type not in immutable_var_types:
+                    if module_opt_key not in mutable_vars_per_mo:
+                        mutable_vars_per_mo[module_opt_key] = []
+                    mutable_vars_per_mo[module_opt_key].append(var_name)
+        if resolved_var_val is None and default_var_name != "":
+            resolved_var_val, v_type = resolve(default_var_name)
+            if resolved_var_val is not None:
+                new_var = {
+                    "key": default_var_name,
+                    "value": resolved_var_val,
+                    "type": v_type,
+                }
+                if not resolved_vars_contains(resolved_vars, new_var):
+                    resolved_vars.append(new_var)
+                if v_type not in immutable_var_types:
+                    if module_opt_key not in mutable_vars_per_mo:
+                        mutable_vars_per_mo[module_opt_key] = []
+                    mutable_vars_per_mo[module_opt_key].append(var_name)
+        if resolved_var_val is None:
+            new_var = {
+                "key": var_name,
+                "value": None,
+                "type": v_type,
+            }
+            if not resolved_vars_contains(resolved_vars, new_var):
+                resolved_vars.append(new_var)
+            continue
+        if resolved_opt_val == original_block:
+            resolved_opt_val = resolved_var_val
+            break
+        resolved_opt_val = resolved_opt_val.replace(original_block, str(resolved_var_val))
+    return resolved_opt_val
+
+
+# summary of loop items for a task whose module options are not templated for all the items
+# more items can be added by `add_item_to_loop_summary()`
+def make_loop_summary(task: Task, variables_in_loop: list, num_of_templated_items: int):
+    loop_summary = {
+        "num_of_items": 0,
+        "num_of_templated_items": num_of_templated_items,
+        "item_types": [],
+    }
     for variables in variables_in_loop:
-        resolved_opts = None
-        if isinstance(task.module_options, dict):
-            resolved_opts = {}
-            for (
-                module_opt_key,
-                module_opt_val,
-            ) in task.module_options.items():
-                if not isinstance(module_opt_val, str):
-                    resolved_opts[module_opt_key] = module_opt_val
-                    continue
-                if not variable_block_re.search(module_opt_val):
-                    resolved_opts[module_opt_key] = module_opt_val
-                    continue
-                # if variables are used in the module option value string
-                var_names = extract_variable_names(module_opt_val)
-                resolved_opt_val = module_opt_val
-                for var_name_dict in var_names:
-                    original_block = var_name_dict.get("original", "")
-                    var_name = var_name_dict.get("name", "")
-                    default_var_name = var_name_dict.get("default", "")
-                    resolved_var_val = variables.get(var_name, None)
-                    if resolved_var_val is not None:
-                        loop_var_type = variables.get("__v_type__", VariableType.Unknown)
-                        loop_var_name = variables.get("__v_name__", "")
-                        if loop_var_type not in immutable_var_types:
-                            if module_opt_key not in mutable_vars_per_mo:
-                                mutable_vars_per_mo[module_opt_key] = []
-                            mutable_vars_per_mo[module_opt_key].append(loop_var_name)
-                    if resolved_var_val is None:
-                        resolved_var_val, v_type, resolve_history = context.resolve_variable(var_name)
-                        used_variables[var_name] = resolve_history
-                        if resolved_var_val is not None:
-                            new_var = {
-                                "key": var_name,
-                                "value": resolved_var_val,
-                                "type": v_type,
-                            }
-                            if not resolved_vars_contains(resolved_vars, new_var):
-                                resolved_vars.append(new_var)
-                            if v_type not in immutable_var_types:
-                                if module_opt_key not in mutable_vars_per_mo:
-                                    mutable_vars_per_mo[module_opt_key] = []
-                                mutable_vars_per_mo[module_opt_key].append(var_name)
-                    if resolved_var_val is None and default_var_name != "":
-                        resolved_var_val, v_type, resolve_history = context.resolve_variable(default_var_name)
-                        used_variables[default_var_name] = resolve_history
-                        if resolved_var_val is not None:
-                            new_var = {
-                                "key": default_var_name,
-                                "value": resolved_var_val,
-                                "type": v_type,
-                            }
-                            if not resolved_vars_contains(resolved_vars, new_var):
-                                resolved_vars.append(new_var)
-                            if v_type not in immutable_var_types:
-                                if module_opt_key not in mutable_vars_per_mo:
-                                    mutable_vars_per_mo[module_opt_key] = []
-                                mutable_vars_per_mo[module_opt_key].append(var_name)
-                    if resolved_var_val is None:
-                        new_var = {
-                            "key": var_name,
-                            "value": None,
-                            "type": v_type,
-                        }
-                        if not resolved_vars_contains(resolved_vars, new_var):
-                            resolved_vars.append(new_var)
-                        continue
-                    if resolved_opt_val == original_block:
-                        resolved_opt_val = resolved_var_val
-                        break
-                    resolved_opt_val = resolved_opt_val.replace(original_block, str(resolved_var_val))
-                resolved_opts[module_opt_key] = resolved_opt_val
-        elif isinstance(task.module_options, str):
-            resolved_opt_val = task.module_options
-            if variable_block_re.search(resolved_opt_val):
-                var_names = extract_variable_names(task.module_options)
-                for var_name_dict in var_names:
-                    original_block = var_name_dict.get("original", "")
-                    var_name = var_name_dict.get("name", "")
-                    default_var_name = var_name_dict.get("default", "")
-                    resolved_var_val = variables.get(var_name, None)
-                    if resolved_var_val is not None:
-                        loop_var_type = variables.get("__v_type__", VariableType.Unknown)
-                        loop_var_name = variables.get("__v_name__", "")
-                        if loop_var_type not in immutable_var_types:
-                            if "" not in mutable_vars_per_mo:
-                                mutable_vars_per_mo[""] = []
-                            mutable_vars_per_mo[""].append(loop_var_name)
-                    if resolved_var_val is None:
-                        resolved_var_val, v_type, resolve_history = context.resolve_variable(var_name)
-                        used_variables[var_name] = resolve_history
-                        if resolved_var_val is not None:
-                            new_var = {
-                                "key": var_name,
-                                "value": resolved_var_val,
-                                "type": v_type,
-                            }
-                            if not resolved_vars_contains(resolved_vars, new_var):
-                                resolved_vars.append(new_var)
-                            if v_type not in immutable_var_types:
-                                if "" not in mutable_vars_per_mo:
-                                    mutable_vars_per_mo[""] = []
-                                mutable_vars_per_mo[""].append(var_name)
-                    if resolved_var_val is None and default_var_name != "":
-                        resolved_var_val, v_type, resolve_history = context.resolve_variable(default_var_name)
-                        used_variables[default_var_name] = resolve_history
-                        if resolved_var_val is not None:
-                            new_var = {
-                                "key": default_var_name,
-                                "value": resolved_var_val,
-                                "type": v_type,
-                            }
-                            if not resolved_vars_contains(resolved_vars, new_var):
-                                resolved_vars.append(new_var)
-                            if v_type not in immutable_var_types:
-                                if "" not in mutable_vars_per_mo:
-                                    mutable_vars_per_mo[""] = []
-                                mutable_vars_per_mo[""].append(var_name)
-                    if resolved_var_val is None:
-                        new_var = {
-                            "key": var_name,
-                            "value": None,
-                            "type": v_type,
-                        }
-                        if not resolved_vars_contains(resolved_vars, new_var):
-                            resolved_vars.append(new_var)
-                        continue
-                    if resolved_opt_val == original_block:
-                        resolved_opt_val = resolved_var_val
-                        break
-                    resolved_opt_val = resolved_opt_val.replace(original_block, str(resolved_var_val))
-            resolved_opts = resolved_opt_val
-        else:
-            resolved_opts = task.module_options
-        resolved_opts_in_loop.append(resolved_opts)
-    return resolved_opts_in_loop, resolved_vars, mutable_vars_per_mo, used_variables
+        add_item_to_loop_summary(loop_summary, task, variables)
+    return loop_summary
+
+
+def add_item_to_loop_summary(loop_summary: dict, task: Task, variables: dict):
+    loop_key = list(task.loop.keys())[0]
+    item_type = type(variables[loop_key]).__name__ if loop_key in variables else "dict"
+    if item_type not in loop_summary["item_types"]:
+        loop_summary["item_types"].append(item_type)
+    loop_summary["num_of_items"] += 1
+    return
+
+
+# template module options for all the loop items (up to `max_items`) after the variable resolution
+# this uses the resolved variables in the `arguments` annotation, so it must be called before the annotation is omitted
+def expand_loop_module_options(task: Task, max_items: int = None):
+    if max_items is None:
+        max_items = MAX_LOOP_ITEMS
+    arguments = task.get_annotation(ARGUMENTS_ANNOTATION_KEY)
+    if not arguments:
+        return []
+
+    resolved_values = {}
+    for v in arguments.vars:
+        if v.name not in resolved_values:
+            resolved_values[v.name] = (v.value, v.type)
+
+    def resolve(var_name):
+        return resolved_values.get(var_name, (None, VariableType.Unknown))
+
+    # `resolve` here only reads the resolved values, so the loop items after `max_items` need not be iterated
+    variables_in_loop = iter_variables_in_loop(task, resolve, [])
+    if max_items > 0:
+        variables_in_loop = islice(variables_in_loop, max_items)
+    templated = [template_module_options(task.module_options, variables, resolve, [], {}) for variables in variables_in_loop]
+    arguments.templated = templated
+    loop_summary = task.get_annotation(LOOP_SUMMARY_ANNOTATION_KEY)
+    if loop_summary:
+        loop_summary["num_of_templated_items"] = len(templated)
+    return templated
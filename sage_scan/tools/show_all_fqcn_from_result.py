@@ -25,7 +25,7 @@ from ansible_risk_insight.models import (
     TaskCall,
     AnsibleRunContext,
 )
-from ansible_risk_insight.risk_assessment_model import RAMClient
+from sage_scan.process.kb_index import load_kb_client
 import tabulate
 
 
@@ -39,7 +39,8 @@ if ARI_KB_DATA_DIR is None:
 if not os.path.exists(ARI_KB_DATA_DIR):
     raise ValueError(f"the ARI_KB_DATA_DIR does not exist: {ARI_KB_DATA_DIR}")
 
-ram_client = RAMClient(root_dir=ARI_KB_DATA_DIR)
+# use the prebuilt index file if `SAGE_KB_INDEX_FILE` is set
+ram_client = load_kb_client(ARI_KB_DATA_DIR)
 
 
 def get_module_fqcn(module_name):
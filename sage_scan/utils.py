@@ -23,6 +23,7 @@ from ansible_risk_insight.finder import (
 from ansible_risk_insight.risk_detector import load_rules
 import re
 import os
+from functools import lru_cache
 import pathlib
 import pygit2
 import jsonpickle
@@ -184,77 +185,99 @@ def dump_new_findings_list(new_findings_list, fpath):
 
 
 variable_block_re = re.compile(r"{{[^}]+}}")
+dict_subscript_re = re.compile(r'(\w+)\[(\'|").*(\'|")\]')
+list_subscript_re = re.compile(r'(\w+)\[\-?\d+\]')
+starts_with_digit_re = re.compile(r"[0-9].*")
+expression_skip_elements = {"if", "else", "+", "is", "defined"}
+
+# the same template strings appear many times in a project (and across projects),
+# so the extracted variable names are cached by the template string
+variable_names_cache_size = 16384
 
 
 def extract_variable_names(txt):
-    if not variable_block_re.search(txt):
+    if "{{" not in txt:
         return []
-    found_var_blocks = variable_block_re.findall(txt)
+    # the cached blocks are shared, so return copies of them
+    return [dict(b) for b in _extract_variable_names(txt)]
+
+
+@lru_cache(maxsize=variable_names_cache_size)
+def _extract_variable_names(txt):
     blocks = []
-    for b in found_var_blocks:
-        if "lookup(" in b.replace(" ", ""):
-            continue
-        parts = b.split("|")
-        var_name = ""
-        default_var_name = ""
-        for i, p in enumerate(parts):
-            if i == 0:
-                var_name = p.replace("{{", "").replace("}}", "")
-                if " if " in var_name and " else " in var_name:
-                    # this block is not just a variable, but an expression
-                    # we need to split this with a space to get its elements
-                    skip_elements = ["if", "else", "+", "is", "defined"]
-                    sub_parts = var_name.split(" ")
-                    for sp in sub_parts:
-                        if not sp:
-                            continue
-                        if sp and sp in skip_elements:
-                            continue
-                        if sp and sp[0] in ['"', "'"]:
-                            continue
-                        var_name = sp
-                        break
-                var_name = var_name.replace(" ", "")
-                if "lookup(" in var_name and "first_found" in var_name:
-                    var_name = var_name.split(",")[-1].replace(")", "")
-                if var_name and var_name[0] == "(":
-                    var_name = var_name.split(")")[0].replace("(", "")
-                if "+" in var_name:
-                    sub_parts = var_name.split("+")
-                    for sp in sub_parts:
-                        if not sp:
-                            continue
-                        if sp and sp[0] in ['"', "'"]:
-                            continue
-                        var_name = sp
-                        break
-                if "[" in var_name and "." not in var_name:
-                    # extract dict/list name
-                    dict_pattern = r'(\w+)\[(\'|").*(\'|")\]'
-                    match = re.search(dict_pattern, var_name)
-                    if match:
-                        matched_str = match.group(1)
-                        var_name = matched_str.split("[")[0]
-                    list_pattern = r'(\w+)\[\-?\d+\]'
-                    match = re.search(list_pattern, var_name)
-                    if match:
-                        matched_str = match.group(1)
-                        var_name = matched_str.split("[")[0]
-            else:
-                if "default(" in p and ")" in p:
-                    default_var = p.replace("}}", "").replace("default(", "").replace(")", "").replace(" ", "")
-                    if not default_var.startswith('"') and not default_var.startswith("'") and not re.compile(r"[0-9].*").match(default_var):
-                        default_var_name = default_var
-        tmp_b = {
-            "original": b,
-        }
-        if var_name == "":
-            continue
-        tmp_b["name"] = var_name
-        if default_var_name != "":
-            tmp_b["default"] = default_var_name
-        blocks.append(tmp_b)
-    return blocks
+    for b in variable_block_re.findall(txt):
+        block = parse_variable_block(b)
+        if block:
+            blocks.append(block)
+    return tuple(blocks)
+
+
+# parse a `{{ ... }}` block and return a dict of the original block, the variable name and the default variable name
+# the first element of the block (before the first filter) is the variable or the expression, and the others are filters
+def parse_variable_block(block: str):
+    if "lookup(" in block.replace(" ", ""):
+        return None
+    expr, _, filters = block.partition("|")
+    var_name = get_var_name_in_expression(expr.replace("{{", "").replace("}}", ""))
+    if var_name == "":
+        return None
+    default_var_name = ""
+    if filters:
+        for f in filters.split("|"):
+            _default_var_name = get_default_var_name_in_filter(f)
+            if _default_var_name:
+                default_var_name = _default_var_name
+    parsed = {
+        "original": block,
+        "name": var_name,
+    }
+    if default_var_name != "":
+        parsed["default"] = default_var_name
+    return parsed
+
+
+def get_var_name_in_expression(expr: str):
+    var_name = expr
+    if " if " in var_name and " else " in var_name:
+        # this block is not just a variable, but an expression
+        # we need to split this with a space to get its elements
+        for sp in var_name.split(" "):
+            if not sp:
+                continue
+            if sp in expression_skip_elements:
+                continue
+            if sp[0] in ['"', "'"]:
+                continue
+            var_name = sp
+            break
+    var_name = var_name.replace(" ", "")
+    if var_name and var_name[0] == "(":
+        var_name = var_name.split(")")[0].replace("(", "")
+    if "+" in var_name:
+        for sp in var_name.split("+"):
+            if not sp:
+                continue
+            if sp[0] in ['"', "'"]:
+                continue
+            var_name = sp
+            break
+    if "[" in var_name and "." not in var_name:
+        # extract dict/list name
+        match = dict_subscript_re.search(var_name)
+        if match:
+            var_name = match.group(1).split("[")[0]
+        match = list_subscript_re.search(var_name)
+        if match:
+            var_name = match.group(1).split("[")[0]
+    return var_name
+
+
+def get_default_var_name_in_filter(filter_part: str):
+    if "default(" in filter_part and ")" in filter_part:
+        default_var = filter_part.replace("}}", "").replace("default(", "").replace(")", "").replace(" ", "")
+        if not default_var.startswith('"') and not default_var.startswith("'") and not starts_with_digit_re.match(default_var):
+            return default_var
+    return ""
 
 
 # Copied from distutils.util.strtobool
@@ -3,18 +3,104 @@ import os
 import copy
 import re
 import argparse
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dataclasses import dataclass, field
+from functools import lru_cache
 
-from sage_scan.models import load_objects
-from sage_scan.models import Playbook, TaskFile, Play, Task, Role, PlaybookData, TaskFileData
+from sage_scan.models import iter_project_lines, load_project_from_lines
+from sage_scan.models import Playbook, TaskFile, Play, Task, Role, PlaybookData, TaskFileData, create_entrypoint_data_list
 from sage_scan.utils import extract_variable_names
-from sage_scan.process.utils import list_entrypoints, get_taskfiles_in_role
 
 
 magic_vars = []
 vars_file = os.getenv("VARS_FILE", os.path.join(os.path.dirname(__file__),"ansible_variables.txt"))
 with open(vars_file, "r") as f:
     magic_vars = f.read().splitlines() 
+# set for membership checks
+magic_var_set = set(magic_vars)
+
+double_quoted_string_re = re.compile(r'"(.*?)"')
+single_quoted_string_re = re.compile(r"'(.*?)'")
+value_separator_re = re.compile('[ |]')
+split_values_cache_size = 4096
+
+
+# an immutable mapping of layered dicts; a newer layer shadows older ones like ChainMap
+# pushing a layer (or `|=`) creates a new chain which shares all the existing layers,
+# and the key order is the same as merging the layers from the oldest one with `|=`
+# the layers must not be updated after they are pushed
+class ScopeChain(Mapping):
+    __slots__ = ("layer", "parent", "_key_set")
+
+    def __init__(self, layer: dict=None, parent=None):
+        self.layer = layer if layer is not None else {}
+        self.parent = parent
+        self._key_set = None
+
+    def push(self, layer: dict):
+        if not layer:
+            return self
+        if self.parent is None and not self.layer:
+            return ScopeChain(layer)
+        return ScopeChain(layer, self)
+
+    # yield layers from the newest one
+    def layers(self):
+        node = self
+        while node is not None:
+            yield node.layer
+            node = node.parent
+
+    # the merged set of the keys in all the layers
+    # it is built when it is first needed, from the key set of the parent, so key lookups do not scan
+    # the layers; a chain shares the key set of the parent if its layer does not add any new keys
+    def key_set(self):
+        if self._key_set is not None:
+            return self._key_set
+        chain = []
+        node = self
+        while node is not None and node._key_set is None:
+            chain.append(node)
+            node = node.parent
+        for node in reversed(chain):
+            if node.parent is None:
+                node._key_set = node.layer.keys()
+                continue
+            parent_key_set = node.parent._key_set
+            new_keys = [key for key in node.layer if key not in parent_key_set]
+            node._key_set = parent_key_set | set(new_keys) if new_keys else parent_key_set
+        return self._key_set
+
+    def __getitem__(self, key):
+        for layer in self.layers():
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.key_set()
+
+    def __iter__(self):
+        if self.parent is None:
+            return iter(self.layer)
+        keys = {}
+        for layer in reversed(list(self.layers())):
+            keys.update(dict.fromkeys(layer))
+        return iter(keys)
+
+    def __len__(self):
+        return len(self.key_set())
+
+    def __or__(self, other):
+        return self.push(other)
+
+    __ior__ = __or__
+
+    def __repr__(self):
+        return f"ScopeChain({dict(self)})"
 
 
 @dataclass
@@ -84,6 +170,26 @@ def check_if_defined(used_var, defined_var):
     return False
 
 
+# return if the variable is defined in any of the defined vars (dict or ScopeChain)
+# this is the same as calling `check_if_defined()` for each defined var, but it looks up
+# the prefixes of the used var instead of scanning all the defined vars
+def check_if_defined_in(used_var, defined_vars):
+    if isinstance(defined_vars, ScopeChain):
+        defined_vars = defined_vars.key_set()
+    if not defined_vars:
+        return False
+    if len(defined_vars) <= len(used_var):
+        # a small set is faster to scan
+        for defined_var in defined_vars:
+            if check_if_defined(used_var, defined_var):
+                return True
+        return False
+    for i in range(len(used_var) + 1):
+        if used_var[:i] in defined_vars:
+            return True
+    return False
+
+
 def check_if_defined_explicitly(used_var, defined_var):
     if used_var == defined_var:
         return True 
@@ -93,7 +199,7 @@ def check_if_defined_explicitly(used_var, defined_var):
 def check_if_magic_vars(used_var):
     if "." in used_var:
         used_var = used_var.split(".")[0]
-    if used_var in magic_vars:
+    if used_var in magic_var_set:
         return True
     if used_var.startswith("ansible_"):
         return True
@@ -106,83 +212,212 @@ def check_if_magic_vars(used_var):
 def find_undefined_vars(vc: VarCont, accum_vc: VarCont):
     undefined_vars = {}
     for v1_name, v1_val in vc.used_vars.items():
-        in_scoped_vars = False
-        in_local_vars = False
-        in_set_vars = False  # check with set vars in the same task when vars is used in 'failed_when'
         if check_if_magic_vars(v1_name):
             continue
-        for v2 in accum_vc.set_scoped_vars:
-            if check_if_defined(v1_name, v2):
-                in_scoped_vars = True
-                break
-        if in_scoped_vars:
+        if check_if_defined_in(v1_name, accum_vc.set_scoped_vars):
             continue
-        for v2 in accum_vc.set_explicit_scoped_vars:
-            if check_if_defined_explicitly(v1_name, v2):
-                in_scoped_vars = True
-                break
-        if in_scoped_vars:
+        # explicitly defined vars must match exactly, so just check the membership
+        if v1_name in accum_vc.set_explicit_scoped_vars:
             continue
-        for v2 in vc.set_local_vars:
-            if check_if_defined(v1_name, v2):
-                in_local_vars = True
-                break
-        if in_local_vars:
+        if check_if_defined_in(v1_name, vc.set_local_vars):
             continue
         if v1_name in vc.set_scoped_vars:
             set_value = vc.set_scoped_vars[v1_name]
             if type(set_value) is str and v1_name in set_value:
                 # this supports the case like (x = x + y)
                 continue
+        # check with set vars in the same task when vars is used in 'failed_when'
         if v1_val.get("in_failed_when", False):
-            for v2 in vc.set_scoped_vars:
-                if check_if_defined(v1_name, v2):
-                    in_set_vars = True
-                    break
-            if in_set_vars:
+            if check_if_defined_in(v1_name, vc.set_scoped_vars):
                 continue
         undefined_vars[v1_name] = v1_val
     return undefined_vars, vc.used_vars
 
 
 # return accum vc based on call tree
-def compute_accum_vc(call_tree, vc_arr, obj_key, obj_filepath):
-    parents=[]
-    parents = traverse_and_get_parents(obj_key, call_tree, parents)
-    parents.reverse()
-    accum_vc = VarCont()
-    for p in parents:
-        pvc = vc_arr[p]
-        if pvc.filepath != obj_filepath:
-            continue
-        accum_vc.accum(pvc)
-    return accum_vc
+# `accum_builder` can be passed to share the index and the accumulated scopes for the same call tree
+def compute_accum_vc(call_tree, vc_arr, obj_key, obj_filepath, accum_builder=None):
+    if accum_builder is None:
+        accum_builder = AccumVarContBuilder.from_call_tree(call_tree, vc_arr)
+    return accum_builder.get_accum_vc(obj_key, obj_filepath)
+
+
+# return (key prefix, task index) of an object key if it is a task key like `...#task:[3]`
+def parse_task_key(key: str):
+    key_parts = key.rsplit('#', 1)
+    prefix = key_parts[0]
+    last_part = key_parts[-1]
+    if "task:" not in last_part:
+        return None, None
+    index = int(last_part.replace("task:[", "").replace("]", ""))
+    return prefix, index
+
+
+# index of a call tree to get parents and earlier siblings of a node without scanning the whole tree
+@dataclass
+class CallTreeIndex:
+    # child key --> parent key of the first edge for the child
+    parent_map: dict = field(default_factory=dict)
+    # key prefix --> list of (task index, task key) in the call tree order
+    sibling_map: dict = field(default_factory=dict)
+    # key prefix --> task indices of `sibling_map` if they are sorted
+    sorted_indices_map: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_call_tree(cls, call_tree):
+        index = cls()
+        for parent, child in call_tree:
+            if child.key not in index.parent_map:
+                index.parent_map[child.key] = parent.key
+            prefix, task_index = parse_task_key(child.key)
+            if prefix is None:
+                continue
+            if prefix not in index.sibling_map:
+                index.sibling_map[prefix] = []
+            index.sibling_map[prefix].append((task_index, child.key))
+        for prefix, siblings in index.sibling_map.items():
+            task_indices = [i for i, _ in siblings]
+            if all(task_indices[i] <= task_indices[i + 1] for i in range(len(task_indices) - 1)):
+                index.sorted_indices_map[prefix] = task_indices
+        return index
+
+    # return the keys of siblings which come before the node, in the reversed call tree order
+    def get_earlier_siblings(self, node_key):
+        prefix, task_index = parse_task_key(node_key)
+        if prefix is None:
+            return []
+        siblings = self.sibling_map.get(prefix, [])
+        if prefix in self.sorted_indices_map:
+            end = bisect_left(self.sorted_indices_map[prefix], task_index)
+            return [key for _, key in reversed(siblings[:end])]
+        return [key for i, key in reversed(siblings) if i < task_index]
+
+    # return the list of parent obj key
+    # the order is the same as `traverse_and_get_parents()`; earlier siblings and the parent of the node,
+    # then those of the parent, and so on
+    def get_parents(self, node_key):
+        parent_nodes = []
+        # call trees do not have cycles in the parent map, but this guards against broken inputs
+        visited = set()
+        while node_key in self.parent_map and node_key not in visited:
+            visited.add(node_key)
+            parent_key = self.parent_map[node_key]
+            parent_nodes.extend(self.get_earlier_siblings(node_key))
+            parent_nodes.append(parent_key)
+            node_key = parent_key
+        return parent_nodes
+
+
+# (set_explicit_scoped_vars, set_scoped_vars, used_vars) of an accumulated VarCont
+def empty_scopes():
+    return (ScopeChain(), ScopeChain(), ScopeChain())
+
+
+def push_vc_to_scopes(scopes: tuple, vc: VarCont):
+    explicit_scoped_vars, scoped_vars, used_vars = scopes
+    return (
+        explicit_scoped_vars.push(vc.set_explicit_scoped_vars),
+        scoped_vars.push(vc.set_scoped_vars),
+        used_vars.push(vc.used_vars),
+    )
+
+
+# build accumulated VarConts for objects in a call tree
+# an accumulated VarCont has the vars of parents and earlier siblings in the same file (see `CallTreeIndex.get_parents()`),
+# and it is made of ScopeChains which share the layers of parents and previous siblings,
+# so that each one can be created without copying dicts
+@dataclass
+class AccumVarContBuilder:
+    call_tree_index: CallTreeIndex = None
+    vc_arr: dict = field(default_factory=dict)
+
+    # (obj_key, filepath) --> scopes of the parents and earlier siblings of the object
+    _scopes: dict = field(default_factory=dict)
+    # (parent_key, filepath) --> scopes in which the parent itself is pushed
+    _base_scopes: dict = field(default_factory=dict)
+    # (parent_key, key prefix, filepath) --> scopes in which first N siblings are pushed
+    _sibling_scopes: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_call_tree(cls, call_tree, vc_arr):
+        return cls(call_tree_index=CallTreeIndex.from_call_tree(call_tree), vc_arr=vc_arr)
+
+    def get_accum_vc(self, obj_key, obj_filepath):
+        explicit_scoped_vars, scoped_vars, used_vars = self.get_scopes(obj_key, obj_filepath)
+        accum_vc = VarCont()
+        accum_vc.set_explicit_scoped_vars = explicit_scoped_vars
+        accum_vc.set_scoped_vars = scoped_vars
+        accum_vc.used_vars = used_vars
+        return accum_vc
+
+    def get_scopes(self, obj_key, filepath):
+        cache_key = (obj_key, filepath)
+        if cache_key in self._scopes:
+            return self._scopes[cache_key]
+        parent_map = self.call_tree_index.parent_map
+        # walk up to the nearest object whose scopes are already computed
+        chain = []
+        visited = set()
+        node_key = obj_key
+        while (node_key, filepath) not in self._scopes:
+            if node_key in visited:
+                # broken call tree with a cycle; accumulate the parents without caching
+                return self._scopes_from_parents(obj_key, filepath)
+            visited.add(node_key)
+            chain.append(node_key)
+            if node_key not in parent_map:
+                break
+            node_key = parent_map[node_key]
+        for node_key in reversed(chain):
+            self._scopes[(node_key, filepath)] = self._compute_scopes(node_key, filepath)
+        return self._scopes[cache_key]
+
+    def _push_if_same_file(self, scopes, obj_key, filepath):
+        vc = self.vc_arr[obj_key]
+        if vc.filepath != filepath:
+            return scopes
+        return push_vc_to_scopes(scopes, vc)
+
+    # the scopes of the parent must be computed before this
+    def _compute_scopes(self, obj_key, filepath):
+        index = self.call_tree_index
+        if obj_key not in index.parent_map:
+            return empty_scopes()
+        parent_key = index.parent_map[obj_key]
+        base_key = (parent_key, filepath)
+        if base_key not in self._base_scopes:
+            self._base_scopes[base_key] = self._push_if_same_file(self._scopes[base_key], parent_key, filepath)
+        scopes = self._base_scopes[base_key]
+
+        prefix, task_index = parse_task_key(obj_key)
+        if prefix is None:
+            return scopes
+        if prefix in index.sorted_indices_map:
+            end = bisect_left(index.sorted_indices_map[prefix], task_index)
+            siblings = index.sibling_map[prefix]
+            sibling_key = (parent_key, prefix, filepath)
+            if sibling_key not in self._sibling_scopes:
+                self._sibling_scopes[sibling_key] = [scopes]
+            sibling_scopes = self._sibling_scopes[sibling_key]
+            while len(sibling_scopes) <= end:
+                _, key = siblings[len(sibling_scopes) - 1]
+                sibling_scopes.append(self._push_if_same_file(sibling_scopes[-1], key, filepath))
+            return sibling_scopes[end]
+        for key in reversed(index.get_earlier_siblings(obj_key)):
+            scopes = self._push_if_same_file(scopes, key, filepath)
+        return scopes
+
+    def _scopes_from_parents(self, obj_key, filepath):
+        scopes = empty_scopes()
+        for key in reversed(self.call_tree_index.get_parents(obj_key)):
+            scopes = self._push_if_same_file(scopes, key, filepath)
+        return scopes
 
 
 # return the list of parent obj key
 def traverse_and_get_parents(node_key, call_tree, parent_nodes):
-    sibling = []
-    for parent, child in call_tree:
-        # sibling
-        key_parts = child.key.rsplit('#', 1)
-        p1 = key_parts[0]
-        p2 = key_parts[-1]
-        n_key_parts = node_key.rsplit('#', 1)
-        np1 = n_key_parts[0]
-        np2 = n_key_parts[-1]
-        if "task:" in p2 and "task:" in np2:
-            p2_num = int(p2.replace("task:[", "").replace("]", ""))
-            np2_num = int(np2.replace("task:[", "").replace("]", ""))
-            if p1 == np1 and p2_num < np2_num:
-                sibling.insert(0, child.key)
-    for parent, child in call_tree:
-        # parent
-        if child.key == node_key:
-            parent_nodes.extend(sibling)
-            parent_nodes.append(parent.key)
-            traverse_and_get_parents(parent.key, call_tree, parent_nodes)
-            break
-    # parent_nodes.reverse()
+    call_tree_index = CallTreeIndex.from_call_tree(call_tree)
+    parent_nodes.extend(call_tree_index.get_parents(node_key))
     return parent_nodes
 
 
@@ -358,20 +593,33 @@ def extract_when_option_var_name(option_parts, is_failed_when=False):
 def _split_values(all_values):
     all_parts = []
     for val in all_values:
-        # identify string enclosed in (") or (') to support the following case
-        # when: result.failed or 'Server API protected' not in result.content
-        double_quoted_strings = re.findall(r'"(.*?)"', f"{val}")
-        single_quoted_strings = re.findall(r"'(.*?)'", f"{val}")
-        for quoted_str in double_quoted_strings:
-            if quoted_str != "" and quoted_str != " ":
-                val = val.replace(quoted_str, " ")
-        for quoted_str in single_quoted_strings:
-            if quoted_str != '' and quoted_str != ' ':
-                val = val.replace(quoted_str, " ")
-        all_parts.extend(re.split('[ |]', f"{val}"))
+        if isinstance(val, str):
+            all_parts.extend(_split_str_value(val))
+        else:
+            all_parts.extend(_split_value(val))
     return all_parts
 
 
+# the same conditions are used in many tasks, so the split results of strings are cached
+@lru_cache(maxsize=split_values_cache_size)
+def _split_str_value(val: str):
+    return tuple(_split_value(val))
+
+
+def _split_value(val):
+    # identify string enclosed in (") or (') to support the following case
+    # when: result.failed or 'Server API protected' not in result.content
+    double_quoted_strings = double_quoted_string_re.findall(f"{val}")
+    single_quoted_strings = single_quoted_string_re.findall(f"{val}")
+    for quoted_str in double_quoted_strings:
+        if quoted_str != "" and quoted_str != " ":
+            val = val.replace(quoted_str, " ")
+    for quoted_str in single_quoted_strings:
+        if quoted_str != '' and quoted_str != ' ':
+            val = val.replace(quoted_str, " ")
+    return value_separator_re.split(f"{val}")
+
+
 def flatten_dict_list(d, parent_key='', sep='.'):
     items = {}
     if d is None:
@@ -515,15 +763,17 @@ def replace_vars(data, current, to_be):
 
 
 # return all undefined vars
-def find_all_undefined_vars(call_tree, vc_arr, target_filepath):
+def find_all_undefined_vars(call_tree, vc_arr, target_filepath, accum_builder=None):
     undefined_vars = {}
     used_vars = {}
 
     accum_vc = VarCont()
+    if accum_builder is None:
+        accum_builder = AccumVarContBuilder.from_call_tree(call_tree, vc_arr)
     for vc in vc_arr.values():
         if target_filepath and vc.filepath != target_filepath:
             continue
-        accum_vc = compute_accum_vc(call_tree, vc_arr, vc.obj_key, vc.filepath)
+        accum_vc = compute_accum_vc(call_tree, vc_arr, vc.obj_key, vc.filepath, accum_builder)
         und_vars, _used_vars = find_undefined_vars(vc, accum_vc)
         undefined_vars |= und_vars
         used_vars |= _used_vars
@@ -532,7 +782,7 @@ def find_all_undefined_vars(call_tree, vc_arr, target_filepath):
 
 
 # return all declared vars
-def find_all_set_vars(pd: PlaybookData|TaskFileData, call_tree, vc_arr, check_point=None):
+def find_all_set_vars(pd: PlaybookData|TaskFileData, call_tree, vc_arr, check_point=None, accum_builder=None):
     if not call_tree:
         return {}, {}
 
@@ -540,7 +790,7 @@ def find_all_set_vars(pd: PlaybookData|TaskFileData, call_tree, vc_arr, check_po
     role_vars = {}
     if not check_point:
         check_point = call_tree[-1][1]
-    accum_vc = compute_accum_vc(call_tree, vc_arr, check_point.key, pd.object.filepath)
+    accum_vc = compute_accum_vc(call_tree, vc_arr, check_point.key, pd.object.filepath, accum_builder)
     if isinstance(pd, TaskFileData):
         if pd.role:
             parent_role = pd.role
@@ -577,60 +827,114 @@ def get_play_vars_from_data(pd: PlaybookData|TaskFileData):
     return set_vars
 
 
+# variable analysis of a PlaybookData/TaskFileData
+# the VarCont array, set vars and undefined/used vars are computed only once and cached,
+# and the `get_*_from_data()` functions below read them from the session of the data
+@dataclass
+class VariableAnalysisSession:
+    pd: PlaybookData|TaskFileData = None
+    # the call tree/sequence which the cached results are based on
+    call_tree: list = None
+    call_seq: list = None
+
+    _vc_arr: dict = None
+    _accum_builder: AccumVarContBuilder = None
+    # (set_vars, role_vars)
+    _set_vars: tuple = None
+    # (undefined_vars_in_obj, used_vars)
+    _undefined_vars: tuple = None
+    _undefined_vars_value: tuple = None
+
+    # return the session cached in the data, or create a new one if the data has been changed
+    @classmethod
+    def for_data(cls, pd: PlaybookData|TaskFileData):
+        session = pd.variable_analysis
+        if session is None or session.call_tree is not pd.call_tree or session.call_seq is not pd.call_seq:
+            session = cls(pd=pd, call_tree=pd.call_tree, call_seq=pd.call_seq)
+            pd.variable_analysis = session
+        return session
+
+    @property
+    def vc_arr(self):
+        if self._vc_arr is None:
+            self._vc_arr = make_vc_arr(self.call_seq)
+        return self._vc_arr
+
+    @property
+    def accum_builder(self):
+        if self._accum_builder is None:
+            self._accum_builder = AccumVarContBuilder.from_call_tree(self.call_tree, self.vc_arr)
+        return self._accum_builder
+
+    # return (set_vars, role_vars)
+    def find_all_set_vars(self):
+        if self._set_vars is None:
+            self._set_vars = find_all_set_vars(self.pd, self.call_tree, self.vc_arr, accum_builder=self.accum_builder)
+        return self._set_vars
+
+    # return (undefined_vars_in_obj, used_vars)
+    def find_all_undefined_vars(self):
+        if self._undefined_vars is None:
+            self._undefined_vars = find_all_undefined_vars(self.call_tree, self.vc_arr, self.pd.object.filepath, accum_builder=self.accum_builder)
+        return self._undefined_vars
+
+    # return (undefined_vars_value, no_value_vars)
+    def get_undefined_vars_value(self, extra_set_vars: dict={}):
+        set_vars, _ = self.find_all_set_vars()
+        undefined_vars_in_obj, _ = self.find_all_undefined_vars()
+        if extra_set_vars:
+            set_vars = set_vars.copy()
+            set_vars.update(extra_set_vars)
+            return get_undefined_vars_value(set_vars, undefined_vars_in_obj)
+        if self._undefined_vars_value is None:
+            self._undefined_vars_value = get_undefined_vars_value(set_vars, undefined_vars_in_obj)
+        return self._undefined_vars_value
+
+
+# the functions below return deep copies of the results cached in the session,
+# so that callers can modify them like the results computed for each call
+
 # return declared vars in the file and role vars
 def get_set_vars_from_data(pd: PlaybookData|TaskFileData):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    set_vars, role_vars = find_all_set_vars(pd, call_tree, vc_arr)
-    return set_vars, role_vars
+    set_vars, role_vars = VariableAnalysisSession.for_data(pd).find_all_set_vars()
+    return copy.deepcopy(set_vars), copy.deepcopy(role_vars)
 
 
 def get_used_vars_from_data(pd: PlaybookData|TaskFileData):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    _, used_vars = find_all_undefined_vars(call_tree, vc_arr, pd.object.filepath)
-    return used_vars
+    _, used_vars = VariableAnalysisSession.for_data(pd).find_all_undefined_vars()
+    return copy.deepcopy(used_vars)
 
 
-def get_undefined_vars_in_obj_from_data(pd: PlaybookData|TaskFileData):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    undefined_vars_in_obj, _ = find_all_undefined_vars(call_tree, vc_arr, pd.object.filepath)
+def _get_undefined_vars_in_obj(session: VariableAnalysisSession):
+    undefined_vars_in_obj, _ = session.find_all_undefined_vars()
     # TODO: this part will be removed when var name extraction becomes robust.
-    undefined_vars_in_obj = filter_complex_name_vars(undefined_vars_in_obj)
-    return undefined_vars_in_obj
+    return filter_complex_name_vars(undefined_vars_in_obj)
+
+
+def get_undefined_vars_in_obj_from_data(pd: PlaybookData|TaskFileData):
+    return copy.deepcopy(_get_undefined_vars_in_obj(VariableAnalysisSession.for_data(pd)))
 
 
 def get_used_vars_with_no_value_from_data(pd: PlaybookData|TaskFileData):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    set_vars = find_all_set_vars(pd, call_tree, vc_arr)
-    undefined_vars_in_obj, _ = find_all_undefined_vars(call_tree, vc_arr, pd.object.filepath)
+    session = VariableAnalysisSession.for_data(pd)
+    set_vars = session.find_all_set_vars()
+    undefined_vars_in_obj, _ = session.find_all_undefined_vars()
     _, no_value_vars = get_undefined_vars_value(set_vars, undefined_vars_in_obj)
     return no_value_vars
 
 
 def get_undefined_vars_value_from_data(pd: PlaybookData|TaskFileData, extra_set_vars: dict={}):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    set_vars, _ = find_all_set_vars(pd, call_tree, vc_arr)
-    if extra_set_vars:
-        set_vars.update(extra_set_vars)
-    undefined_vars_in_obj, _ = find_all_undefined_vars(call_tree, vc_arr, pd.object.filepath)
-    undefined_vars_value, _ = get_undefined_vars_value(set_vars, undefined_vars_in_obj)
-    return undefined_vars_value
+    undefined_vars_value, _ = VariableAnalysisSession.for_data(pd).get_undefined_vars_value(extra_set_vars)
+    return copy.deepcopy(undefined_vars_value)
 
 
 # return vars to be set in play
 def make_set_vars_for_undefined_vars(pd: PlaybookData|TaskFileData, included_vars: dict={}, extra_set_vars: dict={}): 
     vars_to_set = {}
-    used_undefined_vars = get_undefined_vars_in_obj_from_data(pd=pd)
-    used_undefined_var_and_value = get_undefined_vars_value_from_data(pd=pd, extra_set_vars=extra_set_vars)
+    # the cached results are only read here, so they are not copied
+    session = VariableAnalysisSession.for_data(pd)
+    used_undefined_vars = _get_undefined_vars_in_obj(session)
+    used_undefined_var_and_value, _ = session.get_undefined_vars_value(extra_set_vars)
     for var_name in used_undefined_vars:
         if var_name in included_vars:
             continue
@@ -648,66 +952,123 @@ def make_set_vars_for_undefined_vars(pd: PlaybookData|TaskFileData, included_var
     return vars_to_set
 
 
-def resolve_variables(pd: PlaybookData|TaskFileData):
-    call_tree = pd.call_tree
-    call_seq = pd.call_seq
-    vc_arr = make_vc_arr(call_seq)
-    set_vars, role_vars = find_all_set_vars(pd, call_tree, vc_arr)
-    undefined_vars_in_obj, used_vars = find_all_undefined_vars(call_tree, vc_arr, pd.object.filepath)
-    undefined_vars_value, _ = get_undefined_vars_value(set_vars, undefined_vars_in_obj)
+# return the results cached in the session without copying them
+def _resolve_variables(pd: PlaybookData|TaskFileData):
+    session = VariableAnalysisSession.for_data(pd)
+    set_vars, role_vars = session.find_all_set_vars()
+    undefined_vars_in_obj, used_vars = session.find_all_undefined_vars()
+    undefined_vars_value, _ = session.get_undefined_vars_value()
     vars_to_set = make_set_vars_for_undefined_vars(pd)
     return set_vars, role_vars, used_vars, undefined_vars_in_obj, undefined_vars_value, vars_to_set
 
 
+def resolve_variables(pd: PlaybookData|TaskFileData):
+    set_vars, role_vars, used_vars, undefined_vars_in_obj, undefined_vars_value, vars_to_set = _resolve_variables(pd)
+    return (
+        copy.deepcopy(set_vars),
+        copy.deepcopy(role_vars),
+        copy.deepcopy(used_vars),
+        copy.deepcopy(undefined_vars_in_obj),
+        copy.deepcopy(undefined_vars_value),
+        vars_to_set,
+    )
+
+
+# return the result of `resolve_variables()` as a dict for output
+# the result is serialized by the caller, so the cached results are used without copying them
+def make_variable_result(pd: PlaybookData|TaskFileData):
+    set_vars, role_vars, used_vars, undefined_vars_in_obj, undefined_vars_value, vars_to_set = _resolve_variables(pd)
+    result = {
+        "entrypoint": pd.object.key,
+        "set_vars": set_vars,
+        "role_vars": role_vars,
+        "used_vars": used_vars,
+        "undefined_vars_in_pddata": undefined_vars_in_obj,
+        "undefined_vars_value": undefined_vars_value,
+        "vars_to_set": vars_to_set 
+    }
+    return result
+
+
+# resolve variables for all entrypoints of a project given as object lines
+# this runs in worker processes, so the input and the output are plain strings
+def resolve_variables_for_project_lines(lines: list):
+    project = load_project_from_lines(lines)
+    results = []
+    for pd in create_entrypoint_data_list(project, follow_include_for_used_vars=False):
+        results.append(json.dumps(make_variable_result(pd)))
+    return results
+
+
+# write result lines separated by "\n" like `"\n".join(results)`, flushing each batch as soon as it is ready
+@dataclass
+class ResultWriter:
+    file: any = None
+    num_of_lines: int = 0
+
+    def write_lines(self, lines: list):
+        for line in lines:
+            if self.num_of_lines > 0:
+                self.file.write("\n")
+            self.file.write(line)
+            self.num_of_lines += 1
+        self.file.flush()
+
+
+# stream projects from the object file and resolve variables of their entrypoints
+# if `workers` > 1, projects are processed in a process pool with at most `max_in_flight` projects at a time;
+# the results are written in the completion order unless `ordered` is True
+def run_variable_resolution(input_file: str, output_file: str, workers: int=1, ordered: bool=False, max_in_flight: int=0):
+    if max_in_flight <= 0:
+        max_in_flight = max(workers, 1) * 2
+    with open(output_file, "w") as file:
+        writer = ResultWriter(file=file)
+        if workers <= 1:
+            for _, lines in iter_project_lines(input_file):
+                writer.write_lines(resolve_variables_for_project_lines(lines))
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for _, lines in iter_project_lines(input_file):
+                if len(in_flight) >= max_in_flight:
+                    _write_finished_results(in_flight, writer, ordered)
+                in_flight.append(executor.submit(resolve_variables_for_project_lines, lines))
+            while in_flight:
+                _write_finished_results(in_flight, writer, ordered)
+    return
+
+
+# wait for at least one in-flight future and write its results
+def _write_finished_results(in_flight: deque, writer: ResultWriter, ordered: bool):
+    if ordered:
+        future = in_flight.popleft()
+        writer.write_lines(future.result())
+        return
+    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in list(in_flight):
+        if future in done:
+            in_flight.remove(future)
+            writer.write_lines(future.result())
+    return
+
+
 def main():
     parser = argparse.ArgumentParser(description="TODO")
     parser.add_argument("-f", "--file", help="input sage object json file")
     parser.add_argument("-o", "--output", help="output json file")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--ordered", action="store_true", help="write results in the input order when using worker processes")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="max number of projects being processed at a time (default: 2 * workers)")
     args = parser.parse_args()
 
-    fpath = args.file
-
-    sage_objects = load_objects(fpath)
-    projects = sage_objects.projects()   
-
-    pbdata_arr = []
-    for project in projects:
-        entrypoints = list_entrypoints(project)
-        for entrypoint in entrypoints:
-            if isinstance(entrypoint, TaskFile):
-                pbdata_for_this_entry = TaskFileData(object=entrypoint, project=project, follow_include_for_used_vars=False)
-                if not pbdata_for_this_entry:
-                    continue
-                pbdata_arr.append(pbdata_for_this_entry)
-            elif isinstance(entrypoint, Playbook):
-                pbdata_for_this_entry = PlaybookData(object=entrypoint, project=project, follow_include_for_used_vars=False)
-                if not pbdata_for_this_entry:
-                    continue
-                pbdata_arr.append(pbdata_for_this_entry)
-            elif isinstance(entrypoint, Role):
-                taskfiles = get_taskfiles_in_role(entrypoint, project)
-                for taskfile in taskfiles:
-                    pbdata_for_this_entry = TaskFileData(object=taskfile, project=project, follow_include_for_used_vars=False)
-                    if not pbdata_for_this_entry:
-                        continue
-                    pbdata_arr.append(pbdata_for_this_entry)
-
-    results = []
-    for pd in pbdata_arr:
-        set_vars, role_vars, used_vars, undefined_vars_in_obj, undefined_vars_value, vars_to_set = resolve_variables(pd)
-        result = {
-            "entrypoint": pd.object.key,
-            "set_vars": set_vars,
-            "role_vars": role_vars,
-            "used_vars": used_vars,
-            "undefined_vars_in_pddata": undefined_vars_in_obj,
-            "undefined_vars_value": undefined_vars_value,
-            "vars_to_set": vars_to_set 
-        }
-        results.append(json.dumps(result))
-
-    with open(args.output, "w") as f:
-        f.write("\n".join(results))
+    run_variable_resolution(
+        input_file=args.file,
+        output_file=args.output,
+        workers=args.workers,
+        ordered=args.ordered,
+        max_in_flight=args.max_in_flight,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+import random
+import pytest
+from ansible_risk_insight.models import RoleInPlay, ExecutableType
+from sage_scan.models import SageProject, Playbook, Play, Task, TaskFile, Role, File
+
+SRC = {"type": "GitHub-RHIBM", "repo_name": "demo"}
+
+
+# a project with roles, playbooks and taskfiles which use variables in various ways
+# the objects are shuffled by `seed` so that results must not depend on their order
+def make_project(n_roles=3, n_tasks=6, n_playbooks=2, seed=0):
+    rnd = random.Random(seed)
+    objs = []
+    roles = []
+    for r in range(n_roles):
+        rname = f"role{r}"
+        rkey = f"role role:{rname}"
+        main_fp = f"roles/{rname}/tasks/main.yml"
+        sub_fp = f"roles/{rname}/tasks/sub.yml"
+        main_key = f"taskfile role:{rname}#taskfile:{main_fp}"
+        sub_key = f"taskfile role:{rname}#taskfile:{sub_fp}"
+        role = Role(key=rkey, name=rname, fqcn=rname, filepath=f"roles/{rname}",
+                    taskfiles=[main_key, sub_key],
+                    default_variables={f"{rname}_pkg": "nginx", f"{rname}_list": ["a", "b", "c"], "shared_port": 80},
+                    variables={f"{rname}_conf": {"path": "/etc/{{ " + rname + "_pkg }}", "mode": "0644"}})
+        roles.append(role)
+        objs.append(role)
+        for tf_key, fp, n in [(main_key, main_fp, n_tasks), (sub_key, sub_fp, 3)]:
+            tkeys = []
+            for i in range(n):
+                tkey = f"{tf_key.replace('taskfile ', 'task ', 1)}#task:[{i}]"
+                tkeys.append(tkey)
+                mod = rnd.choice(["ansible.builtin.package", "copy", "ansible.builtin.set_fact", "debug"])
+                mo = {"name": "{{ " + rname + "_pkg }}", "state": "present"}
+                t = Task(key=tkey, name=f"task {i} uses {{{{ undefined_{i} }}}}", module=mod, index=i, filepath=fp, role=rname,
+                         module_options=mo, options={"when": f"{rname}_flag is defined and undefined_when_{i}"},
+                         executable=mod, executable_type=ExecutableType.MODULE_TYPE,
+                         yaml_lines=f"- name: task {i}\n  {mod}:\n    name: x\n")
+                if i == 1:
+                    t.registered_variables = {f"reg_{i}": {}}
+                if i == 2:
+                    t.set_facts = {f"fact_{rname}": "{{ " + rname + "_pkg }}-x", "chain_a": "{{ chain_b }}", "chain_b": "{{ " + rname + "_pkg }}"}
+                    t.module = "ansible.builtin.set_fact"
+                if i == 3:
+                    t.loop = {"item": "{{ " + rname + "_list }}"}
+                    t.module_options = {"name": "{{ item }}", "dest": "{{ fact_" + rname + " }}/{{ reg_1.stdout }}"}
+                if i == 4 and tf_key == main_key:
+                    t.executable = "sub.yml"
+                    t.executable_type = ExecutableType.TASKFILE_TYPE
+                    t.module = "ansible.builtin.include_tasks"
+                    t.include_info = {"key": sub_key, "type": "taskfile", "path": sub_fp}
+                if i == 5:
+                    t.module = "ansible.builtin.include_vars"
+                    t.module_options = {"file": "../vars/extra.yml"}
+                    t.variables = {"local_v": "{{ chain_a }}"}
+                objs.append(t)
+            tf = TaskFile(key=tf_key, name=fp, filepath=fp, tasks=tkeys, role=rname, yaml_lines="---\n")
+            objs.append(tf)
+        objs.append(File(key=f"file role:{rname}#file:roles/{rname}/vars/extra.yml", filepath=f"roles/{rname}/vars/extra.yml", role=rname, body="x: 1"))
+    for p in range(n_playbooks):
+        fp = f"playbooks/site{p}.yml"
+        pbkey = f"playbook playbook:{fp}"
+        play_keys = []
+        for pi in range(2):
+            play_key = f"play playbook:{fp}#play:[{pi}]"
+            play_keys.append(play_key)
+            tkeys = []
+            for i in range(n_tasks):
+                tkey = f"task playbook:{fp}#play:[{pi}]#task:[{i}]"
+                tkeys.append(tkey)
+                t = Task(key=tkey, name=f"pb task {i}", module="ansible.builtin.shell", index=i, play_index=pi, filepath=fp,
+                         module_options="echo {{ play_var }} {{ missing_" + str(i) + " }}", options={},
+                         executable="ansible.builtin.shell", executable_type=ExecutableType.MODULE_TYPE, yaml_lines="- shell: x\n")
+                if i == 0:
+                    t.registered_variables = {"out": {}}
+                objs.append(t)
+            rips = []
+            for r in roles[: 1 + (p + pi) % len(roles)]:
+                rips.append(RoleInPlay(name=r.name, role_info={"key": r.key}))
+            play = Play(key=play_key, name=f"play {pi}", filepath=fp, index=pi, tasks=tkeys, roles=rips,
+                        variables={"play_var": "hello", "nested": {"a": {"b": "{{ play_var }}"}}}, vars_files=["vars/common.yml"])
+            objs.append(play)
+        objs.append(Playbook(key=pbkey, name=fp, filepath=fp, plays=play_keys, yaml_lines="---\n"))
+        objs.append(File(key=f"file playbook:playbooks/vars/common.yml", filepath="playbooks/vars/common.yml", body="a: 1"))
+    # independent taskfile including a role taskfile
+    fp = "tasks/standalone.yml"
+    tf_key = f"taskfile taskfile:{fp}"
+    tkeys = []
+    for i in range(3):
+        tkey = f"task taskfile:{fp}#task:[{i}]"
+        tkeys.append(tkey)
+        objs.append(Task(key=tkey, name=f"standalone {i}", module="debug", index=i, filepath=fp,
+                         module_options={"msg": "{{ standalone_v }}"}, executable="debug", executable_type=ExecutableType.MODULE_TYPE))
+    objs.append(TaskFile(key=tf_key, name=fp, filepath=fp, tasks=tkeys))
+    rnd.shuffle(objs)
+    for o in objs:
+        o.set_source(SRC)
+    proj = SageProject.from_source_objects(source=SRC, file_inventory=[], objects=objs, metadata={}, scan_time=[], dir_size=0)
+    return proj
+
+
+@pytest.fixture
+def project_factory():
+    return make_project
@@ -0,0 +1,132 @@
+import jsonpickle
+from ansible_risk_insight.models import (
+    Module as ARIModule,
+    ModuleArgument,
+)
+from sage_scan.process.annotation_engine import AnnotationEngine, default_annotators
+from sage_scan.process.annotations import (
+    set_module_spec_annotations,
+    set_module_arg_key_annotations,
+    set_module_arg_value_annotations,
+    set_variable_annotations,
+)
+from sage_scan.process.knowledge_base import KnowledgeBase
+from sage_scan.process.variable_resolver import VariableResolver
+
+
+def _make_module(fqcn, arguments):
+    name = fqcn.split(".")[-1]
+    return ARIModule(
+        name=name,
+        fqcn=fqcn,
+        key=f"module module:{fqcn}",
+        collection="ansible.builtin",
+        examples=f"- {name}:\n",
+        builtin=True,
+        arguments=arguments,
+    )
+
+
+# a KB client which knows the modules used in the test projects
+class StubKBClient(object):
+    def __init__(self):
+        modules = [
+            _make_module("ansible.builtin.package", [ModuleArgument(name="name", type="list", required=True), ModuleArgument(name="state", type="str")]),
+            _make_module("ansible.builtin.copy", [ModuleArgument(name="src", type="path"), ModuleArgument(name="dest", type="path", required=True)]),
+            _make_module("ansible.builtin.debug", [ModuleArgument(name="msg", type="str")]),
+            _make_module("ansible.builtin.shell", [ModuleArgument(name="chdir", type="path")]),
+        ]
+        self.modules = {}
+        for module in modules:
+            self.modules[module.fqcn] = module
+            self.modules[module.name] = module
+
+    def search_module(self, name, used_in=""):
+        module = self.modules.get(name, None)
+        if module is None:
+            return []
+        return [{"type": "module", "name": module.fqcn, "object": module, "used_in": used_in}]
+
+    def search_role(self, name, used_in=""):
+        return []
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        return []
+
+    def search_action_group(self, name, max_match=-1):
+        return []
+
+
+annotation_keys = [key for annotator in default_annotators for key in annotator.outputs]
+
+
+def _get_annotations(project):
+    annotations = {}
+    for task in project.tasks:
+        values = {key: task.annotations[key] for key in annotation_keys if key in task.annotations}
+        annotations[task.key] = jsonpickle.encode(values, make_refs=False, unpicklable=False)
+    return annotations
+
+
+# P001 - P004 annotations set by the loop before the annotation engine
+def _annotate_sequentially(project):
+    VariableResolver().resolve_all_vars_in_project(project)
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    for task in project.tasks:
+        kb.resolve_task(task, set_module_object_annotation=True)
+        set_module_spec_annotations(task)
+        set_module_arg_key_annotations(task, knowledge_base=kb)
+        set_module_arg_value_annotations(task)
+        set_variable_annotations(task)
+    return project
+
+
+def _annotate_by_engine(project, engine):
+    VariableResolver().resolve_all_vars_in_project(project)
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    kb.resolve_project(project, set_module_object_annotation=True, module_registry=kb.module_registry)
+    engine.annotate(project.tasks, knowledge_base=kb)
+    return project
+
+
+def test_engine_same_as_sequential_annotations(project_factory):
+    for seed in range(2):
+        expected = _get_annotations(_annotate_sequentially(project_factory(seed=seed)))
+        assert any("module.wrong_arg_keys" in value for value in expected.values())
+        assert any("variable.undefined_vars" in value for value in expected.values())
+        for workers in [1, 2]:
+            project = _annotate_by_engine(project_factory(seed=seed), AnnotationEngine(workers=workers))
+            assert _get_annotations(project) == expected
+
+
+def test_engine_skip_unchanged(project_factory):
+    engine = AnnotationEngine(skip_unchanged=True)
+    calls = []
+    for annotator in engine.annotators:
+        func = annotator.func
+
+        def counting_func(target, knowledge_base, func=func, name=annotator.name):
+            calls.append((name, len(target) if isinstance(target, list) else 1))
+            return func(target, knowledge_base)
+
+        annotator.func = counting_func
+
+    project = _annotate_by_engine(project_factory(seed=0), engine)
+    num_of_tasks = len(project.tasks)
+    assert calls == [("P001", 1)] * num_of_tasks + [("P002_P003", num_of_tasks)] + [("P004", 1)] * num_of_tasks
+
+    # the variables are resolved again, but the annotators are skipped because the inputs are the same
+    calls.clear()
+    project = _annotate_by_engine(project, engine)
+    assert calls == []
+
+    # only the changed task is annotated again, and the annotations are the same as the sequential loop
+    calls.clear()
+    expected_project = project_factory(seed=0)
+    for p in [project, expected_project]:
+        task = [t for t in p.tasks if t.module == "copy"][0]
+        task.module_options = {"dest": "{{ new_dest }}", "wrong_key": "x"}
+    project = _annotate_by_engine(project, engine)
+    assert sorted(set(name for name, _ in calls)) == ["P002_P003", "P004"]
+    assert all(num == 1 for _, num in calls)
+    assert _get_annotations(project) == _get_annotations(_annotate_sequentially(expected_project))
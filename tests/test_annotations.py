@@ -0,0 +1,110 @@
+from ansible_risk_insight.models import (
+    ExecutableType,
+    Module as ARIModule,
+    ModuleArgument,
+)
+from sage_scan.models import Task
+from sage_scan.process.knowledge_base import KnowledgeBase
+from sage_scan.process import annotations
+from sage_scan.process.annotations import (
+    MODULE_OBJECT_ANNOTATION_KEY,
+    MODULE_REF_ANNOTATION_KEY,
+    set_module_spec_annotations,
+    set_module_arg_key_annotations,
+    set_module_arg_value_annotations,
+)
+
+
+# a KB client which knows only `ansible.builtin.copy`
+class StubKBClient(object):
+    def __init__(self):
+        self.module = ARIModule(
+            name="copy",
+            fqcn="ansible.builtin.copy",
+            key="module module:ansible.builtin.copy",
+            collection="ansible.builtin",
+            examples="- copy:\n    src: a\n    dest: b\n",
+            builtin=True,
+            arguments=[
+                ModuleArgument(name="src", type="str"),
+                ModuleArgument(name="dest", type="path", required=True),
+                ModuleArgument(name="mode", type="any"),
+            ],
+        )
+
+    def search_module(self, name, used_in=""):
+        if name in ["copy", "ansible.builtin.copy"]:
+            return [{"type": "module", "name": self.module.fqcn, "object": self.module, "used_in": used_in}]
+        return []
+
+    def search_role(self, name, used_in=""):
+        return []
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        return []
+
+    def search_action_group(self, name, max_match=-1):
+        return []
+
+
+def _make_task():
+    return Task(
+        key="task playbook:site.yml#play:[0]#task:[0]",
+        module="ansible.builtin.copy",
+        executable="ansible.builtin.copy",
+        executable_type=ExecutableType.MODULE_TYPE,
+        module_options={"src": "a.txt", "wrong_key": "x"},
+    )
+
+
+def _check_annotations(task):
+    assert task.get_annotation("module.resolved_fqcn") == "ansible.builtin.copy"
+    assert task.get_annotation("module.not_exist") is False
+    assert task.get_annotation("module.need_correction") is False
+    assert task.get_annotation("module.wrong_arg_keys") == ["wrong_key"]
+    assert task.get_annotation("module.missing_required_arg_keys") == ["dest"]
+    assert task.get_annotation("module.wrong_arg_values") == []
+
+
+def test_annotations_without_registry():
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    task = _make_task()
+    kb.resolve_task(task, set_module_object_annotation=True)
+    assert task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY) is not None
+    assert task.get_annotation(MODULE_REF_ANNOTATION_KEY) is None
+
+    set_module_spec_annotations(task)
+    set_module_arg_key_annotations(task, knowledge_base=kb)
+    set_module_arg_value_annotations(task)
+    _check_annotations(task)
+
+
+def test_annotations_with_registry():
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    task = _make_task()
+    kb.resolve_task(task, set_module_object_annotation=True, module_registry=kb.module_registry)
+    assert task.get_annotation(MODULE_OBJECT_ANNOTATION_KEY) is None
+    assert task.get_annotation(MODULE_REF_ANNOTATION_KEY) == "ansible.builtin.copy"
+
+    set_module_spec_annotations(task, module_registry=kb.module_registry)
+    # the registry of the knowledge base is used if the registry is not given
+    set_module_arg_key_annotations(task, knowledge_base=kb)
+    set_module_arg_value_annotations(task, module_registry=kb.module_registry)
+    _check_annotations(task)
+
+
+def test_module_examples_once_per_module(monkeypatch):
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    tasks = [_make_task(), _make_task()]
+    kb.resolve_tasks(tasks, set_module_object_annotation=True, module_registry=kb.module_registry)
+
+    monkeypatch.setattr(annotations, "FEATURE_TASK_MODULE_EXAMPLES", False)
+    for task in tasks:
+        set_module_spec_annotations(task, module_registry=kb.module_registry)
+        assert "module.examples" not in task.annotations
+    assert list(kb.module_registry.examples_map()) == ["ansible.builtin.copy"]
+    assert kb.module_registry.get_examples("ansible.builtin.copy").startswith("- copy:")
+
+    monkeypatch.setattr(annotations, "FEATURE_TASK_MODULE_EXAMPLES", True)
+    set_module_spec_annotations(tasks[0], module_registry=kb.module_registry)
+    assert tasks[0].get_annotation("module.examples").startswith("- copy:")
@@ -0,0 +1,139 @@
+from ansible_risk_insight.models import ExecutableType, TaskFile as ARITaskFile
+from sage_scan.models import (
+    SageProject,
+    Playbook,
+    Play,
+    Task,
+    TaskFile,
+)
+from sage_scan.process.knowledge_base import KnowledgeBase
+
+
+# the recursive traversal before call graphs were cached
+def _reference_call_graph(project, obj, history=None, follow_include=True):
+    history = history or []
+    if obj.key in history:
+        return []
+    _history = history + [obj.key]
+    call_graph = []
+    for c_key in project._get_children_keys_for_graph(obj=obj, follow_include=follow_include):
+        c_obj = project.get_object(c_key)
+        if not c_obj:
+            continue
+        call_graph.append((obj, c_obj))
+        call_graph.extend(_reference_call_graph(project, c_obj, _history, follow_include))
+    return call_graph
+
+
+def _reference_all_call_sequences(project, follow_include=True):
+    found_taskfile_keys = set()
+    all_call_sequences = []
+    for obj in project.playbooks + project.roles:
+        call_seq = project.call_graph2sequence(_reference_call_graph(project, obj, follow_include=follow_include))
+        all_call_sequences.append(call_seq)
+        found_taskfile_keys.update([o.key for o in call_seq if isinstance(o, TaskFile)])
+    for tf in project.taskfiles:
+        if tf.key in found_taskfile_keys:
+            continue
+        all_call_sequences.append(project.call_graph2sequence(_reference_call_graph(project, tf, follow_include=follow_include)))
+    return all_call_sequences
+
+
+def _keys(call_seq):
+    return [obj.key for obj in call_seq]
+
+
+def test_call_sequences_same_as_reference(project_factory):
+    for seed in range(3):
+        project = project_factory(seed=seed)
+        for follow_include in [True, False]:
+            expected = [_keys(seq) for seq in _reference_all_call_sequences(project, follow_include)]
+            actual = [_keys(seq) for seq in project.get_all_call_sequences(follow_include=follow_include)]
+            assert actual == expected
+
+            for entrypoint in project.playbooks + project.roles + project.taskfiles:
+                expected_seq = project.call_graph2sequence(_reference_call_graph(project, entrypoint, follow_include=follow_include))
+                actual_seq = project.get_call_sequence_by_entrypoint(entrypoint, follow_include=follow_include)
+                assert _keys(actual_seq) == _keys(expected_seq)
+
+            for task in project.tasks:
+                expected_seqs = [seq for seq in expected if task.key in seq]
+                actual_seqs = [_keys(seq) for seq in project.get_call_sequences_for_task(task, follow_include=follow_include)]
+                assert actual_seqs == expected_seqs
+                first_seq = project.get_call_sequence_for_task(task, follow_include=follow_include)
+                assert (_keys(first_seq) if first_seq else None) == (expected_seqs[0] if expected_seqs else None)
+
+
+def _make_include_project(self_include=False):
+    project = SageProject()
+    pb_key = "playbook playbook:site.yml"
+    play_key = "play playbook:site.yml#play:[0]"
+    include_task_key = "task playbook:site.yml#play:[0]#task:[0]"
+    tf_key = "taskfile taskfile:tasks/sub.yml"
+    sub_task_key = "task taskfile:tasks/sub.yml#task:[0]"
+    project.add_object(Playbook(key=pb_key, name="site.yml", filepath="site.yml", plays=[play_key]))
+    project.add_object(Play(key=play_key, name="play", filepath="site.yml", tasks=[include_task_key]))
+    project.add_object(
+        Task(
+            key=include_task_key,
+            module="ansible.builtin.include_tasks",
+            filepath="site.yml",
+            executable="tasks/sub.yml",
+            executable_type=ExecutableType.TASKFILE_TYPE,
+        )
+    )
+    sub_task = Task(key=sub_task_key, module="ansible.builtin.debug", filepath="tasks/sub.yml", executable_type=ExecutableType.MODULE_TYPE)
+    if self_include:
+        sub_task.include_info = {"type": "taskfile", "path": "tasks/sub.yml", "key": tf_key}
+    project.add_object(sub_task)
+    project.add_object(TaskFile(key=tf_key, name="tasks/sub.yml", filepath="tasks/sub.yml", tasks=[sub_task_key]))
+    return project
+
+
+class StubKBClient(object):
+    def search_module(self, name, used_in=""):
+        return []
+
+    def search_role(self, name, used_in=""):
+        return []
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        if name == "tasks/sub.yml":
+            taskfile = ARITaskFile(defined_in="tasks/sub.yml", key="taskfile taskfile:tasks/sub.yml")
+            return [{"type": "taskfile", "name": taskfile.key, "object": taskfile, "used_in": used_in}]
+        return []
+
+    def search_action_group(self, name, max_match=-1):
+        return []
+
+
+def test_call_graphs_rebuilt_after_include_resolution():
+    pb_key = "playbook playbook:site.yml"
+    expected_before = [pb_key, "play playbook:site.yml#play:[0]", "task playbook:site.yml#play:[0]#task:[0]"]
+    expected_after = expected_before + ["taskfile taskfile:tasks/sub.yml", "task taskfile:tasks/sub.yml#task:[0]"]
+
+    for resolve in ["resolve_project", "resolve_tasks", "resolve_task"]:
+        project = _make_include_project()
+        playbook = project.get_object(pb_key)
+        # build the call graph before resolving includes
+        assert _keys(project.get_call_sequence_by_entrypoint(playbook)) == expected_before
+
+        kb = KnowledgeBase(kb_client=StubKBClient())
+        if resolve == "resolve_project":
+            kb.resolve_project(project)
+        elif resolve == "resolve_tasks":
+            kb.resolve_tasks(project.tasks)
+        else:
+            for task in project.tasks:
+                kb.resolve_task(task)
+        assert _keys(project.get_call_sequence_by_entrypoint(playbook)) == expected_after
+        assert len(project.get_all_call_sequences()) == 1
+
+
+def test_call_graph_with_cycle():
+    project = _make_include_project(self_include=True)
+    playbook = project.get_object("playbook playbook:site.yml")
+    kb = KnowledgeBase(kb_client=StubKBClient())
+    kb.resolve_project(project)
+    expected = _keys(project.call_graph2sequence(_reference_call_graph(project, playbook)))
+    assert _keys(project.get_call_sequence_by_entrypoint(playbook)) == expected
@@ -0,0 +1,93 @@
+import os
+import random
+from sage_scan.models import Play, Task, File
+from sage_scan.process.file_resolver import FileCont, FileIndex, find_file_obj, to_fc_list, resolve_file
+
+
+# the file matching before the file index; the relative path of each file is compared with `used_file`
+def find_file_obj_by_relpath(fc_list, objects):
+    for i, fc in enumerate(fc_list):
+        found = False
+        for obj in objects:
+            if not isinstance(obj, File):
+                continue
+            current_dir = os.path.dirname(fc.current_filepath)
+            relative_path = os.path.relpath(obj.filepath, current_dir)
+            norm_used_file = os.path.normpath(fc.used_file)
+            if norm_used_file == relative_path:
+                fc_list[i].file_obj = obj
+                found = True
+            if found:
+                break
+
+
+def _make_files(rnd, n=40):
+    dirs = ["", "vars", "roles/r1/vars", "roles/r1/tasks", "roles/r2/vars", "group_vars", "a/b/c"]
+    files = []
+    for i in range(n):
+        fp = os.path.join(rnd.choice(dirs), f"f{i % 10}.yml")
+        files.append(File(key=f"file {fp}#{i}", filepath=fp, body=""))
+    return files
+
+
+def test_file_index_matches_relpath():
+    rnd = random.Random(0)
+    files = _make_files(rnd)
+    dirs = ["", "roles/r1/tasks", "roles/r2/tasks", "playbooks", "a/b"]
+    prefixes = ["", "./", "../", "../../", "vars/", "../vars/", "./vars/../vars/", "roles/r1/vars/", "a/b/c/"]
+    fc_list = []
+    for _ in range(300):
+        current_filepath = os.path.join(rnd.choice(dirs), "main.yml")
+        used_file = rnd.choice(prefixes) + f"f{rnd.randrange(12)}.yml"
+        fc_list.append(FileCont(obj_key="task", current_filepath=current_filepath, used_file=used_file))
+    expected = [FileCont(obj_key=fc.obj_key, current_filepath=fc.current_filepath, used_file=fc.used_file) for fc in fc_list]
+
+    find_file_obj_by_relpath(expected, files)
+    find_file_obj(fc_list, files, FileIndex.from_objects(files))
+
+    assert any(fc.file_obj.filepath for fc in fc_list)
+    assert any(not fc.file_obj.filepath for fc in fc_list)
+    for fc, exp in zip(fc_list, expected):
+        assert fc.file_obj is exp.file_obj or (fc.file_obj == File() and exp.file_obj == File())
+        assert fc.used_file == exp.used_file
+
+
+def test_with_first_found_candidates():
+    files = [File(key="file vars/RedHat.yml", filepath="roles/r1/vars/RedHat.yml"), File(key="file default.yml", filepath="roles/r1/default.yml")]
+    task = Task(
+        key="task t1",
+        module="ansible.builtin.include_vars",
+        filepath="roles/r1/tasks/main.yml",
+        module_options={"file": "{{ item }}"},
+        options={"with_first_found": [{"files": ["Debian.yml", "RedHat.yml"], "paths": ["../vars"]}, "../default.yml"]},
+    )
+    fc_list = resolve_file(task, files)
+    assert len(fc_list) == 1
+    fc = fc_list[0]
+    assert fc.candidates == ["../vars/Debian.yml", "../vars/RedHat.yml", "../default.yml"]
+    assert fc.used_file == "../vars/RedHat.yml"
+    assert fc.file_obj is files[0]
+
+    # the raw file argument is kept if no candidate is found
+    task.options = {"with_first_found": ["missing.yml"]}
+    fc = resolve_file(task, files)[0]
+    assert fc.used_file == "{{ item }}"
+    assert fc.file_obj == File()
+
+
+def test_vars_files_list():
+    files = [File(key="file vars/common.yml", filepath="vars/common.yml")]
+    play = Play(key="play p1", filepath="site.yml", vars_files=["vars/common.yml", ["vars/missing.yml", "vars/common.yml"], ["vars/a.yml", "vars/b.yml"]])
+    fc_list = resolve_file(play, files)
+    assert [fc.used_file for fc in fc_list] == ["vars/common.yml", "vars/common.yml", ["vars/a.yml", "vars/b.yml"]]
+    assert fc_list[0].file_obj is files[0]
+    assert fc_list[1].file_obj is files[0]
+    # no file in the list is found; `used_file` keeps the raw value
+    assert fc_list[2].candidates == ["vars/a.yml", "vars/b.yml"]
+    assert fc_list[2].file_obj == File()
+
+
+def test_no_file_reference():
+    task = Task(key="task t1", module="ansible.builtin.debug", filepath="main.yml", module_options={"msg": "x"})
+    assert to_fc_list(task) == []
+    assert resolve_file(task, []) is None
@@ -0,0 +1,105 @@
+import pickle
+import random
+import pytest
+from ansible_risk_insight.models import Module as ARIModule, ModuleArgument
+from sage_scan.process.kb_index import (
+    KBIndex,
+    get_kb_index,
+    kb_index_sections,
+    make_module_summary,
+    module_from_summary,
+    write_kb_index,
+)
+
+
+def _make_sections(rnd):
+    sections = {name: {} for name in kb_index_sections}
+    for i in range(50):
+        short_name = f"mod_{i}"
+        fqcn = f"ns{i % 3}.coll.{short_name}"
+        module = ARIModule(
+            name=short_name,
+            fqcn=fqcn,
+            key=f"module collection:ns{i % 3}.coll#module:{fqcn}",
+            collection=f"ns{i % 3}.coll",
+            examples=f"- {fqcn}:\n    name: x\n",
+            arguments=[ModuleArgument(name=f"arg{j}", type="str", default=None if j else "ü", aliases=[f"a{j}"]) for j in range(rnd.randint(0, 3))],
+        )
+        summary = make_module_summary(module)
+        sections["modules"][fqcn] = summary
+        if i % 2 == 0:
+            sections["modules"][short_name] = summary
+            sections["module_fallbacks"][short_name] = summary
+    for i in range(20):
+        name = f"ns.coll.role_{i}"
+        sections["roles"][name] = {"fqcn": name, "defined_in": f"roles/role_{i}", "key": f"role collection:ns.coll#role:{name}"}
+        key = f"taskfile collection:ns.coll#taskfile:tasks/t{i}.yml"
+        sections["taskfiles"][key] = {"defined_in": f"tasks/t{i}.yml", "key": key}
+        sections["action_groups"][f"group_{i}"] = [f"ns.coll.mod_{j}" for j in range(i % 5)]
+    return sections
+
+
+@pytest.fixture
+def kb_index_file(tmp_path):
+    sections = _make_sections(random.Random(0))
+    fpath = str(tmp_path / "kb.idx")
+    write_kb_index(sections, fpath)
+    return fpath, sections
+
+
+def test_kb_index_round_trip(kb_index_file):
+    fpath, sections = kb_index_file
+    kb_index = KBIndex(fpath=fpath)
+    for name in kb_index_sections:
+        assert list(kb_index.keys(name)) == sorted(sections[name])
+        for key, value in sections[name].items():
+            assert kb_index.get(name, key) == value
+        assert kb_index.get(name, "__missing__") is None
+
+    for name, summary in sections["modules"].items():
+        result = kb_index.search_module(name, used_in="x.yml")
+        assert len(result) == 1
+        assert result[0]["name"] == summary["fqcn"]
+        assert result[0]["used_in"] == "x.yml"
+        assert result[0]["object"] == module_from_summary(summary)
+        assert make_module_summary(result[0]["object"]) == summary
+    # an unknown FQCN falls back to the module found by its short name
+    assert kb_index.search_module("unknown.coll.mod_2")[0]["object"].fqcn == "ns2.coll.mod_2"
+    assert kb_index.search_module("unknown.coll.mod_1") == []
+    assert kb_index.search_module("mod_1") == []
+
+    for name, summary in sections["roles"].items():
+        role = kb_index.search_role(name)[0]["object"]
+        assert (role.fqcn, role.defined_in, role.key) == (summary["fqcn"], summary["defined_in"], summary["key"])
+    assert kb_index.search_role("ns.coll.missing") == []
+
+    for key, summary in sections["taskfiles"].items():
+        taskfile = kb_index.search_taskfile(key, is_key=True)[0]["object"]
+        assert (taskfile.defined_in, taskfile.key) == (summary["defined_in"], summary["key"])
+        # only the search by a taskfile key is supported
+        assert kb_index.search_taskfile(key) == []
+
+    for name, groups in sections["action_groups"].items():
+        assert kb_index.search_action_group(name) == groups
+        assert kb_index.search_action_group(name, max_match=2) == groups[:2]
+        assert kb_index.search_action_group(name, max_match=0) == []
+    assert kb_index.search_action_group("missing") == []
+
+
+def test_kb_index_pickle(kb_index_file):
+    fpath, sections = kb_index_file
+    kb_index = get_kb_index(fpath)
+    assert get_kb_index(fpath) is kb_index
+    # the unpickled index maps the same file
+    loaded = pickle.loads(pickle.dumps(kb_index))
+    assert loaded.fpath == fpath
+    assert list(loaded.keys("modules")) == sorted(sections["modules"])
+
+
+def test_kb_index_invalid_file(tmp_path):
+    with pytest.raises(ValueError):
+        KBIndex(fpath=str(tmp_path / "missing.idx"))
+    fpath = tmp_path / "bad.idx"
+    fpath.write_bytes(b"\0" * 256)
+    with pytest.raises(ValueError):
+        KBIndex(fpath=str(fpath))
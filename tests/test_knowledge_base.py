@@ -0,0 +1,75 @@
+from sage_scan.process.knowledge_base import KnowledgeBase, KBSearchCache
+
+
+# a KB client which counts the searches; it caches module searches by itself if `cached_search_types` is set
+class CountingKBClient(object):
+    def __init__(self, cached_search_types=None):
+        if cached_search_types is not None:
+            self.cached_search_types = cached_search_types
+        self.searches = []
+
+    def search_module(self, name, used_in=""):
+        self.searches.append(("module", name))
+        return []
+
+    def search_role(self, name, used_in=""):
+        self.searches.append(("role", name))
+        return []
+
+    def search_taskfile(self, name, is_key=False, used_in=""):
+        self.searches.append(("taskfile", name))
+        return []
+
+    def search_action_group(self, name, max_match=-1):
+        self.searches.append(("action_group", name))
+        return []
+
+
+def _search_twice(kb):
+    for _ in range(2):
+        kb.search_module("ansible.builtin.copy")
+        kb.search_modules(["ansible.builtin.copy", "ansible.builtin.file"])
+        kb.search_action_group("group/aws")
+
+
+def test_search_cache():
+    client = CountingKBClient()
+    kb = KnowledgeBase(kb_client=client, search_cache=KBSearchCache())
+    _search_twice(kb)
+    assert client.searches == [("module", "ansible.builtin.copy"), ("module", "ansible.builtin.file"), ("action_group", "group/aws")]
+
+
+def test_search_cache_skipped_for_cached_searches(tmp_path):
+    client = CountingKBClient(cached_search_types=["module"])
+    cache = KBSearchCache()
+    kb = KnowledgeBase(kb_client=client, search_cache=cache)
+    _search_twice(kb)
+    # module searches are left to the client
+    assert client.searches.count(("module", "ansible.builtin.copy")) == 4
+    assert client.searches.count(("action_group", "group/aws")) == 1
+    assert list(cache._entries) == [KBSearchCache.make_key("action_group", "group/aws")]
+
+    # all the results are cached if they are saved to a file
+    client = CountingKBClient(cached_search_types=["module"])
+    kb = KnowledgeBase(kb_client=client, search_cache=KBSearchCache(cache_file=str(tmp_path / "cache.json")))
+    _search_twice(kb)
+    assert client.searches.count(("module", "ansible.builtin.copy")) == 1
+
+
+def test_lazy_fingerprint(tmp_path):
+    kb_dir = tmp_path / "kb"
+    (kb_dir / "indices").mkdir(parents=True)
+    cache = KBSearchCache(kb_dir=str(kb_dir))
+    assert cache.fingerprint is None
+    cache.validate()
+    assert cache.fingerprint is None
+
+    cache.put(KBSearchCache.make_key("module", "copy"), [])
+    assert cache.fingerprint
+    cache.validate()
+    assert cache.get(KBSearchCache.make_key("module", "copy")) == (True, [])
+
+    # the cached results are dropped when the KB data dir is updated
+    (kb_dir / "indices" / "modules.json").write_text("{}")
+    cache.validate()
+    assert cache.get(KBSearchCache.make_key("module", "copy")) == (False, None)
@@ -0,0 +1,22 @@
+from sage_scan.models import create_entrypoint_data_list
+from sage_scan.process.metrics import ProjectTable, compute_metrics_for_project
+
+
+def test_metrics_same_as_compute_metrics(project_factory):
+    for seed in range(3):
+        project = project_factory(seed=seed)
+        expected = create_entrypoint_data_list(project)
+        for data in expected:
+            data.compute_metrics()
+        actual = compute_metrics_for_project(project)
+        assert [data.metrics_to_json() for data in actual] == [data.metrics_to_json() for data in expected]
+
+
+def test_project_table_rows(project_factory):
+    project = project_factory(seed=0)
+    table = ProjectTable.from_project(project)
+    assert len(table.task_member_entrypoint) == len(table.task_member_row) == sum(len(data.tasks) for data in table.data_list)
+    # each task has only one row even if it appears in multiple entrypoints
+    assert len(table.task_keys) == len(table.task_filepath) == len(set(task.key for data in table.data_list for task in data.tasks))
+    for ep, row in zip(table.task_member_entrypoint, table.task_member_row):
+        assert table.task_keys.values[row] in [task.key for task in table.data_list[ep].tasks]
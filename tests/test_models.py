@@ -0,0 +1,81 @@
+import json
+from sage_scan.models import (
+    SageProject,
+    SageObjects,
+    Collection,
+    Playbook,
+    save_objects,
+    load_objects,
+    ModuleExample,
+    get_source_id_from_line,
+    iter_project_lines,
+    iter_projects,
+)
+
+
+def _make_project():
+    project = SageProject(source={"type": "GitHub-RHIBM", "repo_name": "test/repo"})
+    project.add_object(Collection(name="test.coll", key="collection collection:test.coll"))
+    project.add_object(Playbook(name="site.yml", key="playbook playbook:site.yml", filepath="site.yml"))
+    return project
+
+
+def test_add_collection_object():
+    project = _make_project()
+    collection = project.get_collection_by_fqcn("test.coll")
+    assert collection is not None
+    assert collection.name == "test.coll"
+
+
+def test_load_project_with_collection(tmp_path):
+    fpath = str(tmp_path / "objects.json")
+    save_objects(fpath, SageObjects(_projects=[_make_project()]))
+    project = load_objects(fpath).projects()[0]
+    assert project.get_collection_by_fqcn("test.coll") is not None
+    assert project.get_object(key="playbook playbook:site.yml") is not None
+
+
+def test_save_module_examples(tmp_path):
+    project = _make_project()
+    project.set_module_examples({"ansible.builtin.copy": "- copy:\n    src: a\n"})
+    # examples of the same module are added only once
+    project.set_module_examples({"ansible.builtin.copy": "- copy:\n    src: a\n"})
+    assert len(project.module_examples) == 1
+
+    fpath = str(tmp_path / "objects.json")
+    save_objects(fpath, SageObjects(_projects=[project]))
+    loaded = load_objects(fpath).projects()[0]
+    assert isinstance(loaded.module_examples[0], ModuleExample)
+    assert loaded.get_module_examples("ansible.builtin.copy") == "- copy:\n    src: a\n"
+    assert loaded.get_module_examples("ansible.builtin.unknown") == ""
+
+
+def test_iter_project_lines(tmp_path):
+    project_a = _make_project()
+    project_b = SageProject(source={"type": "GitHub-RHIBM", "repo_name": "test/other"})
+    project_b.add_object(Playbook(name="main.yml", key="playbook playbook:main.yml", filepath="main.yml", yaml_lines="- hosts: all  \n"))
+    for project in [project_a, project_b]:
+        for obj in project.objects():
+            obj.set_source(project.source)
+    fpath = str(tmp_path / "objects.json")
+    save_objects(fpath, SageObjects(_projects=[project_a, project_b]))
+    with open(fpath, "r") as file:
+        lines = file.readlines()
+    for line in lines:
+        assert get_source_id_from_line(line.encode("utf-8")) == json.loads(line)["source_id"]
+
+    # objects of project_a are split by an object of project_b
+    interleaved = [lines[0], lines[2], "\n", lines[1]]
+    with open(fpath, "w") as file:
+        file.write("".join(interleaved))
+    results = list(iter_project_lines(fpath))
+    source_ids = [json.dumps(project.source, separators=(",", ":")) for project in [project_a, project_b]]
+    assert [source_id for source_id, _ in results] == source_ids
+    assert results[0][1] == [lines[0], lines[1]]
+    assert results[1][1] == [lines[2]]
+
+    projects = list(iter_projects(fpath))
+    assert len(projects) == 2
+    assert projects[0].get_collection_by_fqcn("test.coll") is not None
+    assert projects[0].get_object(key="playbook playbook:site.yml") is not None
+    assert projects[1].get_object(key="playbook playbook:main.yml").yaml_lines == "- hosts: all  \n"
@@ -0,0 +1,132 @@
+import json
+import random
+from sage_scan.models import create_entrypoint_data_list
+from sage_scan.variable_container import (
+    AccumVarContBuilder,
+    ScopeChain,
+    VarCont,
+    check_if_defined,
+    check_if_defined_in,
+    get_set_vars_from_data,
+    get_used_vars_from_data,
+    get_undefined_vars_in_obj_from_data,
+    get_undefined_vars_value_from_data,
+    make_vc_arr,
+    resolve_variables,
+)
+
+
+# the linear scan which `check_if_defined_in()` replaces
+def _check_if_defined_by_scan(used_var, defined_vars):
+    for defined_var in defined_vars:
+        if check_if_defined(used_var, defined_var):
+            return True
+    return False
+
+
+def _random_var_name(rnd):
+    parts = [rnd.choice(["app", "app_port", "pkg", "conf", "item", "x"]) for _ in range(rnd.randint(1, 3))]
+    return ".".join(parts)
+
+
+def test_check_if_defined_in_scope_chain():
+    rnd = random.Random(0)
+    for _ in range(50):
+        chain = ScopeChain()
+        merged = {}
+        chains = [(chain, dict(merged))]
+        for _ in range(rnd.randint(1, 20)):
+            layer = {_random_var_name(rnd): i for i in range(rnd.randint(0, 5))}
+            chain = chain.push(layer)
+            merged |= layer
+            chains.append((chain, dict(merged)))
+        # check the chains in a random order so that some key sets are built from their parents
+        rnd.shuffle(chains)
+        for chain, merged in chains:
+            assert len(chain) == len(merged)
+            assert list(chain) == list(merged)
+            for _ in range(20):
+                used_var = _random_var_name(rnd)
+                assert (used_var in chain) == (used_var in merged)
+                assert check_if_defined_in(used_var, chain) == _check_if_defined_by_scan(used_var, merged)
+                assert check_if_defined_in(used_var, merged) == _check_if_defined_by_scan(used_var, merged)
+
+
+def _modify_nested(data):
+    if isinstance(data, dict):
+        for value in list(data.values()):
+            _modify_nested(value)
+        data["__modified__"] = True
+    elif isinstance(data, list):
+        for value in data:
+            _modify_nested(value)
+        data.append("__modified__")
+
+
+def test_cached_results_are_copied(project_factory):
+    project = project_factory(seed=0)
+    for pd in create_entrypoint_data_list(project, follow_include_for_used_vars=False):
+        expected = json.dumps(resolve_variables(pd), default=str)
+        getters = [
+            get_set_vars_from_data,
+            get_used_vars_from_data,
+            get_undefined_vars_in_obj_from_data,
+            get_undefined_vars_value_from_data,
+            resolve_variables,
+        ]
+        for getter in getters:
+            first = json.dumps(getter(pd), default=str)
+            _modify_nested(getter(pd))
+            assert json.dumps(getter(pd), default=str) == first
+        assert json.dumps(resolve_variables(pd), default=str) == expected
+
+
+# the parent search which `CallTreeIndex.get_parents()` replaces
+def _traverse_and_get_parents_by_scan(node_key, call_tree, parent_nodes):
+    sibling = []
+    for parent, child in call_tree:
+        key_parts = child.key.rsplit('#', 1)
+        n_key_parts = node_key.rsplit('#', 1)
+        if "task:" in key_parts[-1] and "task:" in n_key_parts[-1]:
+            num = int(key_parts[-1].replace("task:[", "").replace("]", ""))
+            n_num = int(n_key_parts[-1].replace("task:[", "").replace("]", ""))
+            if key_parts[0] == n_key_parts[0] and num < n_num:
+                sibling.insert(0, child.key)
+    for parent, child in call_tree:
+        if child.key == node_key:
+            parent_nodes.extend(sibling)
+            parent_nodes.append(parent.key)
+            _traverse_and_get_parents_by_scan(parent.key, call_tree, parent_nodes)
+            break
+    return parent_nodes
+
+
+# the accumulation which `AccumVarContBuilder` replaces; a new VarCont merges the vars of all the parents
+def _compute_accum_vc_by_merge(call_tree, vc_arr, obj_key, obj_filepath):
+    parents = _traverse_and_get_parents_by_scan(obj_key, call_tree, [])
+    accum_vc = VarCont()
+    for p in reversed(parents):
+        pvc = vc_arr[p]
+        if pvc.filepath != obj_filepath:
+            continue
+        accum_vc.accum(pvc)
+    return accum_vc
+
+
+def test_accum_vc_same_as_merged_parents(project_factory):
+    rnd = random.Random(0)
+    project = project_factory(seed=0)
+    for pd in create_entrypoint_data_list(project, follow_include_for_used_vars=False):
+        vc_arr = make_vc_arr(pd.call_seq)
+        # the shuffled call tree has siblings which are not sorted by the task index
+        for call_tree in [pd.call_tree, rnd.sample(pd.call_tree, len(pd.call_tree))]:
+            builder = AccumVarContBuilder.from_call_tree(call_tree, vc_arr)
+            filepaths = set(vc.filepath for vc in vc_arr.values())
+            # objects in a random order so that the cached scopes are reused in various ways
+            obj_keys = rnd.sample(list(vc_arr), len(vc_arr))
+            for obj_key in obj_keys:
+                for filepath in filepaths:
+                    expected = _compute_accum_vc_by_merge(call_tree, vc_arr, obj_key, filepath)
+                    accum_vc = builder.get_accum_vc(obj_key, filepath)
+                    for attr in ["set_explicit_scoped_vars", "set_scoped_vars", "used_vars"]:
+                        assert list(getattr(accum_vc, attr).items()) == list(getattr(expected, attr).items())
@@ -0,0 +1,134 @@
+import random
+import jsonpickle
+from sage_scan.models import Play, Task
+from sage_scan.process.variable_resolver import (
+    VariableResolver,
+    Variable,
+    VariableContext,
+    VariableHistory,
+    get_variables_in_loop,
+    make_loop_summary,
+    resolve_module_options,
+    template_module_options,
+)
+
+
+def _make_context():
+    context = VariableContext()
+    packages = ["nginx", "httpd", {"name": "git"}, "vim", ["a", "b"]]
+    context.add(Play(key="play playbook:site.yml#play:[0]", variables={"packages": packages, "state": "present"}))
+    return context
+
+
+def _make_task():
+    return Task(
+        key="task playbook:site.yml#play:[0]#task:[0]",
+        module="ansible.builtin.package",
+        module_options={"name": "{{ item }}", "state": "{{ state }}"},
+        loop={"item": "{{ packages }}"},
+    )
+
+
+# template all the loop items and then take the first ones, which is what `resolve_module_options()` did
+def _resolve_module_options_for_all_items(context, task, num_of_templated_items):
+    resolved_vars = []
+
+    def resolve(var_name):
+        resolved_var_val, v_type, _ = context.resolve_variable(var_name)
+        return resolved_var_val, v_type
+
+    variables_in_loop = get_variables_in_loop(task, resolve, resolved_vars)
+    resolved_opts_in_loop = []
+    for variables in variables_in_loop[:num_of_templated_items]:
+        resolved_opts_in_loop.append(template_module_options(task.module_options, variables, resolve, resolved_vars, {}))
+    loop_summary = None
+    if num_of_templated_items < len(variables_in_loop):
+        loop_summary = make_loop_summary(task, variables_in_loop, num_of_templated_items)
+    return resolved_opts_in_loop, resolved_vars, loop_summary
+
+
+def test_resolve_module_options_with_loop_limit():
+    for lazy_loop, max_loop_items, num_of_templated_items in [(False, 0, 6), (True, 0, 1), (False, 2, 2), (True, 3, 1), (False, 10, 6)]:
+        task = _make_task()
+        resolved_opts_in_loop, resolved_vars, _, _, loop_summary = resolve_module_options(
+            _make_context(), task, lazy_loop=lazy_loop, max_loop_items=max_loop_items
+        )
+        expected_opts, expected_vars, expected_summary = _resolve_module_options_for_all_items(_make_context(), task, num_of_templated_items)
+        assert len(resolved_opts_in_loop) == num_of_templated_items
+        assert resolved_opts_in_loop == expected_opts
+        assert resolved_vars == expected_vars
+        assert loop_summary == expected_summary
+        if num_of_templated_items < 6:
+            # the resolved list itself is also a loop item after its elements
+            assert loop_summary == {"num_of_items": 6, "num_of_templated_items": num_of_templated_items, "item_types": ["str", "dict", "list"]}
+
+
+def _make_history(log):
+    history = VariableHistory()
+    for var_name, variable in log:
+        history.append(var_name, variable)
+    return history
+
+
+def test_forked_variable_history():
+    rnd = random.Random(0)
+    # (history, the expected log as a list of (var_name, Variable))
+    histories = [(VariableHistory(), [])]
+    snapshots = []
+    for i in range(300):
+        history, log = rnd.choice(histories)
+        if rnd.random() < 0.1:
+            histories.append((history.fork(), list(log)))
+            continue
+        var_name = f"var{rnd.randint(0, 10)}"
+        history.append(var_name, Variable(name=var_name, value=i))
+        log.append((var_name, Variable(name=var_name, value=i)))
+        snapshots.append((history.snapshot(), list(log)))
+
+    # check the snapshots in a random order so that some digests are computed from the forked ones
+    snapshots += [(history.snapshot(), log) for history, log in histories]
+    rnd.shuffle(snapshots)
+    for snapshot, log in snapshots:
+        expected = _make_history(log).to_dict()
+        assert dict(snapshot) == expected
+        assert list(snapshot) == list(expected)
+        assert len(snapshot) == len(expected)
+        for var_name in [f"var{i}" for i in range(11)]:
+            assert (var_name in snapshot) == (var_name in expected)
+            if var_name in expected:
+                assert snapshot.first(var_name) == expected[var_name][0]
+                assert snapshot.last(var_name) == expected[var_name][-1]
+        assert snapshot.digest() == _make_history(log).snapshot().digest()
+    digests = set(snapshot.digest() for snapshot, _ in snapshots)
+    assert len(digests) == len(set(tuple((name, v.value) for name, v in log) for _, log in snapshots))
+
+
+def test_context_checkpoint():
+    context = _make_context()
+    context.module_defaults = {"ansible.builtin.package": {"state": "latest"}}
+    checkpoint = context.checkpoint()
+    checkpoint.module_defaults["ansible.builtin.package"] = {}
+    checkpoint.add(Play(key="play playbook:site.yml#play:[1]", variables={"state": "absent"}))
+    assert context.module_defaults == {"ansible.builtin.package": {"state": "latest"}}
+    assert [v.value for v in context.var_set_history.to_dict()["state"]] == ["present"]
+    assert [v.value for v in checkpoint.var_set_history.to_dict()["state"]] == ["present", "absent"]
+
+
+def _get_variable_annotations(project):
+    annotations = {}
+    for task in project.tasks:
+        annotations[task.key] = jsonpickle.encode(task.annotations, make_refs=False, unpicklable=False)
+    return annotations
+
+
+def test_resolve_all_vars_in_project_same_as_traverse(project_factory):
+    for seed in range(3):
+        # `traverse()` for each call sequence, which is what `resolve_all_vars_in_project()` did
+        expected_project = project_factory(seed=seed)
+        for call_seq in expected_project.get_all_call_sequences():
+            VariableResolver().traverse(call_seq=call_seq)
+        expected = _get_variable_annotations(expected_project)
+
+        project = VariableResolver().resolve_all_vars_in_project(project_factory(seed=seed))
+        assert _get_variable_annotations(project) == expected
+        assert any(annotations != "{}" for annotations in expected.values())